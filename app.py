@@ -9,14 +9,17 @@ from compute_stack.lambda_stack.lambda_construct import (
     SemiStructuredCurateDataLambdaStack,
     UnStructuredCurateDataLambdaStack,
     UnStructuredApplicationDataLambdaStack,
-    SnowflakeModelLambdaStack
+    SnowflakeModelLambdaStack,
+    CompactionLambdaStack,
+    ChunkedConversionLambdaStack
 )
 from compute_stack.glue_stack.glue_construct import (
     StructuredCurateDataGlueStack,
     StructuredApplicationDataGlueStack,
     SemiStructuredCurateDataGlueStack,
     UnStructuredCurateDataGlueStack,
-    UnStructuredApplicationDataGlueStack
+    UnStructuredApplicationDataGlueStack,
+    CompactionGlueStack
 )
 
 def check_env_vars(required_vars):
@@ -38,6 +41,8 @@ semi_structured_curated_lambda_stack = SemiStructuredCurateDataLambdaStack(app,
 unstructured_curated_lambda_stack = UnStructuredCurateDataLambdaStack(app, "unstructured-curated-lambda-stack")
 unstructured_application_lambda_stack = UnStructuredApplicationDataLambdaStack(app, "unstructured-application-lambda-stack")
 snowflake_model_claims_lambda_stack = SnowflakeModelLambdaStack(app, "snowflake-model-claims-lambda-stack")
+compaction_lambda_stack = CompactionLambdaStack(app, "compaction-lambda-stack")
+chunked_conversion_lambda_stack = ChunkedConversionLambdaStack(app, "chunked-conversion-lambda-stack")
 
 # Glue stacks
 structured_curated_glue_stack = StructuredCurateDataGlueStack(app, "structured-curated-glue-stack")
@@ -45,6 +50,7 @@ structured_application_glue_stack = StructuredApplicationDataGlueStack(app, "str
 semi_structured_curated_glue_stack = SemiStructuredCurateDataGlueStack(app, "semi-structured-curated-glue-stack")
 unstructured_curated_glue_stack = UnStructuredCurateDataGlueStack(app, "unstructured-curated-glue-stack")
 unstructured_application_glue_stack = UnStructuredApplicationDataGlueStack(app, "unstructured-application-glue-stack")
+compaction_glue_stack = CompactionGlueStack(app, "compaction-glue-stack")
 
 # Orchestration Step Function
 orchestration_stack = OrchestrationStack(
@@ -59,7 +65,12 @@ orchestration_stack = OrchestrationStack(
     semi_structured_curated_glue_stack.glue_job.name,
     unstructured_curated_glue_stack.glue_job.name,
     unstructured_application_glue_stack.glue_job.name,
-    snowflake_model_claims_lambda_stack.fn
+    snowflake_model_claims_lambda_stack.fn,
+    snowflake_model_claims_lambda_stack.load_status_fn,
+    chunked_conversion_lambda_stack.plan_fn,
+    chunked_conversion_lambda_stack.convert_fn,
+    chunked_conversion_lambda_stack.commit_fn,
+    env_name=deployment_env
 )
 
 # Lambda stack + bucket wiring
@@ -67,7 +78,8 @@ MetaLambdaStack(
     app,
     "meta-lambda-stack",
     orchestration_stack,
-    env_name=deployment_env
+    env_name=deployment_env,
+    dispatch_mode=os.environ.get("DISPATCH_MODE", "single")
 )
 
 # Build CloudFormation templates
@@ -0,0 +1,269 @@
+"""
+Synthetic claims generator for load testing.
+
+Rows follow FACT_CLAIMS (02_fact_structure.sql + BILLED_AMOUNT) with PATIENT_ID / PROVIDER_ID drawn
+from bounded dimension cardinalities. Everything is generated column-wise with NumPy and written
+through Arrow, one chunk at a time, so memory stays at one chunk whatever the target size.
+
+    python -m benchmark.claims_generator --size 100MB --format csv --out /tmp/lake
+    python -m benchmark.claims_generator --size 2GB --files 8 --workers 8 --format parquet --out s3://stage-bucket
+    python -m benchmark.claims_generator --size 1MB --format ndjson --null-rate 0.05 --skew 1.2 --out /tmp/lake
+
+Files land under the prefixes the state machine routes on:
+claims/type=structured/ for csv / parquet and claims/type=semi-structured/ for ndjson / json.
+"""
+import argparse
+import io
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import pyarrow as pa
+
+FORMAT_PREFIX = {
+    "csv": "claims/type=structured/",
+    "parquet": "claims/type=structured/",
+    "ndjson": "claims/type=semi-structured/",
+    "json": "claims/type=semi-structured/"
+}
+FORMAT_SUFFIX = {"csv": ".csv", "parquet": ".parquet", "ndjson": ".ndjson", "json": ".json"}
+
+# columns that may be null in source extracts
+NULLABLE_COLUMNS = ("paid_date", "amount_allowed", "coinsurance_amount", "deductible_amount", "paid_amount")
+
+SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*(B|KB|MB|GB|TB)?$", re.IGNORECASE)
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+
+class ClaimsConfig(NamedTuple):
+    patients: int = 1_000_000  # DIM_PATIENT cardinality
+    providers: int = 50_000  # DIM_PROVIDER cardinality
+    skew: float = 1.1  # Zipf exponent for patient / provider frequency, 0 = uniform
+    null_rate: float = 0.02  # share of nulls in NULLABLE_COLUMNS
+    start_date: date = date(2020, 1, 1)
+    days: int = 5 * 365
+    chunk_rows: int = 500_000
+
+
+DEFAULTS = ClaimsConfig()
+
+
+def parse_size(text: str) -> int:
+    match = SIZE_PATTERN.match(text.strip())
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[(match.group(2) or "B").upper()])
+
+
+@lru_cache(maxsize=8)
+def zipf_table(cardinality: int, skew: float) -> tuple:
+    """(cdf, keys by rank) of one key space .. built once per process, shared by every chunk."""
+    weights = 1.0 / np.power(np.arange(1, cardinality + 1, dtype=np.float64), skew)
+    cdf = np.cumsum(weights)
+    # hot keys should not simply be the lowest ids
+    keys = np.random.default_rng(cardinality).permutation(cardinality) + 1
+    cdf.flags.writeable = keys.flags.writeable = False
+    return cdf, keys
+
+
+def skewed_keys(rng, rows: int, cardinality: int, skew: float):
+    """Keys 1..cardinality with Zipf-like frequencies, drawn by inverse CDF in one vectorised pass."""
+    if skew <= 0:
+        return rng.integers(1, cardinality + 1, rows)
+    cdf, keys = zipf_table(cardinality, skew)
+    return keys[np.searchsorted(cdf, rng.random(rows) * cdf[-1])]
+
+
+def date_keys(days_since_epoch):
+    """yyyymmdd DIM_DATE keys for an array of day numbers."""
+    dates = days_since_epoch.astype("datetime64[D]")
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    months = dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    days = (dates - dates.astype("datetime64[M]")).astype(np.int64) + 1
+    return years * 10000 + months * 100 + days
+
+
+def with_nulls(rng, values, null_rate: float):
+    if null_rate <= 0:
+        return pa.array(values)
+    return pa.array(values, mask=rng.random(len(values)) < null_rate)
+
+
+def claims_chunk(rng, rows: int, first_claim_id: int, config: ClaimsConfig) -> pa.Table:
+    epoch_day = (config.start_date - date(1970, 1, 1)).days
+    service_days = epoch_day + rng.integers(0, config.days, rows)
+    paid_days = service_days + rng.integers(0, 60, rows)
+
+    billed = np.round(rng.lognormal(5.0, 1.0, rows), 2)
+    allowed = np.round(billed * rng.uniform(0.4, 1.0, rows), 2)
+    deductible = np.round(np.minimum(allowed, rng.choice([0.0, 0.0, 50.0, 250.0, 500.0], rows)), 2)
+    coinsurance = np.round((allowed - deductible) * rng.choice([0.0, 0.1, 0.2, 0.3], rows), 2)
+    paid = np.round(allowed - deductible - coinsurance, 2)
+
+    columns = {
+        "claim_id": pa.array(np.arange(first_claim_id, first_claim_id + rows, dtype=np.int64)),
+        "patient_id": pa.array(skewed_keys(rng, rows, config.patients, config.skew)),
+        "provider_id": pa.array(skewed_keys(rng, rows, config.providers, config.skew)),
+        "date_of_service": pa.array(date_keys(service_days)),
+        "paid_date": date_keys(paid_days),
+        "amount_allowed": allowed,
+        "billed_amount": pa.array(billed),
+        "coinsurance_amount": coinsurance,
+        "deductible_amount": deductible,
+        "paid_amount": paid
+    }
+    for name in NULLABLE_COLUMNS:
+        columns[name] = with_nulls(rng, columns[name], config.null_rate)
+    return pa.table(columns)
+
+
+class ChunkWriter:
+    """Write Arrow chunks as csv, ndjson, json (one array) or parquet to a binary sink."""
+
+    def __init__(self, sink, fmt: str, schema: pa.Schema):
+        self.sink = sink
+        self.fmt = fmt
+        self.writer = None
+        self.first = True
+        if fmt == "csv":
+            import pyarrow.csv as pv
+
+            self.writer = pv.CSVWriter(sink, schema)
+        elif fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(sink, schema)
+        elif fmt not in ("ndjson", "json"):
+            raise ValueError(f"Unknown format: {fmt}")
+
+    def write(self, table: pa.Table):
+        # pandas' C JSON encoder .. no per-row Python, nullable ints stay ints
+        if self.fmt == "ndjson":
+            self.sink.write(self.to_pandas(table).to_json(orient="records", lines=True).encode())
+        elif self.fmt == "json":
+            records = self.to_pandas(table).to_json(orient="records")[1:-1]
+            self.sink.write(("[" if self.first else ",").encode() + records.encode())
+        else:
+            self.writer.write_table(table)
+        self.first = False
+
+    @staticmethod
+    def to_pandas(table: pa.Table):
+        import pandas as pd
+
+        return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        elif self.fmt == "json":
+            self.sink.write(b"[]" if self.first else b"]")
+
+
+def open_sink(out: str, key: str):
+    if out.startswith("s3://"):
+        import boto3
+        from pipeline.s3_io import S3MultipartWriter
+
+        bucket, _, prefix = out[len("s3://"):].partition("/")
+        if prefix.strip("/"):
+            key = f"{prefix.strip('/')}/{key}"
+        return S3MultipartWriter(boto3.client("s3"), bucket, key)
+    path = Path(out) / key
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path, "wb")
+
+
+def write_claims(sink, fmt: str, target_bytes: int, config: ClaimsConfig = DEFAULTS, seed: int = 0,
+                 first_claim_id: int = 1) -> dict:
+    """Write chunks to sink until about target_bytes are written. Returns rows and bytes written."""
+    rng = np.random.default_rng(seed)
+    writer, rows, chunk_rows = None, 0, min(config.chunk_rows, 1000)
+
+    while sink.tell() < target_bytes:
+        chunk = claims_chunk(rng, chunk_rows, first_claim_id + rows, config)
+        writer = writer or ChunkWriter(sink, fmt, chunk.schema)
+        before = sink.tell()
+        writer.write(chunk)
+        rows += chunk_rows
+
+        # size the next chunk from the bytes per row observed so far
+        written = sink.tell() - before
+        if written:
+            remaining_rows = int((target_bytes - sink.tell()) / (written / chunk_rows)) + 1
+            chunk_rows = max(1, min(config.chunk_rows, remaining_rows))
+    if writer:
+        writer.close()
+    return {"rows": rows, "bytes": sink.tell()}
+
+
+def generate_bytes(fmt: str, size_bytes: int, config: ClaimsConfig = DEFAULTS, seed: int = 0) -> bytes:
+    """In-memory claims file of about size_bytes (benchmarks)."""
+    buffer = io.BytesIO()
+    write_claims(buffer, fmt, size_bytes, config, seed)
+    return buffer.getvalue()
+
+
+def generate_file(out: str, fmt: str, target_bytes: int, config: ClaimsConfig, seed: int, index: int) -> dict:
+    key = f"{FORMAT_PREFIX[fmt]}claims-{seed}-{index:05d}{FORMAT_SUFFIX[fmt]}"
+    sink = open_sink(out, key)
+    try:
+        # claim ids stay unique across files
+        result = write_claims(sink, fmt, target_bytes, config, seed * 100_003 + index, first_claim_id=index * 10 ** 10 + 1)
+    except Exception:
+        if hasattr(sink, "abort"):
+            sink.abort()
+        raise
+    sink.close()
+    return {"key": key, **result}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", required=True, help="total size, e.g. 1MB, 100MB, 2GB")
+    parser.add_argument("--format", choices=sorted(FORMAT_PREFIX), default="csv")
+    parser.add_argument("--out", required=True, help="local directory or s3://bucket[/prefix]")
+    parser.add_argument("--files", type=int, default=1, help="split the total size over this many files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes generating files in parallel")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--patients", type=int, default=DEFAULTS.patients)
+    parser.add_argument("--providers", type=int, default=DEFAULTS.providers)
+    parser.add_argument("--skew", type=float, default=DEFAULTS.skew)
+    parser.add_argument("--null-rate", type=float, default=DEFAULTS.null_rate)
+    parser.add_argument("--start-date", type=date.fromisoformat, default=DEFAULTS.start_date)
+    parser.add_argument("--days", type=int, default=DEFAULTS.days)
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULTS.chunk_rows)
+    args = parser.parse_args(argv)
+
+    # the s3 sink lives in the shared pipeline package
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "shared"))
+
+    config = ClaimsConfig(args.patients, args.providers, args.skew, args.null_rate, args.start_date, args.days, args.chunk_rows)
+    per_file = parse_size(args.size) // args.files
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, args.files))) as executor:
+        futures = [
+            executor.submit(generate_file, args.out, args.format, per_file, config, args.seed, index)
+            for index in range(args.files)
+        ]
+        results = [future.result() for future in futures]
+    seconds = time.perf_counter() - started
+
+    total_bytes = sum(result["bytes"] for result in results)
+    total_rows = sum(result["rows"] for result in results)
+    for result in results:
+        print(f"{result['key']}: {result['rows']} rows, {result['bytes']} bytes")
+    print(f"{total_rows} rows, {total_bytes / 1024 ** 2:.1f} MB in {seconds:.1f}s ({total_bytes / 1024 ** 2 / seconds:.1f} MB/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Date key derivation (src/shared/pipeline/date_keys.py) against a pandas Series.apply baseline.
+
+    python -m benchmark.date_keys
+    python -m benchmark.date_keys --rows 1000000 --mix "%Y-%m-%d=0.5,%m/%d/%Y=0.5" --output /tmp/date_keys.json
+
+Rows are random service dates written in a mix of formats, plus nulls. The formats of the mix are the column's
+declared formats: Arrow parses with them (overlapping ones read every value to find the ambiguous ones), pandas
+applies a per row datetime.strptime over the same formats with the same ambiguity rule.
+--baseline-rows runs pandas on the first rows only (it takes minutes at 10M). Arrow keys are checked against the
+keys the dates were generated from (ambiguous rows, reported as unparsedRows, are null), pandas against Arrow.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src" / "shared"))
+
+from benchmark.claims_generator import date_keys as expected_keys  # noqa: E402
+from pipeline import date_keys  # noqa: E402
+
+DEFAULT_MIX = "%Y-%m-%d=0.6,%Y%m%d=0.2,%m/%d/%Y=0.15,%d-%b-%Y=0.05"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for entry in text.split(","):
+        date_format, share = entry.rsplit("=", 1)
+        mix[date_format] = float(share)
+    return mix
+
+
+def mixed_dates(rows: int, mix: dict, null_rate: float, seed: int = 0) -> tuple:
+    """(text dates, expected int64 keys) .. every row's format drawn from mix."""
+    rng = np.random.default_rng(seed)
+    epoch_day = (date(2015, 1, 1) - date(1970, 1, 1)).days
+    days = epoch_day + rng.integers(0, 10 * 365, rows)
+    nulls = rng.random(rows) < null_rate
+    shares = np.array(list(mix.values()))
+    choice = rng.choice(len(mix), size=rows, p=shares / shares.sum())
+
+    timestamps = pa.array(days.astype(np.int32), pa.date32()).cast(pa.timestamp("s"))
+    text = pa.nulls(rows, pa.string())
+    for index, date_format in enumerate(mix):
+        mask = pa.array((choice == index) & ~nulls)
+        text = pc.replace_with_mask(text, mask, pc.strftime(timestamps.filter(mask), format=date_format))
+    return text, pa.array(expected_keys(days), mask=nulls)
+
+
+def pandas_keys(series, formats):
+    """The row by row baseline .. the key every format that parses agrees on, None when they differ."""
+    def parse_one(text):
+        if not isinstance(text, str):
+            return None
+        keys = set()
+        for date_format in formats:
+            try:
+                parsed = datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            keys.add(parsed.year * 10000 + parsed.month * 100 + parsed.day)
+        return keys.pop() if len(keys) == 1 else None
+
+    return series.apply(parse_one)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--baseline-rows", type=int, help="rows for the pandas baseline (default --rows)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="format=share, comma separated")
+    parser.add_argument("--null-rate", type=float, default=0.02)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    formats = tuple(mix)
+    text, expected = mixed_dates(args.rows, mix, args.null_rate)
+    print(f"{args.rows} rows, {text.nbytes / 1024 ** 2:.1f} MB of text")
+
+    keys, arrow_seconds = timed(date_keys.date_keys, text, formats)
+
+    baseline_rows = min(args.baseline_rows or args.rows, args.rows)
+    series = text.slice(0, baseline_rows).to_pandas()
+    baseline, pandas_seconds = timed(pandas_keys, series, formats)
+    baseline = pa.array(baseline.astype("Int64"), pa.int64())
+    # text dates without a key .. ambiguous under the declared formats when the mix has overlapping ones
+    unparsed = pc.sum(pc.and_(pc.is_valid(expected), pc.is_null(keys))).as_py() or 0
+
+    results = {
+        "rows": args.rows,
+        "mix": args.mix,
+        "formats": list(formats),
+        "overlapping": sorted(date_keys.overlapping(formats)),
+        "arrowSeconds": round(arrow_seconds, 3),
+        "arrowRowsPerSecond": round(args.rows / arrow_seconds),
+        "pandasRows": baseline_rows,
+        "pandasSeconds": round(pandas_seconds, 3),
+        "pandasRowsPerSecond": round(baseline_rows / pandas_seconds),
+        "unparsedRows": unparsed,
+        "arrowMatches": keys.equals(pc.if_else(pc.is_null(keys), pa.scalar(None, pa.int64()), expected)),
+        "pandasMatches": baseline.equals(keys.slice(0, baseline_rows))
+    }
+    results["speedup"] = round(results["arrowRowsPerSecond"] / results["pandasRowsPerSecond"], 1)
+
+    print(f"arrow   {args.rows} rows {arrow_seconds:8.3f}s  {results['arrowRowsPerSecond']:>12,} rows/s")
+    print(f"pandas  {baseline_rows} rows {pandas_seconds:8.3f}s  {results['pandasRowsPerSecond']:>12,} rows/s")
+    print(f"speedup {results['speedup']}x, formats {results['formats']}, {unparsed} unparsed, "
+          f"matches arrow {results['arrowMatches']} pandas {results['pandasMatches']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if results["arrowMatches"] and results["pandasMatches"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
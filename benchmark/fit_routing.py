@@ -0,0 +1,141 @@
+"""
+Fit the routing table (src/shared/pipeline/routing_table.json) from recorded runs.
+
+Inputs are benchmark/handlers.py result files and / or measurement files exported from real runs
+(CloudWatch REPORT lines, Glue job run history) as a JSON list of
+{"route": "stage/structured", "engine": "glue", "sizeBytes": 123, "seconds": 4.2, "peakMemoryMB": 900}.
+
+    python -m benchmark.fit_routing benchmark/results/20260101T000000Z.json --write
+    python -m benchmark.fit_routing measurements.json --replay
+
+Per route and engine, seconds and peak memory are fitted as a straight line over input size.
+Routes / engines without at least two distinct sizes keep their current figures.
+"""
+import argparse
+import copy
+import json
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src" / "shared"))
+
+from pipeline import routing  # noqa: E402
+
+MB = 1024 * 1024
+
+# benchmark handler -> (route, engine)
+HANDLER_ROUTES = {
+    "curate-structured": ("stage/structured", "lambda"),
+    "curate-structured-streaming": ("stage/structured", "streaming"),
+    "application-structured": ("curated/structured", "lambda"),
+    "curate-semi-structured": ("stage/semi-structured", "lambda"),
+    "curate-semi-structured-streaming": ("stage/semi-structured", "streaming"),
+    "curate-unstructured": ("stage/unstructured", "lambda"),
+    "application-unstructured": ("curated/unstructured", "lambda")
+}
+
+
+def load_measurements(paths: list) -> list:
+    measurements = []
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            measurements.extend(data)
+            continue
+        # benchmark/handlers.py result file
+        for result in data["results"]:
+            if result["handler"] not in HANDLER_ROUTES or result.get("error"):
+                continue
+            route, engine = HANDLER_ROUTES[result["handler"]]
+            measurements.append({
+                "route": route,
+                "engine": engine,
+                "sizeBytes": result["inputBytes"],
+                # a cold container pays the imports before the first byte
+                "seconds": result["wallSeconds"] + result["importSeconds"],
+                # moto holds source and destination objects in the same process .. its peak RSS
+                # overstates the handler, memory is only fitted from real runs
+                "peakMemoryMB": None
+            })
+    return measurements
+
+
+def fit_line(sizes_mb, values):
+    slope, intercept = np.polyfit(np.asarray(sizes_mb, dtype=float), np.asarray(values, dtype=float), 1)
+    return float(intercept), float(slope)
+
+
+def fit(table: dict, measurements: list) -> dict:
+    fitted = copy.deepcopy(table)
+    grouped = defaultdict(list)
+    for measurement in measurements:
+        grouped[(measurement["route"], measurement["engine"])].append(measurement)
+
+    for (route, engine), group in sorted(grouped.items()):
+        sizes_mb = [m["sizeBytes"] / MB for m in group]
+        if len(set(sizes_mb)) < 2:
+            print(f"{route} {engine}: fewer than two distinct sizes, kept")
+            continue
+        figures = fitted["routes"].setdefault(route, {}).setdefault(engine, {})
+
+        startup, seconds_per_mb = fit_line(sizes_mb, [m["seconds"] for m in group])
+        figures["startupSeconds"] = round(max(startup, 0.0), 3)
+        figures["throughputMBps"] = round(1 / max(seconds_per_mb, 1e-6), 2)
+
+        memory = [m.get("peakMemoryMB") for m in group]
+        if None not in memory:
+            base, per_mb = fit_line(sizes_mb, memory)
+            figures["baseMemoryMB"] = round(max(base, 0.0), 1)
+            figures["memoryPerMB"] = round(max(per_mb, 0.0), 3)
+        print(f"{route} {engine}: {json.dumps(figures)}")
+    return fitted
+
+
+def replay(table: dict, measurements: list):
+    """Predicted vs measured seconds for every recorded run, plus the engine routing would pick."""
+    print(f"{'route':<24}{'engine':<11}{'MB':>9}{'measured s':>12}{'predicted s':>13}{'error':>8}  decision")
+    for m in sorted(measurements, key=lambda m: (m["route"], m["engine"], m["sizeBytes"])):
+        figures = table["routes"].get(m["route"], {}).get(m["engine"])
+        if figures is None:
+            continue
+        predicted = routing.predict_seconds(figures, m["sizeBytes"])
+        layer, data_format = m["route"].split("/", 1)
+        suffix = ".ndjson" if m["engine"] == "streaming" and data_format == "semi-structured" else ".csv"
+        decision = routing.decide(layer, f"claims/type={data_format}/replay{suffix}", m["sizeBytes"], table)
+        error = (predicted - m["seconds"]) / m["seconds"] if m["seconds"] else 0.0
+        print(f"{m['route']:<24}{m['engine']:<11}{m['sizeBytes'] / MB:>9.1f}{m['seconds']:>12.3f}"
+              f"{predicted:>13.3f}{error:>8.0%}  {decision.engine if decision else '-'}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("measurements", nargs="+", help="benchmark result or measurement files")
+    parser.add_argument("--table", default=str(routing.DEFAULT_TABLE_PATH))
+    parser.add_argument("--write", action="store_true", help="write the fitted table back to --table")
+    parser.add_argument("--replay", action="store_true", help="compare the table against the measurements, no fit")
+    args = parser.parse_args(argv)
+
+    table = routing.load_routing_table(args.table)
+    measurements = load_measurements(args.measurements)
+
+    if args.replay:
+        replay(table, measurements)
+        return 0
+
+    fitted = fit(table, measurements)
+    if args.write:
+        with open(args.table, "w") as f:
+            json.dump(fitted, f, indent=2)
+            f.write("\n")
+        print(f"routing table written to {args.table}")
+    replay(fitted, measurements)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
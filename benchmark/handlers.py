@@ -0,0 +1,375 @@
+"""
+Benchmark every pipeline Lambda entry point in-process against a moto S3 stand-in.
+
+    python -m benchmark.handlers
+    python -m benchmark.handlers --handlers curate-structured,curate-structured-streaming --sizes 16,256
+    python -m benchmark.handlers --baseline benchmark/results/<previous>.json
+
+Each case runs in a fresh interpreter so import time and peak RSS belong to that case alone.
+S3 API time is measured per operation through botocore events, the rest of the wall time is compute.
+Note that moto keeps objects in the same process, so RSS includes the input and output objects.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SHARED_PATH = REPO_ROOT / "src" / "shared"
+RESULTS_PATH = REPO_ROOT / "benchmark" / "results"
+
+STAGE_BUCKET = "stage-datalake-benchmark"
+CURATED_BUCKET = "curated-datalake-benchmark"
+APPLICATION_BUCKET = "application-datalake-benchmark"
+
+MB = 1024 * 1024
+
+# input "csv" / "json" / "ndjson" / "binary" sweep --sizes (MB), "records" / "paths" sweep --counts
+HANDLERS = {
+    "metadata": {
+        "path": "src/_lambda_/process_meta_data/metadata.py", "entry": "handler", "input": "records"
+    },
+    "curate-structured": {
+        "path": "src/_lambda_/curate_layer/process_structured_data/structured.py", "entry": "handler",
+        "input": "csv", "source": STAGE_BUCKET, "dest": CURATED_BUCKET, "engine": "in-memory"
+    },
+    "curate-structured-streaming": {
+        "path": "src/_lambda_/curate_layer/process_structured_data/structured.py", "entry": "handler",
+        "input": "csv", "source": STAGE_BUCKET, "dest": CURATED_BUCKET, "engine": "streaming"
+    },
+    "application-structured": {
+        "path": "src/_lambda_/application_layer/process_structured_data/structured.py", "entry": "handler",
+        "input": "csv", "source": CURATED_BUCKET, "dest": APPLICATION_BUCKET
+    },
+    "curate-semi-structured": {
+        "path": "src/_lambda_/curate_layer/process_semi_structured_data/semi_structured.py", "entry": "handler",
+        "input": "json", "source": STAGE_BUCKET, "dest": CURATED_BUCKET, "engine": "in-memory"
+    },
+    "curate-semi-structured-streaming": {
+        "path": "src/_lambda_/curate_layer/process_semi_structured_data/semi_structured.py", "entry": "handler",
+        "input": "ndjson", "source": STAGE_BUCKET, "dest": CURATED_BUCKET, "engine": "streaming"
+    },
+    "curate-unstructured": {
+        "path": "src/_lambda_/curate_layer/process_unstructured_data/unstructured.py", "entry": "handler",
+        "input": "binary", "source": STAGE_BUCKET, "dest": CURATED_BUCKET
+    },
+    "application-unstructured": {
+        "path": "src/_lambda_/application_layer/process_unstructured_data/unstructured.py", "entry": "handler",
+        "input": "binary", "source": CURATED_BUCKET, "dest": APPLICATION_BUCKET
+    },
+    "snowflake-model": {
+        "path": "src/_lambda_/ingest_data_model/model.py", "entry": "lambda_handler", "input": "paths"
+    },
+    # files are submitted first (untimed), the stub loads them after loadSeconds
+    "snowflake-load-status": {
+        "path": "src/_lambda_/ingest_data_model/model.py", "entry": "load_status_handler", "input": "paths",
+        "submit": "lambda_handler", "loadSeconds": 1.0
+    }
+}
+
+COUNT_INPUTS = ("records", "paths")
+DATASET_PREFIX = {
+    "csv": "claims/type=structured/",
+    "json": "claims/type=semi-structured/",
+    "ndjson": "claims/type=semi-structured/",
+    "binary": "claims/type=unstructured/"
+}
+SUFFIX = {"csv": ".csv", "json": ".json", "ndjson": ".ndjson", "binary": ".bin"}
+
+
+def make_input(kind: str, size_bytes: int) -> bytes:
+    if kind == "binary":
+        return os.urandom(size_bytes)
+    from benchmark.claims_generator import generate_bytes
+
+    return generate_bytes(kind, size_bytes)
+
+
+class PhaseTimer:
+    """Wall time and call count per AWS API operation, collected through botocore events."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def attach(self, client):
+        client.meta.events.register("before-call", self.before_call)
+        client.meta.events.register("after-call", self.after_call)
+
+    def before_call(self, model, context, **kwargs):
+        context["benchmark_start"] = time.perf_counter()
+
+    def after_call(self, model, context, **kwargs):
+        started = context.pop("benchmark_start", None)
+        if started is not None:
+            self.seconds[model.name] += time.perf_counter() - started
+            self.calls[model.name] += 1
+
+
+def reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_handler(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(f"benchmark_{name.replace('-', '_')}", REPO_ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_state_machine():
+    import boto3
+
+    # the metadata handler reads STATE_MACHINE_ARN at import
+    step_functions = boto3.client("stepfunctions")
+    os.environ["STATE_MACHINE_ARN"] = step_functions.create_state_machine(
+        name="benchmark-state-machine",
+        definition=json.dumps({"StartAt": "Done", "States": {"Done": {"Type": "Succeed"}}}),
+        roleArn="arn:aws:iam::123456789012:role/benchmark"
+    )["stateMachineArn"]
+
+
+def prepare_metadata(s3, count: int) -> dict:
+    records = []
+    for i in range(count):
+        key = f"claims/type=structured/benchmark-{i}.csv"
+        s3.put_object(Bucket=STAGE_BUCKET, Key=key, Body=b"claim_id\n1\n", ContentType="text/csv")
+        records.append({"s3": {"bucket": {"name": STAGE_BUCKET}, "object": {"key": key}}})
+    return {"Records": records}
+
+
+def prepare_snowflake(count: int, stack: list, load_seconds: float = 0.0) -> dict:
+    import base64
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from benchmark.snowpipe_stub import SnowpipeStub
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    stub = SnowpipeStub(load_seconds=load_seconds).__enter__()
+    stack.append(stub)
+    os.environ.update({
+        "SNOWFLAKE_ACCOUNT": "benchmark",
+        "SNOWFLAKE_USER": "benchmark",
+        "SNOWFLAKE_PRIVATE_KEY": base64.b64encode(private_key).decode(),
+        "SNOWFLAKE_PIPE": json.dumps({"FACT_CLAIMS": "BENCHMARK_MODEL_CLAIMS_FACT_PIPE"}),
+        "SNOWFLAKE_BASE_URL": stub.base_url
+    })
+    return {"files": [{"objectKey": f"claims/model/fact/benchmark-{i}.parquet"} for i in range(count)]}
+
+
+def prepare_object(s3, spec: dict, size_bytes: int) -> dict:
+    kind = spec["input"]
+    body = make_input(kind, size_bytes)
+    key = f"{DATASET_PREFIX[kind]}benchmark{SUFFIX[kind]}"
+    content_type = {"csv": "text/csv", "binary": "binary/octet-stream"}.get(kind, "application/json")
+    s3.put_object(Bucket=spec["source"], Key=key, Body=body, ContentType=content_type)
+
+    event = {
+        "bucketName": spec["source"],
+        "bucketNameLower": spec["source"].lower(),
+        "objectKey": key,
+        "contentType": content_type,
+        "fileSize": len(body),
+        "destBucket": spec["dest"],
+        "destPrefix": "benchmark/"
+    }
+    if spec.get("engine"):
+        event["engine"] = spec["engine"]
+    return event
+
+
+def run_case(case: dict) -> dict:
+    """Run one handler / size case .. called in a fresh interpreter."""
+    import boto3
+    from moto import mock_aws
+
+    os.environ.update({
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "CURATED_BUCKET": CURATED_BUCKET,
+        "APPLICATION_BUCKET": APPLICATION_BUCKET
+    })
+    sys.path.insert(0, str(SHARED_PATH))
+    sys.path.insert(0, str(REPO_ROOT))
+    spec = HANDLERS[case["handler"]]
+    stack = []
+
+    with mock_aws():
+        s3 = boto3.client("s3")
+        for bucket in (STAGE_BUCKET, CURATED_BUCKET, APPLICATION_BUCKET):
+            s3.create_bucket(Bucket=bucket)
+
+        if spec["input"] == "records":
+            create_state_machine()
+
+        # handlers build their boto3 clients on first use (pipeline.runtime) .. time every API call
+        from pipeline import runtime
+
+        timer = PhaseTimer()
+        runtime.CLIENT_HOOKS.append(lambda service_name, client: timer.attach(client))
+
+        # import before generating input so the handler pays for its own imports
+        started = time.perf_counter()
+        module = load_handler(case["handler"], spec["path"])
+        import_seconds = time.perf_counter() - started
+
+        if spec["input"] == "records":
+            event = prepare_metadata(s3, case["count"])
+        elif spec["input"] == "paths":
+            event = prepare_snowflake(case["count"], stack, spec.get("loadSeconds", 0.0))
+        else:
+            event = prepare_object(s3, spec, case["sizeMB"] * MB)
+
+        context = types.SimpleNamespace(aws_request_id="benchmark", function_name=case["handler"])
+        if spec.get("submit"):
+            event = getattr(module, spec["submit"])(event, context)
+        reset_peak_rss()
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        response = getattr(module, spec["entry"])(event, context)
+        wall_seconds = time.perf_counter() - started
+        peak = peak_rss_mb()
+
+        for item in stack:
+            item.__exit__(None, None, None)
+
+    result = {
+        **case,
+        "importSeconds": round(import_seconds, 4),
+        "wallSeconds": round(wall_seconds, 4),
+        "phases": {name: round(seconds, 4) for name, seconds in sorted(timer.seconds.items())},
+        "calls": dict(sorted(timer.calls.items())),
+        "computeSeconds": round(max(wall_seconds - sum(timer.seconds.values()), 0.0), 4),
+        "peakRssMB": round(peak, 1),
+        "rssGrowthMB": round(peak - rss_before, 1),
+        "statusCode": response.get("statusCode") if isinstance(response, dict) else None
+    }
+    if "sizeMB" in case:
+        result["inputBytes"] = event["fileSize"]
+        result["throughputMBps"] = round(event["fileSize"] / MB / wall_seconds, 2)
+    else:
+        result["itemsPerSecond"] = round(case["count"] / wall_seconds, 1)
+    return result
+
+
+def case_id(result: dict) -> str:
+    return f"{result['handler']}@{result.get('sizeMB', result.get('count'))}"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """Cases whose wall time or peak RSS grew by more than threshold against the baseline run."""
+    previous = {case_id(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(case_id(result))
+        if not before or "error" in result or "error" in before:
+            continue
+        for metric in ("wallSeconds", "peakRssMB"):
+            if before[metric] and result[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{case_id(result)} {metric}: {before[metric]} -> {result[metric]}")
+    return regressions
+
+
+def spawn_case(case: dict) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json") as result_file:
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmark.handlers", "--run-case", json.dumps(case), "--result-file", result_file.name],
+            cwd=REPO_ROOT, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            return {**case, "error": completed.stderr.strip().splitlines()[-1] if completed.stderr else "failed"}
+        with open(result_file.name) as f:
+            return json.load(f)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", default=",".join(HANDLERS), help="comma separated handler names")
+    parser.add_argument("--sizes", default="1,16,64", help="input sizes in MB for object handlers")
+    parser.add_argument("--counts", default="1,100,1000", help="records / files for the metadata and model handlers")
+    parser.add_argument("--output", help="result JSON path (default benchmark/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative growth before a regression")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        with open(args.result_file, "w") as f:
+            json.dump(run_case(json.loads(args.run_case)), f)
+        return 0
+
+    cases = []
+    for name in args.handlers.split(","):
+        if HANDLERS[name]["input"] in COUNT_INPUTS:
+            cases += [{"handler": name, "count": int(count)} for count in args.counts.split(",")]
+        else:
+            cases += [{"handler": name, "sizeMB": int(size)} for size in args.sizes.split(",")]
+
+    results = []
+    for case in cases:
+        result = spawn_case(case)
+        results.append(result)
+        if "error" in result:
+            print(f"{case_id(result):45} ERROR {result['error']}")
+        else:
+            rate = f"{result['throughputMBps']:>8} MB/s" if "throughputMBps" in result else f"{result['itemsPerSecond']:>8} /s"
+            print(f"{case_id(result):45} {result['wallSeconds']:>8}s {rate} peak {result['peakRssMB']:>7} MB")
+
+    report = {
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "gitCommit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results
+    }
+    output = Path(args.output) if args.output else RESULTS_PATH / f"{time.strftime('%Y%m%dT%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"results written to {output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
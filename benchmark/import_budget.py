@@ -0,0 +1,186 @@
+"""
+Import time budget for every Lambda image.
+
+    python -m benchmark.import_budget
+    python -m benchmark.import_budget --handlers curate_layer/process_structured_data --repeat 10 --output /tmp/imports.json
+
+Each src/_lambda_/**/Dockerfile is parsed for its CMD entry module and the paths it COPYs (handler file,
+shared pipeline package). The entry module is then imported in a fresh interpreter laid out like
+LAMBDA_TASK_ROOT, --repeat times, and the median import time is checked against import_budgets.json.
+A handler also fails when a module listed under forbiddenModules ends up in sys.modules after import.
+The heaviest top level imports come from one extra `python -X importtime` run.
+
+Exit code 1 when any handler is over budget, so CI can gate dependency additions.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+LAMBDA_ROOT = REPO_ROOT / "src" / "_lambda_"
+BUDGETS_PATH = Path(__file__).with_name("import_budgets.json")
+
+IMPORT_SCRIPT = """
+import importlib, json, sys, time
+sys.stderr.write("{marker}\\n")
+started = time.perf_counter()
+importlib.import_module({module!r})
+elapsed = time.perf_counter() - started
+print(json.dumps({{"importMs": elapsed * 1000, "modules": sorted(sys.modules)}}))
+"""
+
+# written to stderr right before the import .. -X importtime lines above it are interpreter startup
+MARKER = "-- import --"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_dockerfile(path: Path) -> dict:
+    """Entry module, handler function and copied paths of one Lambda image."""
+    copies, cmd = [], None
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if line.startswith("COPY "):
+            parts = line.split()[1:]
+            copies.append((parts[:-1], parts[-1]))
+        elif line.startswith("CMD "):
+            cmd = json.loads(line[4:])[0]
+    if cmd is None:
+        raise ValueError(f"No CMD in {path}")
+
+    sources = [source for sources, _ in copies for source in sources]
+    # images that copy shared/ are built with src/ as context (see the compute stacks)
+    context = REPO_ROOT / "src" if any(s.startswith(("_lambda_/", "shared/")) for s in sources) else path.parent
+    module, function = cmd.rsplit(".", 1)
+    entry = next((source for source in sources if Path(source).name == f"{module}.py"), None)
+    if entry is None:
+        raise ValueError(f"{path} does not COPY {module}.py")
+
+    requirements = next((context / source for source in sources if source.endswith("requirements.txt")), None)
+    return {
+        "handler": str(path.parent.relative_to(LAMBDA_ROOT)),
+        "module": module,
+        "function": function,
+        "entryPath": str((context / entry).parent),
+        "shared": "shared/" in sources,
+        "requirements": [line.split("==")[0].strip() for line in requirements.read_text().splitlines()
+                         if line.strip() and not line.startswith("#")] if requirements else []
+    }
+
+
+def task_root_path(image: dict) -> str:
+    paths = [image["entryPath"]]
+    if image["shared"]:
+        paths.append(str(REPO_ROOT / "src" / "shared"))
+    return os.pathsep.join(paths)
+
+
+def run_import(image: dict, importtime: bool = False) -> subprocess.CompletedProcess:
+    env = {
+        **os.environ,
+        "PYTHONPATH": task_root_path(image),
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+        "METRICS_ENABLED": "false"
+    }
+    # -s: no user site-packages, the image only has what its requirements install
+    command = [sys.executable, "-s"]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", IMPORT_SCRIPT.format(module=image["module"], marker=MARKER)]
+    # run outside the repo so nothing but the task root is importable
+    return subprocess.run(command, env=env, cwd="/", capture_output=True, text=True)
+
+
+def heaviest_imports(stderr: str, top: int) -> list:
+    """Top level packages by cumulative import time (microseconds -> ms)."""
+    totals = {}
+    for line in stderr.split(MARKER, 1)[-1].splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) <= 1:
+            name = match.group(4).split(".")[0]
+            totals[name] = totals.get(name, 0) + int(match.group(2))
+    return [{"module": name, "cumulativeMs": round(us / 1000, 1)}
+            for name, us in sorted(totals.items(), key=lambda item: -item[1])[:top]]
+
+
+def measure(image: dict, repeat: int, top: int) -> dict:
+    runs = []
+    modules = []
+    for _ in range(repeat):
+        completed = run_import(image)
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()[-1] if completed.stderr else "failed"
+            return {**image, "error": error}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        runs.append(result["importMs"])
+        modules = result["modules"]
+
+    return {
+        **image,
+        "importMs": round(statistics.median(runs), 1),
+        "minImportMs": round(min(runs), 1),
+        "moduleCount": len(modules),
+        "modules": modules,
+        "heaviest": heaviest_imports(run_import(image, importtime=True).stderr, top)
+    }
+
+
+def check(result: dict, budgets: dict) -> list:
+    """Budget violations of one measured handler."""
+    if "error" in result:
+        return [f"{result['handler']}: import failed .. {result['error']}"]
+
+    budget = {**budgets.get("defaults", {}), **budgets.get("handlers", {}).get(result["handler"], {})}
+    violations = []
+    if result["importMs"] > budget.get("importMs", float("inf")):
+        violations.append(f"{result['handler']}: import {result['importMs']} ms > budget {budget['importMs']} ms")
+
+    loaded = {name.split(".")[0] for name in result["modules"]}
+    for name in budget.get("forbiddenModules", []):
+        if name in loaded:
+            violations.append(f"{result['handler']}: imports {name} at module load")
+    return violations
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", help="comma separated handler directories under src/_lambda_ (default all)")
+    parser.add_argument("--budgets", default=str(BUDGETS_PATH))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports reported per handler")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+
+    images = [parse_dockerfile(path) for path in sorted(LAMBDA_ROOT.glob("**/Dockerfile"))]
+    if args.handlers:
+        selected = set(args.handlers.split(","))
+        images = [image for image in images if image["handler"] in selected]
+
+    results, violations = [], []
+    for image in images:
+        result = measure(image, args.repeat, args.top)
+        results.append(result)
+        violations += check(result, budgets)
+        heaviest = ", ".join(f"{entry['module']} {entry['cumulativeMs']}" for entry in result.get("heaviest", []))
+        print(f"{result['handler']:<48}{result.get('importMs', 'error'):>9} ms  {heaviest}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": [{k: v for k, v in r.items() if k != "modules"} for r in results],
+                       "violations": violations}, f, indent=2)
+
+    for violation in violations:
+        print(f"OVER BUDGET {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Compare the Parquet writer profiles (src/shared/pipeline/parquet_profile.py) on synthetic claims.
+
+    python -m benchmark.parquet_profiles --size 256MB
+    python -m benchmark.parquet_profiles --size 64MB --profiles default,claims --output /tmp/profiles.json
+
+Per profile: write time, file size, row groups, and how many row groups min/max statistics leave
+to scan for a one month date_of_service filter and a 1% claim_id range.
+"""
+import argparse
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src" / "shared"))
+
+from benchmark.claims_generator import claims_chunk, parse_size, DEFAULTS  # noqa: E402
+from pipeline import parquet_profile, schema_registry  # noqa: E402
+
+
+def claims_table(size_bytes: int, seed: int = 0) -> pa.Table:
+    """Conformed claims (declared types) of about size_bytes in memory."""
+    import numpy as np
+
+    def conformed(rows):
+        return schema_registry.conform_arrow(claims_chunk(rng, rows, 1, DEFAULTS), schema_registry.CLAIMS_COLUMNS)
+
+    rng = np.random.default_rng(seed)
+    sample = conformed(10_000)
+    return conformed(max(1, int(size_bytes / (sample.nbytes / sample.num_rows))))
+
+
+def row_groups_to_scan(metadata, column: str, low, high) -> int:
+    """Row groups whose min/max range overlaps [low, high] .. what a reader has to open."""
+    index = metadata.schema.to_arrow_schema().get_field_index(column)
+    scanned = 0
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(index).statistics
+        if stats is None or not stats.has_min_max or not (stats.max < low or stats.min > high):
+            scanned += 1
+    return scanned
+
+
+def run_profile(table: pa.Table, profile, repeat: int) -> dict:
+    seconds = []
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        started = time.perf_counter()
+        parquet_profile.write_table(table, buffer, profile)
+        seconds.append(time.perf_counter() - started)
+    data = buffer.getvalue()
+    metadata = pq.ParquetFile(pa.BufferReader(data)).metadata
+
+    # one month of service dates and 1% of the claim ids
+    month = 20230300
+    claim_ids = table.column("claim_id")
+    low_id = claim_ids[table.num_rows // 2].as_py()
+    return {
+        "profile": profile.name,
+        "writeSeconds": round(min(seconds), 3),
+        "writeMBps": round(table.nbytes / 1024 ** 2 / min(seconds), 1),
+        "fileMB": round(len(data) / 1024 ** 2, 2),
+        "ratio": round(table.nbytes / len(data), 2),
+        "rowGroups": metadata.num_row_groups,
+        "monthScan": row_groups_to_scan(metadata, "date_of_service", month + 1, month + 31),
+        "claimIdScan": row_groups_to_scan(metadata, "claim_id", low_id, low_id + table.num_rows // 100)
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="64MB", help="in-memory Arrow size of the claims table")
+    parser.add_argument("--profiles", default=",".join(parquet_profile.PROFILES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    table = claims_table(parse_size(args.size))
+    print(f"{table.num_rows} rows, {table.nbytes / 1024 ** 2:.1f} MB in memory")
+    print(f"{'profile':<14}{'write s':>9}{'MB/s':>8}{'file MB':>9}{'ratio':>7}{'groups':>8}{'month':>7}{'ids':>6}")
+
+    results = []
+    for name in args.profiles.split(","):
+        result = run_profile(table, parquet_profile.get_profile(name), args.repeat)
+        results.append(result)
+        print(f"{name:<14}{result['writeSeconds']:>9}{result['writeMBps']:>8}{result['fileMB']:>9}"
+              f"{result['ratio']:>7}{result['rowGroups']:>8}{result['monthScan']:>7}{result['claimIdScan']:>6}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": table.num_rows, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Snowpipe returns at most this many load events per insertReport / loadHistoryScan response
+MAX_EVENTS_PER_RESPONSE = 10000
+# a pipe loads the files of a submission one after the other .. distinct load times page loadHistoryScan
+LOAD_INTERVAL_SECONDS = 0.001
+
+
+def timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def parse_timestamp(text: str) -> float:
+    return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
+class SnowpipeStub:
+    """
+    Local stand-in for the Snowpipe REST API (insertFiles, insertReport, loadHistoryScan).
+    Every accepted request is recorded so callers can assert on call volume.
+
+    Submitted files load load_seconds later (LOAD_INTERVAL_SECONDS apart) (LOAD_FAILED with probability failure_rate), insertReport pages
+    through the load events with beginMark. throttle_every answers every n-th request with 429 + Retry-After.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, load_seconds: float = 0.0, failure_rate: float = 0.0,
+                 throttle_every: int = 0, retry_after: float = 0.0, seed: int = 0):
+        self.latency_seconds = latency_seconds
+        self.load_seconds = load_seconds
+        self.failure_rate = failure_rate
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.requests = []
+        self.queued = {}  # pipe -> [(load at, event)] not loaded yet
+        self.events = {}  # pipe -> load events in load order
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                stub.requests.append({"method": "POST", "path": self.path, "files": len(body.get("files", []))})
+                time.sleep(stub.latency_seconds)
+                stub.submit(urlparse(self.path).path.rsplit("/", 1)[0], body.get("files", []))
+                self.respond(200, {"requestId": "stub", "responseCode": "SUCCESS"})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                pipe, operation = url.path.rsplit("/", 1)
+                params = {name: values[0] for name, values in parse_qs(url.query).items()}
+                stub.requests.append({"method": "GET", "path": url.path})
+                time.sleep(stub.latency_seconds)
+                if stub.throttle_every and len(stub.requests) % stub.throttle_every == 0:
+                    self.respond(429, {"message": "throttled"}, {"Retry-After": str(stub.retry_after)})
+                elif operation == "insertReport":
+                    self.respond(200, stub.insert_report(pipe, params.get("beginMark")))
+                elif operation == "loadHistoryScan":
+                    self.respond(200, stub.load_history(pipe, params["startTimeInclusive"],
+                                                        params.get("endTimeExclusive")))
+                else:
+                    self.respond(404, {"message": f"unknown operation {operation}"})
+
+            def respond(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def submit(self, pipe: str, files: list):
+        now = time.time()
+        with self.lock:
+            queued = self.queued.setdefault(pipe, [])
+            for index, entry in enumerate(files):
+                failed = self.rng.random() < self.failure_rate
+                queued.append((now + self.load_seconds + index * LOAD_INTERVAL_SECONDS, {
+                    "path": entry["path"],
+                    "fileSize": entry.get("size", 0),
+                    "timeReceived": timestamp(now),
+                    "rowsInserted": 0 if failed else 1000,
+                    "rowsParsed": 1000,
+                    "errorsSeen": 1000 if failed else 0,
+                    "errorLimit": 1,
+                    "complete": True,
+                    "status": "LOAD_FAILED" if failed else "LOADED",
+                    "firstError": "Numeric value 'abc' is not recognized" if failed else None
+                }))
+
+    def loaded(self, pipe: str) -> list:
+        """Load events of a pipe, the queued files that are due are loaded first."""
+        now = time.time()
+        with self.lock:
+            queued = self.queued.get(pipe, [])
+            due = sorted((item for item in queued if item[0] <= now), key=lambda item: item[0])
+            self.queued[pipe] = [item for item in queued if item[0] > now]
+            events = self.events.setdefault(pipe, [])
+            events += [{**event, "lastInsertTime": timestamp(load_at)} for load_at, event in due]
+            return events
+
+    def insert_report(self, pipe: str, begin_mark: str = None) -> dict:
+        events = self.loaded(pipe)
+        begin = int(begin_mark or 0)
+        files = events[begin:begin + MAX_EVENTS_PER_RESPONSE]
+        return {"pipe": pipe, "completeResult": True, "nextBeginMark": str(begin + len(files)), "files": files}
+
+    def load_history(self, pipe: str, start: str, end: str = None) -> dict:
+        start, end = parse_timestamp(start), parse_timestamp(end) if end else float("inf")
+        files = [event for event in self.loaded(pipe) if start <= parse_timestamp(event["lastInsertTime"]) < end]
+        complete = len(files) <= MAX_EVENTS_PER_RESPONSE
+        files = files[:MAX_EVENTS_PER_RESPONSE]
+        result = {"pipe": pipe, "completeResult": complete, "files": files, "startTimeInclusive": timestamp(start)}
+        if files:
+            result["rangeEndTime"] = files[-1]["lastInsertTime"]
+        return result
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
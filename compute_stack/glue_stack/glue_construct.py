@@ -16,6 +16,13 @@ class StructuredCurateDataGlueStack(Stack):
             path="src/glue/curate_layer/process_structured_data/structured.py"
         )
 
+        # Shared pipeline package (schema registry, ..) for --extra-py-files
+        shared_asset = s3_assets.Asset(
+            self, "structured-curate-shared-pipeline-asset",
+            path="src/shared",
+            exclude=["**/__pycache__"]
+        )
+
         # IAM Role for Glue
         glue_role = iam.Role(
             self, "structured-curated-glue-role",
@@ -36,6 +43,30 @@ class StructuredCurateDataGlueStack(Stack):
             ]
         ))
 
+        # --SOURCE_PREFIX runs list the source prefix
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:ListBucket"],
+            resources=[f"arn:aws:s3:::{os.environ.get('STAGE_BUCKET')}"]
+        ))
+
+
+        # quality rule counts (pipeline/quality.py) .. Glue has no EMF extraction, they go out with PutMetricData
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["cloudwatch:PutMetricData"],
+            resources=["*"]
+        ))
+
+        # DIM_* key files for the quality rules .. references rules skipped without REFERENCE_BUCKET
+        if os.environ.get('REFERENCE_BUCKET'):
+            glue_role.add_to_policy(iam.PolicyStatement(
+                actions=["s3:GetObject", "s3:ListBucket"],
+                resources=[
+                    f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}",
+                    f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}/reference/*"
+                ]
+            ))
+
+        shared_asset.grant_read(glue_role)
 
         # Define the Glue job
         self.glue_job = glue.CfnJob(
@@ -47,6 +78,12 @@ class StructuredCurateDataGlueStack(Stack):
                 python_version="3",
                 script_location=script_asset.s3_object_url
             ),
+            default_arguments={
+                "--extra-py-files": shared_asset.s3_object_url,
+                # --SOURCE_PREFIX runs only pick up objects earlier runs did not read
+                "--job-bookmark-option": "job-bookmark-enable",
+                **({"--REFERENCE_BUCKET": os.environ['REFERENCE_BUCKET']} if os.environ.get('REFERENCE_BUCKET') else {})
+            },
             glue_version="4.0",  # or "3.0"
             max_retries=0,
             number_of_workers=2,
@@ -64,6 +101,13 @@ class StructuredApplicationDataGlueStack(Stack):
             path="src/glue/application_layer/process_structured_data/structured.py"
         )
 
+        # Shared pipeline package (schema registry, ..) for --extra-py-files
+        shared_asset = s3_assets.Asset(
+            self, "structured-application-shared-pipeline-asset",
+            path="src/shared",
+            exclude=["**/__pycache__"]
+        )
+
         # IAM Role for Glue
         glue_role = iam.Role(
             self, "structured-application-glue-role",
@@ -84,6 +128,29 @@ class StructuredApplicationDataGlueStack(Stack):
             ]
         ))
 
+        # --SOURCE_PREFIX runs list the source prefix
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:ListBucket"],
+            resources=[f"arn:aws:s3:::{os.environ.get('CURATED_BUCKET')}"]
+        ))
+
+        # unresolved / unparsed fact key counts (pipeline/fact_model.py) go out with PutMetricData
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["cloudwatch:PutMetricData"],
+            resources=["*"]
+        ))
+
+        # DIM_* snapshots for the fact keys .. keys passed through unresolved without REFERENCE_BUCKET
+        if os.environ.get('REFERENCE_BUCKET'):
+            glue_role.add_to_policy(iam.PolicyStatement(
+                actions=["s3:GetObject", "s3:ListBucket"],
+                resources=[
+                    f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}",
+                    f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}/reference/*"
+                ]
+            ))
+
+        shared_asset.grant_read(glue_role)
 
         # Define the Glue job
         self.glue_job = glue.CfnJob(
@@ -95,6 +162,12 @@ class StructuredApplicationDataGlueStack(Stack):
                 python_version="3",
                 script_location=script_asset.s3_object_url
             ),
+            default_arguments={
+                "--extra-py-files": shared_asset.s3_object_url,
+                # --SOURCE_PREFIX runs only pick up objects earlier runs did not read
+                "--job-bookmark-option": "job-bookmark-enable",
+                **({"--REFERENCE_BUCKET": os.environ['REFERENCE_BUCKET']} if os.environ.get('REFERENCE_BUCKET') else {})
+            },
             glue_version="4.0",  # or "3.0"
             max_retries=0,
             number_of_workers=2,
@@ -112,6 +185,13 @@ class SemiStructuredCurateDataGlueStack(Stack):
             path="src/glue/curate_layer/process_semi_structured_data/semi_structured.py"
         )
 
+        # Shared pipeline package (source resolution, ..) for --extra-py-files
+        shared_asset = s3_assets.Asset(
+            self, "semi-structured-curate-shared-pipeline-asset",
+            path="src/shared",
+            exclude=["**/__pycache__"]
+        )
+
         # IAM Role for Glue
         glue_role = iam.Role(
             self, "semi-structured-curated-glue-role",
@@ -132,6 +212,30 @@ class SemiStructuredCurateDataGlueStack(Stack):
             ]
         ))
 
+        # --SOURCE_PREFIX runs list the source prefix
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:ListBucket"],
+            resources=[f"arn:aws:s3:::{os.environ.get('STAGE_BUCKET')}"]
+        ))
+
+        # quality rule counts (pipeline/quality.py) .. Glue has no EMF extraction, they go out with PutMetricData
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["cloudwatch:PutMetricData"],
+            resources=["*"]
+        ))
+
+        # DIM_* key files for the quality rules .. references rules skipped without REFERENCE_BUCKET
+        if os.environ.get('REFERENCE_BUCKET'):
+            glue_role.add_to_policy(iam.PolicyStatement(
+                actions=["s3:GetObject", "s3:ListBucket"],
+                resources=[
+                    f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}",
+                    f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}/reference/*"
+                ]
+            ))
+
+        shared_asset.grant_read(glue_role)
+
         # Define the Glue job
         self.glue_job = glue.CfnJob(
             self, "pyspark-semi-structured-curate-data-glue-job",
@@ -142,6 +246,12 @@ class SemiStructuredCurateDataGlueStack(Stack):
                 python_version="3",
                 script_location=script_asset.s3_object_url
             ),
+            default_arguments={
+                "--extra-py-files": shared_asset.s3_object_url,
+                # --SOURCE_PREFIX runs only pick up objects earlier runs did not read
+                "--job-bookmark-option": "job-bookmark-enable",
+                **({"--REFERENCE_BUCKET": os.environ['REFERENCE_BUCKET']} if os.environ.get('REFERENCE_BUCKET') else {})
+            },
             glue_version="4.0",  # or "3.0"
             max_retries=0,
             number_of_workers=2,
@@ -159,6 +269,13 @@ class UnStructuredCurateDataGlueStack(Stack):
             path="src/glue/curate_layer/process_unstructured_data/unstructured.py"
         )
 
+        # Shared pipeline package (source resolution, ..) for --extra-py-files
+        shared_asset = s3_assets.Asset(
+            self, "unstructured-curate-shared-pipeline-asset",
+            path="src/shared",
+            exclude=["**/__pycache__"]
+        )
+
         # IAM Role for Glue
         glue_role = iam.Role(
             self, "unstructured-curated-glue-role",
@@ -179,6 +296,14 @@ class UnStructuredCurateDataGlueStack(Stack):
             ]
         ))
 
+        # --SOURCE_PREFIX runs list the source prefix
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:ListBucket"],
+            resources=[f"arn:aws:s3:::{os.environ.get('STAGE_BUCKET')}"]
+        ))
+
+        shared_asset.grant_read(glue_role)
+
         # Define the Glue job
         self.glue_job = glue.CfnJob(
             self, "pyspark-unstructured-curate-data-glue-job",
@@ -189,6 +314,9 @@ class UnStructuredCurateDataGlueStack(Stack):
                 python_version="3",
                 script_location=script_asset.s3_object_url
             ),
+            default_arguments={
+                "--extra-py-files": shared_asset.s3_object_url
+            },
             glue_version="4.0",  # or "3.0"
             max_retries=0,
             number_of_workers=2,
@@ -206,6 +334,13 @@ class UnStructuredApplicationDataGlueStack(Stack):
             path="src/glue/application_layer/process_unstructured_data/unstructured.py"
         )
 
+        # Shared pipeline package (source resolution, ..) for --extra-py-files
+        shared_asset = s3_assets.Asset(
+            self, "unstructured-application-shared-pipeline-asset",
+            path="src/shared",
+            exclude=["**/__pycache__"]
+        )
+
         # IAM Role for Glue
         glue_role = iam.Role(
             self, "unstructured-application-glue-role",
@@ -226,6 +361,14 @@ class UnStructuredApplicationDataGlueStack(Stack):
             ]
         ))
 
+        # --SOURCE_PREFIX runs list the source prefix
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:ListBucket"],
+            resources=[f"arn:aws:s3:::{os.environ.get('CURATED_BUCKET')}"]
+        ))
+
+        shared_asset.grant_read(glue_role)
+
         # Define the Glue job
         self.glue_job = glue.CfnJob(
             self, "pyspark-unstructured-application-data-glue-job",
@@ -236,9 +379,86 @@ class UnStructuredApplicationDataGlueStack(Stack):
                 python_version="3",
                 script_location=script_asset.s3_object_url
             ),
+            default_arguments={
+                "--extra-py-files": shared_asset.s3_object_url
+            },
             glue_version="4.0",  # or "3.0"
             max_retries=0,
             number_of_workers=2,
             worker_type="G.1X",  # or "G.2X"
             description="A sample Glue job using PySpark"
-        )
\ No newline at end of file
+        )
+
+class CompactionGlueStack(Stack):
+    def __init__(self, scope: Construct, id: str, **kwargs):
+        super().__init__(scope, id, **kwargs)
+
+        # Upload the PySpark script to an S3 asset
+        script_asset = s3_assets.Asset(
+            self, "compaction-glue-asset",
+            path="src/glue/compaction/compact.py"
+        )
+
+        # Shared pipeline package (compaction, parquet profiles) for --extra-py-files
+        shared_asset = s3_assets.Asset(
+            self, "compaction-shared-pipeline-asset",
+            path="src/shared",
+            exclude=["**/__pycache__"]
+        )
+
+        # IAM Role for Glue
+        glue_role = iam.Role(
+            self, "compaction-glue-role",
+            assumed_by=iam.ServicePrincipal("glue.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSGlueServiceRole")
+            ]
+        )
+
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=[
+                "s3:GetObject",
+                "s3:PutObject",
+                "s3:DeleteObject"
+            ],
+            resources=[
+                f"arn:aws:s3:::{os.environ.get('CURATED_BUCKET')}/*",
+                f"arn:aws:s3:::{os.environ.get('APPLICATION_BUCKET')}/*"
+            ]
+        ))
+
+        # partitions are found by listing
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:ListBucket"],
+            resources=[
+                f"arn:aws:s3:::{os.environ.get('CURATED_BUCKET')}",
+                f"arn:aws:s3:::{os.environ.get('APPLICATION_BUCKET')}"
+            ]
+        ))
+
+        shared_asset.grant_read(glue_role)
+
+        # Define the Glue job .. start with --BUCKET and --PREFIX
+        self.glue_job = glue.CfnJob(
+            self, "pyspark-compaction-glue-job",
+            name="pyspark-compaction-glue-job",
+            role=glue_role.role_arn,
+            command=glue.CfnJob.JobCommandProperty(
+                name="glueetl",
+                python_version="3",
+                script_location=script_asset.s3_object_url
+            ),
+            default_arguments={
+                "--extra-py-files": shared_asset.s3_object_url,
+                "--PREFIX": "claims/type=structured/",
+                "--TARGET_FILE_MB": "512",
+                "--SMALL_FILE_MB": "64",
+                "--MIN_FILES": "4",
+                "--DELETE_AFTER_SECONDS": "900"
+            },
+            glue_version="4.0",  # or "3.0"
+            max_retries=0,
+            number_of_workers=2,
+            worker_type="G.1X",  # or "G.2X"
+            description="Merge small Parquet files of the curated and application buckets"
+        )
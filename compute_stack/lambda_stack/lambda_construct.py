@@ -4,7 +4,10 @@ from aws_cdk import (
     Stack,
     aws_iam as iam,
     aws_lambda as _lambda,
-    Duration
+    aws_events as events,
+    aws_events_targets as targets,
+    Duration,
+    Size
 )
 from constructs import Construct
 
@@ -38,7 +41,8 @@ class StructuredCurateDataLambdaStack(Stack):
             iam.PolicyStatement.from_json({
                 "Effect": "Allow",
                 "Action": [
-                    "s3:PutObject"
+                    "s3:PutObject",
+                    "s3:AbortMultipartUpload"
                 ],
                 "Resource": [
                     f"arn:aws:s3:::{os.environ['CURATED_BUCKET']}/*"
@@ -47,12 +51,41 @@ class StructuredCurateDataLambdaStack(Stack):
         )
 
 
+        # DIM_* key files for the quality rules (pipeline/quality.py) .. references rules skipped without it
+        if os.environ.get('REFERENCE_BUCKET'):
+            lambda_role.add_to_policy(
+                iam.PolicyStatement.from_json({
+                    "Effect": "Allow",
+                    "Action": [
+                        "s3:GetObject"
+                    ],
+                    "Resource": [
+                        f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}/reference/*"
+                    ]
+                })
+            )
+
         self.fn = _lambda.DockerImageFunction(
             self, "structured-curate-lambda",
-            code=_lambda.DockerImageCode.from_image_asset("src/_lambda_/curate_layer/process_structured_data"),
+            # build from src/ so the image can copy the shared pipeline package
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/curate_layer/process_structured_data/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
             timeout=Duration.seconds(180),
             memory_size=4096, # MB -- 4GB
             description="State task for state machine .. process structured data that is not big data",
+            environment={
+                "REFERENCE_BUCKET": os.environ.get('REFERENCE_BUCKET', ""),  # quality rules, see above
+                "DIMENSION_CACHE_TMP_MB": "384",  # snapshots kept in /tmp .. below the default 512 MB ephemeral storage
+                "STREAMING_MIN_BYTES": str(64 * 1024 * 1024),  # stream CSV -> Parquet from 64 MB up
+                "STREAMING_BLOCK_MB": "32",
+                "RANGE_GET_MIN_MB": "64",  # download from 64 MB up as concurrent byte ranges
+                "RANGE_GET_CHUNK_MB": "16",
+                "RANGE_GET_CONCURRENCY": "8",
+                "MULTIPART_CONCURRENCY": "4"  # Parquet parts uploaded in parallel while conversion continues
+            },
             role=lambda_role
         )
 
@@ -84,7 +117,8 @@ class StructuredApplicationDataLambdaStack(Stack):
             iam.PolicyStatement.from_json({
                 "Effect": "Allow",
                 "Action": [
-                    "s3:PutObject"
+                    "s3:PutObject",
+                    "s3:AbortMultipartUpload"
                 ],
                 "Resource": [
                     f"arn:aws:s3:::{os.environ['APPLICATION_BUCKET']}/*"
@@ -93,12 +127,44 @@ class StructuredApplicationDataLambdaStack(Stack):
         )
 
 
+        # DIM_* snapshots for the fact model lookups (pipeline/fact_model.py) .. keys pass through without it
+        if os.environ.get('REFERENCE_BUCKET'):
+            lambda_role.add_to_policy(
+                iam.PolicyStatement.from_json({
+                    "Effect": "Allow",
+                    "Action": [
+                        "s3:GetObject"
+                    ],
+                    "Resource": [
+                        f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}/reference/*"
+                    ]
+                })
+            )
+
         self.fn = _lambda.DockerImageFunction(
             self, "structured-application-lambda",
-            code=_lambda.DockerImageCode.from_image_asset("src/_lambda_/application_layer/process_structured_data"),
+            # build from src/ so the image can copy the shared pipeline package
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/application_layer/process_structured_data/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
             timeout=Duration.seconds(180),
             memory_size=4096, # MB -- 4GB
             description="State task for state machine .. process structured data that is not big data",
+            # /tmp tier of the dimension cache (pipeline/dimension_cache.py)
+            ephemeral_storage_size=Size.gibibytes(4),
+            environment={
+                "DATA_QUALITY": "false",  # the curate layer already applied the quality rules
+                "REFERENCE_BUCKET": os.environ.get('REFERENCE_BUCKET', ""),  # fact model lookups, see above
+                "DIMENSION_CACHE_MB": "1024",  # dimension tables kept in memory across warm invocations
+                "DIMENSION_CACHE_TMP_MB": "3072",
+                "DIMENSION_REVALIDATE_SECONDS": "60",  # HEAD the snapshot ETags at most once a minute
+                "RANGE_GET_MIN_MB": "64",  # download from 64 MB up as concurrent byte ranges
+                "RANGE_GET_CHUNK_MB": "16",
+                "RANGE_GET_CONCURRENCY": "8",
+                "MULTIPART_CONCURRENCY": "4"  # Parquet parts uploaded in parallel while conversion continues
+            },
             role=lambda_role
         )
 
@@ -130,7 +196,8 @@ class SemiStructuredCurateDataLambdaStack(Stack):
             iam.PolicyStatement.from_json({
                 "Effect": "Allow",
                 "Action": [
-                    "s3:PutObject"
+                    "s3:PutObject",
+                    "s3:AbortMultipartUpload"
                 ],
                 "Resource": [
                     f"arn:aws:s3:::{os.environ['CURATED_BUCKET']}/*"
@@ -139,12 +206,41 @@ class SemiStructuredCurateDataLambdaStack(Stack):
         )
 
 
+        # DIM_* key files for the quality rules (pipeline/quality.py) .. references rules skipped without it
+        if os.environ.get('REFERENCE_BUCKET'):
+            lambda_role.add_to_policy(
+                iam.PolicyStatement.from_json({
+                    "Effect": "Allow",
+                    "Action": [
+                        "s3:GetObject"
+                    ],
+                    "Resource": [
+                        f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}/reference/*"
+                    ]
+                })
+            )
+
         self.fn = _lambda.DockerImageFunction(
             self, "semi-structured-curate-lambda",
-            code=_lambda.DockerImageCode.from_image_asset("src/_lambda_/curate_layer/process_semi_structured_data"),
+            # build from src/ so the image can copy the shared pipeline package
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/curate_layer/process_semi_structured_data/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
             timeout=Duration.seconds(180),
             memory_size=4096, # MB -- 4GB
             description="State task for state machine .. process structured data that is not big data",
+            environment={
+                "REFERENCE_BUCKET": os.environ.get('REFERENCE_BUCKET', ""),  # quality rules, see above
+                "DIMENSION_CACHE_TMP_MB": "384",  # snapshots kept in /tmp .. below the default 512 MB ephemeral storage
+                "STREAMING_BLOCK_MB": "32",  # NDJSON bytes parsed per block / row group
+                "FLATTEN_NESTED": "false",
+                "RANGE_GET_MIN_MB": "64",  # download from 64 MB up as concurrent byte ranges
+                "RANGE_GET_CHUNK_MB": "16",
+                "RANGE_GET_CONCURRENCY": "8",
+                "MULTIPART_CONCURRENCY": "4"  # Parquet parts uploaded in parallel while conversion continues
+            },
             role=lambda_role
         )
 
@@ -177,7 +273,8 @@ class UnStructuredCurateDataLambdaStack(Stack):
             iam.PolicyStatement.from_json({
                 "Effect": "Allow",
                 "Action": [
-                    "s3:PutObject"
+                    "s3:PutObject",
+                    "s3:AbortMultipartUpload"
                 ],
                 "Resource": [
                     f"arn:aws:s3:::{os.environ['CURATED_BUCKET']}/*"
@@ -189,7 +286,12 @@ class UnStructuredCurateDataLambdaStack(Stack):
 
         self.fn = _lambda.DockerImageFunction(
             self, "unstructured-curate-lambda",
-            code=_lambda.DockerImageCode.from_image_asset("src/_lambda_/curate_layer/process_unstructured_data"),
+            # build from src/ so the image can copy the shared pipeline package
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/curate_layer/process_unstructured_data/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
             timeout=Duration.seconds(180),
             memory_size=4096, # MB -- 4GB
             description="State task for state machine .. process unstructured data that is not big data",
@@ -225,7 +327,8 @@ class UnStructuredApplicationDataLambdaStack(Stack):
             iam.PolicyStatement.from_json({
                 "Effect": "Allow",
                 "Action": [
-                    "s3:PutObject"
+                    "s3:PutObject",
+                    "s3:AbortMultipartUpload"
                 ],
                 "Resource": [
                     f"arn:aws:s3:::{os.environ['APPLICATION_BUCKET']}/*"
@@ -236,13 +339,198 @@ class UnStructuredApplicationDataLambdaStack(Stack):
 
         self.fn = _lambda.DockerImageFunction(
             self, "unstructured-application-lambda",
-            code=_lambda.DockerImageCode.from_image_asset("src/_lambda_/application_layer/process_unstructured_data"),
+            # build from src/ so the image can copy the shared pipeline package
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/application_layer/process_unstructured_data/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
             timeout=Duration.seconds(180),
             memory_size=4096, # MB -- 4GB
             description="State task for state machine .. process unstructured data that is not big data",
             role=lambda_role
         )
 
+class CompactionLambdaStack(Stack):
+    def __init__(self, scope: Construct, id: str, **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+
+        lambda_role = iam.Role(
+            self, "compaction-lambda-exection-role",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole")
+            ]
+        )
+
+        lambda_role.add_to_policy(
+            iam.PolicyStatement.from_json({
+                "Effect": "Allow",
+                "Action": [
+                    "s3:GetObject",
+                    "s3:PutObject",
+                    "s3:DeleteObject",
+                    "s3:AbortMultipartUpload"
+                ],
+                "Resource": [
+                    f"arn:aws:s3:::{os.environ['CURATED_BUCKET']}/*",
+                    f"arn:aws:s3:::{os.environ['APPLICATION_BUCKET']}/*"
+                ]
+            })
+        )
+
+        lambda_role.add_to_policy(
+            iam.PolicyStatement.from_json({
+                "Effect": "Allow",
+                "Action": [
+                    "s3:ListBucket"
+                ],
+                "Resource": [
+                    f"arn:aws:s3:::{os.environ['CURATED_BUCKET']}",
+                    f"arn:aws:s3:::{os.environ['APPLICATION_BUCKET']}"
+                ]
+            })
+        )
+
+
+        self.fn = _lambda.DockerImageFunction(
+            self, "compaction-lambda",
+            # build from src/ so the image can copy the shared pipeline package
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/compaction/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
+            timeout=Duration.seconds(900),
+            memory_size=4096, # MB -- 4GB
+            description="Merge small Parquet files of the curated and application buckets",
+            environment={
+                "COMPACTION_TARGET_MB": "128",
+                "COMPACTION_SMALL_MB": "32",
+                "COMPACTION_MIN_FILES": "4",
+                "COMPACTION_DELETE_AFTER_SECONDS": "900"  # replaced files stay readable this long
+            },
+            role=lambda_role
+        )
+
+        # one scheduled run per bucket .. partitions left over at the time limit go to the next run
+        schedule = events.Rule(
+            self, "compaction-schedule",
+            schedule=events.Schedule.rate(Duration.hours(6))
+        )
+        for bucket in (os.environ['CURATED_BUCKET'], os.environ['APPLICATION_BUCKET']):
+            schedule.add_target(targets.LambdaFunction(
+                self.fn,
+                event=events.RuleTargetInput.from_object({
+                    "bucketName": bucket,
+                    "prefix": "claims/type=structured/"
+                })
+            ))
+
+class ChunkedConversionLambdaStack(Stack):
+    def __init__(self, scope: Construct, id: str, **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+
+        lambda_role = iam.Role(
+            self, "chunked-conversion-lambda-exection-role",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole")
+            ]
+        )
+
+        lambda_role.add_to_policy(
+            iam.PolicyStatement.from_json({
+                "Effect": "Allow",
+                "Action": [
+                    "s3:GetObject"
+                ],
+                "Resource": [
+                    f"arn:aws:s3:::{os.environ['STAGE_BUCKET']}/*"
+                ]
+            })
+        )
+
+        lambda_role.add_to_policy(
+            iam.PolicyStatement.from_json({
+                "Effect": "Allow",
+                "Action": [
+                    "s3:PutObject",
+                    "s3:DeleteObject",
+                    "s3:AbortMultipartUpload"
+                ],
+                "Resource": [
+                    f"arn:aws:s3:::{os.environ['CURATED_BUCKET']}/*"
+                ]
+            })
+        )
+
+        # commit lists the parts
+        lambda_role.add_to_policy(
+            iam.PolicyStatement.from_json({
+                "Effect": "Allow",
+                "Action": [
+                    "s3:ListBucket"
+                ],
+                "Resource": [
+                    f"arn:aws:s3:::{os.environ['CURATED_BUCKET']}"
+                ]
+            })
+        )
+
+        # DIM_* key files for the quality rules (pipeline/quality.py) .. references rules skipped without it
+        if os.environ.get('REFERENCE_BUCKET'):
+            lambda_role.add_to_policy(
+                iam.PolicyStatement.from_json({
+                    "Effect": "Allow",
+                    "Action": [
+                        "s3:GetObject"
+                    ],
+                    "Resource": [
+                        f"arn:aws:s3:::{os.environ['REFERENCE_BUCKET']}/reference/*"
+                    ]
+                })
+            )
+
+        environment = {
+            "REFERENCE_BUCKET": os.environ.get('REFERENCE_BUCKET', ""),  # quality rules, see above
+            "DIMENSION_CACHE_TMP_MB": "384",  # snapshots kept in /tmp .. below the default 512 MB ephemeral storage
+            "CHUNKED_CHUNK_MB": "128",  # source bytes per part .. keep in step with routing_table.json chunkMB
+            "RANGE_GET_CHUNK_MB": "16",
+            "RANGE_GET_CONCURRENCY": "8",
+            "MULTIPART_CONCURRENCY": "4"
+        }
+
+        # plan / convert / commit share one image, the handler is picked per function
+        functions = {}
+        for name, handler, timeout, memory_size, description in (
+            ("plan", "chunked.plan_handler", 60, 512,
+             "State task for the chunked state machine .. split a CSV into newline aligned byte ranges"),
+            ("convert", "chunked.convert_handler", 180, 4096,
+             "State task for the chunked state machine .. convert one byte range to one Parquet part"),
+            ("commit", "chunked.commit_handler", 60, 512,
+             "State task for the chunked state machine .. check the parts and write the manifest")
+        ):
+            functions[name] = _lambda.DockerImageFunction(
+                self, f"chunked-{name}-lambda",
+                # build from src/ so the image can copy the shared pipeline package
+                code=_lambda.DockerImageCode.from_image_asset(
+                    "src",
+                    file="_lambda_/chunked_conversion/Dockerfile",
+                    exclude=["glue", "**/__pycache__"],
+                    cmd=[handler]
+                ),
+                timeout=Duration.seconds(timeout),
+                memory_size=memory_size,
+                description=description,
+                environment=environment,
+                role=lambda_role
+            )
+
+        self.plan_fn = functions["plan"]
+        self.convert_fn = functions["convert"]
+        self.commit_fn = functions["commit"]
+
 class SnowflakeModelLambdaStack(Stack):
     def __init__(self, scope: Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
@@ -267,21 +555,50 @@ class SnowflakeModelLambdaStack(Stack):
             })
         )
 
+        environment = {
+            "SNOWFLAKE_ACCOUNT": os.environ["SNOWFLAKE_ACCOUNT"],
+            "SNOWFLAKE_USER": os.environ["SNOWFLAKE_USER"],
+            "SNOWFLAKE_ROLE": os.environ["SNOWFLAKE_ROLE"],
+            "SNOWFLAKE_PIPE": json.dumps({
+                "FACT_CLAIMS": os.environ["SNOWFLAKE_PIPE_FACT_CLAIMS"]
+            }),
+            "SNOWFLAKE_PRIVATE_KEY": os.environ["SNOWFLAKE_PRIVATE_KEY"],  # base64-encoded
+        }
 
         self.fn = _lambda.DockerImageFunction(
             self, "snowflake-lambda-application-lambda",
-            code=_lambda.DockerImageCode.from_image_asset("src/_lambda_/ingest_data_model"),
+            # build from src/ so the image can copy the shared pipeline package
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/ingest_data_model/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
             timeout=Duration.seconds(180),
             memory_size=4096, # MB -- 4GB
             description="State task for state machine .. ingest data to model",
+            environment=environment,
+            role=lambda_role
+        )
+
+        # same image, polls insertReport / loadHistoryScan until the submitted files settled
+        self.load_status_fn = _lambda.DockerImageFunction(
+            self, "snowflake-load-status-lambda",
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/ingest_data_model/Dockerfile",
+                exclude=["glue", "**/__pycache__"],
+                cmd=["model.load_status_handler"]
+            ),
+            timeout=Duration.seconds(90),
+            memory_size=512, # MB .. waits on HTTP, the state machine waits between polls
+            description="State task for state machine .. poll the Snowpipe load status",
             environment={
-                "SNOWFLAKE_ACCOUNT": os.environ["SNOWFLAKE_ACCOUNT"],
-                "SNOWFLAKE_USER": os.environ["SNOWFLAKE_USER"],
-                "SNOWFLAKE_ROLE": os.environ["SNOWFLAKE_ROLE"],
-                "SNOWFLAKE_PIPE": json.dumps({
-                    "FACT_CLAIMS": os.environ["SNOWFLAKE_PIPE_FACT_CLAIMS"]
-                }),
-                "SNOWFLAKE_PRIVATE_KEY": os.environ["SNOWFLAKE_PRIVATE_KEY"],  # base64-encoded
+                **environment,
+                # keep the poll under the timeout
+                "LOAD_STATUS_POLL_SECONDS": "50",
+                "LOAD_STATUS_TIMEOUT_SECONDS": "3600",
+                "SNOWPIPE_POLL_MIN_SECONDS": "1",
+                "SNOWPIPE_POLL_MAX_SECONDS": "30"
             },
             role=lambda_role
         )
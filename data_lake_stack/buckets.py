@@ -1,4 +1,5 @@
 import os
+import json
 import boto3
 from botocore.exceptions import ClientError
 from aws_cdk import (
@@ -8,10 +9,24 @@ from aws_cdk import (
     aws_lambda as _lambda,
     aws_iam as iam,
     aws_s3 as s3,
-    aws_s3_notifications as s3n
+    aws_s3_notifications as s3n,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources
 )
 from constructs import Construct
 
+# micro batch limits per bucket layer when dispatch_mode="batch"
+# maxFiles / maxBytes close a batch in the meta lambda (as does the 256 KB StartExecution input limit),
+# windowSeconds is the SQS batching window .. the only copy, passed to the meta lambda as BATCH_LIMITS
+DISPATCH_BATCH_LIMITS = {
+    "stage": {"maxFiles": 500, "maxBytes": 512 * 1024 * 1024, "windowSeconds": 30},
+    "curated": {"maxFiles": 500, "maxBytes": 512 * 1024 * 1024, "windowSeconds": 30},
+    "application": {"maxFiles": 1000, "maxBytes": 1024 * 1024 * 1024, "windowSeconds": 60}
+}
+# receives before a dispatch record moves to the dead-letter queue .. ~3 hours of visibility timeouts,
+# long enough for a deferred duplicate to outlive a normal execution, short for a poison record
+DISPATCH_MAX_RECEIVES = 10
+
 class MetaLambdaStack(Stack):
     def __init__(
         self,
@@ -19,11 +34,13 @@ class MetaLambdaStack(Stack):
         id: str,
         orchestration_stack,
         env_name: str,
+        dispatch_mode: str = "single",
         **kwargs
     ) -> None:
         super().__init__(scope, id, **kwargs)
 
         is_dev = str(env_name).upper() == "DEV"
+        is_batch = str(dispatch_mode).lower() == "batch"
 
         # Resolve buckets + check if they were imported
         stage_bucket, imported_stage = self.resolve_bucket("StageBucket", os.environ["STAGE_BUCKET"], is_dev)
@@ -55,21 +72,62 @@ class MetaLambdaStack(Stack):
             })
         )
 
+        # glue batch manifests written next to the objects they list
+        lambda_role.add_to_policy(
+            iam.PolicyStatement.from_json({
+                "Effect": "Allow",
+                "Action": ["s3:PutObject"],
+                "Resource": [
+                    f"{stage_bucket.bucket_arn}/_manifests/*",
+                    f"{curated_bucket.bucket_arn}/_manifests/*"
+                ]
+            })
+        )
+
+        # Idempotency ledger .. owned by the orchestration stack, whose state machine settles the claims
+        ledger_table = orchestration_stack.ledger_table
+
         #  Docker Lambda
         self.meta_lambda = _lambda.DockerImageFunction(
             self, "MetaLambdaFunction",
-            code=_lambda.DockerImageCode.from_image_asset("src/_lambda_/process_meta_data"),
+            code=_lambda.DockerImageCode.from_image_asset(
+                "src",
+                file="_lambda_/process_meta_data/Dockerfile",
+                exclude=["glue", "**/__pycache__"]
+            ),
             timeout=Duration.seconds(180),
             memory_size=2048,
             description="Triggered by S3 to extract metadata and start Step Function",
             environment={
-                "STATE_MACHINE_ARN": orchestration_stack.state_machine.state_machine_arn
+                "STATE_MACHINE_ARN": orchestration_stack.state_machine.state_machine_arn,
+                "MAX_WORKERS": "16",  # concurrent HEAD + StartExecution calls per notification batch
+                "CURATED_BUCKET": os.environ["CURATED_BUCKET"],
+                "APPLICATION_BUCKET": os.environ["APPLICATION_BUCKET"],
+                "DISPATCH_MODE": "batch" if is_batch else "single",
+                "BATCH_LIMITS": json.dumps(DISPATCH_BATCH_LIMITS),
+                "ROUTING_OBJECTIVE": "latency",  # or "cost" .. see src/shared/pipeline/routing_table.json
+                "GLUE_MANIFEST_PREFIX": "_manifests/glue/",
+                "GLUE_BATCH_MAX_FILES": "500",  # objects per Glue job run
+                "LEDGER_TABLE": ledger_table.table_name,
+                # claims are held until the execution ends .. longer than the state machine timeout
+                "LEDGER_IN_FLIGHT_SECONDS": str(orchestration_stack.ledger_in_flight_seconds),
+                "LEDGER_DONE_TTL_SECONDS": str(orchestration_stack.ledger_done_ttl_seconds)
             },
             role=lambda_role
         )
+        ledger_table.grant_read_write_data(self.meta_lambda)
 
         # Conditional Lambda trigger permission
-        if not imported_stage:
+        if not imported_stage and is_batch:
+            #  Buffer notifications in SQS so one invocation sees a whole burst
+            self.add_batch_dispatch(
+                stage_bucket, "stage",
+                s3.NotificationKeyFilter(
+                    prefix="claims/type=structured/",
+                    suffix=".csv"
+                )
+            )
+        elif not imported_stage:
             self.meta_lambda.add_permission(
                 "AllowInvokeFromS3",
                 principal=iam.ServicePrincipal("s3.amazonaws.com"),
@@ -86,6 +144,41 @@ class MetaLambdaStack(Stack):
                 )
             )
 
+    def add_batch_dispatch(self, bucket: s3.IBucket, layer: str, key_filter: s3.NotificationKeyFilter) -> sqs.Queue:
+        limits = DISPATCH_BATCH_LIMITS[layer]
+
+        # records that keep failing (deleted key, poison message) are parked here instead of retried until expiry
+        dead_letter_queue = sqs.Queue(
+            self, f"{layer}-dispatch-dlq",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14)
+        )
+
+        queue = sqs.Queue(
+            self, f"{layer}-dispatch-queue",
+            visibility_timeout=Duration.seconds(6 * 180),  # 6x the meta lambda timeout
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            dead_letter_queue=sqs.DeadLetterQueue(queue=dead_letter_queue, max_receive_count=DISPATCH_MAX_RECEIVES)
+        )
+
+        bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            s3n.SqsDestination(queue),
+            key_filter
+        )
+
+        self.meta_lambda.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                queue,
+                batch_size=min(limits["maxFiles"], 10000),
+                max_batching_window=Duration.seconds(limits["windowSeconds"]),
+                report_batch_item_failures=True
+            )
+        )
+        return queue
+
     def resolve_bucket(self, id: str, name: str, is_dev: bool) -> tuple[s3.IBucket, bool]:
         if self.bucket_exists(name):
             return s3.Bucket.from_bucket_name(self, f"Imported{id}", name), True
@@ -95,7 +188,9 @@ class MetaLambdaStack(Stack):
                 bucket_name=name,
                 versioned=True,
                 removal_policy=RemovalPolicy.DESTROY if is_dev else RemovalPolicy.RETAIN,
-                auto_delete_objects=is_dev
+                auto_delete_objects=is_dev,
+                # uploads of a Lambda killed mid-write (timeout, OOM) never reach abort .. S3 cleans them up
+                lifecycle_rules=[s3.LifecycleRule(abort_incomplete_multipart_upload_after=Duration.days(1))]
             )
             return bucket, False
 
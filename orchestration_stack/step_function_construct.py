@@ -1,5 +1,6 @@
-from aws_cdk import Stack
+from aws_cdk import Stack, Duration, RemovalPolicy
 from aws_cdk import (
+    aws_dynamodb as dynamodb,
     aws_stepfunctions as sfn,
     aws_lambda as _lambda_,
     aws_stepfunctions_tasks as tasks,
@@ -22,12 +23,47 @@ class OrchestrationStack(Stack):
             unstructured_curated_glue_stack_name: str,
             unstructured_application_glue_stack_name: str,
             snowflake_model_claims_lambda_fn: _lambda_.IFunction,
+            snowflake_load_status_lambda_fn: _lambda_.IFunction,
+            chunked_plan_lambda_fn: _lambda_.IFunction,
+            chunked_convert_lambda_fn: _lambda_.IFunction,
+            chunked_commit_lambda_fn: _lambda_.IFunction,
+            env_name: str = "DEV",
             **kwargs
         ) -> None:
         super().__init__(scope, id, **kwargs)
 
-         # file size threshold 2GB
-        SIZE_THRESHOLD = 2000
+        is_dev = str(env_name).upper() == "DEV"
+
+        # file size threshold 2GB .. only used when the meta lambda sent no route
+        SIZE_THRESHOLD = 2 * 1024 * 1024 * 1024
+
+        # files of one micro batch processed in parallel
+        MAP_MAX_CONCURRENCY = 40
+
+        # glue batches of one micro batch run one after the other .. a job runs one at a time by default
+        GLUE_BATCH_MAX_CONCURRENCY = 1
+
+        # part Lambdas of one chunked file running at once .. keep in step with routing_table.json maxConcurrency
+        CHUNKED_MAX_CONCURRENCY = 40
+
+        # a timed out execution skips its Catch .. its ledger claims expire an hour later instead
+        STATE_MACHINE_TIMEOUT = Duration.hours(24)
+        self.ledger_in_flight_seconds = STATE_MACHINE_TIMEOUT.to_seconds() + 3600
+        # done claims evicted a week after they were claimed
+        self.ledger_done_ttl_seconds = 7 * 24 * 3600
+
+        # ledger updates of one execution running at once
+        LEDGER_MAX_CONCURRENCY = 40
+
+        # Idempotency ledger (src/shared/pipeline/ledger.py) .. one item per object version, evicted by TTL
+        # claimed by the meta lambda, settled here when the execution ends
+        self.ledger_table = dynamodb.Table(
+            self, "DispatchLedger",
+            partition_key=dynamodb.Attribute(name="ledgerKey", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expiresAt",
+            removal_policy=RemovalPolicy.DESTROY if is_dev else RemovalPolicy.RETAIN
+        )
 
         # sucess defined
         success = sfn.Succeed(self, "Done")
@@ -73,6 +109,53 @@ class OrchestrationStack(Stack):
             lambda_function=snowflake_model_claims_lambda_fn,
             output_path="$.Payload"
         )
+
+        # application micro batches are submitted in one insertFiles call instead of one per file
+        snowflake_model_claims_fact_fn_task_batch = tasks.LambdaInvoke(
+            self, "job-snowflake-ingest-batch",
+            lambda_function=snowflake_model_claims_lambda_fn,
+            output_path="$.Payload"
+        )
+
+        # insertFiles only queues the files .. the load status Lambda polls the pipes until every file settled
+        # (src/shared/pipeline/snowpipe_status.py), the state machine waits between polls instead of the Lambda
+        def snowpipe_load_status(suffix: str, succeeded: sfn.IChainable) -> Choice:
+            check_ingest = Choice(self, f"Check Snowpipe Ingest {suffix}")
+            load_status_task = tasks.LambdaInvoke(
+                self, f"job-snowflake-load-status-{suffix.lower()}",
+                lambda_function=snowflake_load_status_lambda_fn,
+                output_path="$.Payload"
+            )
+            load_status_task.add_retry(
+                errors=["States.TaskFailed"],
+                interval=Duration.seconds(10),
+                max_attempts=3,
+                backoff_rate=2
+            )
+            wait_for_load = sfn.Wait(
+                self, f"Wait For Snowpipe Load {suffix}",
+                time=sfn.WaitTime.seconds_path("$.loadStatus.nextPollSeconds")
+            )
+            check_load = Choice(self, f"Check Snowpipe Load {suffix}")
+            check_load.when(
+                Condition.string_equals("$.loadStatus.state", "pending"),
+                wait_for_load.next(load_status_task)
+            ).when(
+                Condition.string_equals("$.loadStatus.state", "loaded"),
+                succeeded
+            ).otherwise(
+                sfn.Fail(self, f"Snowpipe Load Failed {suffix}", error="LoadFailed",
+                         cause="Snowpipe did not load every file, see loadStatus.failed")
+            )
+            load_status_task.next(check_load)
+            check_ingest.when(
+                Condition.number_equals("$.statusCode", 200),
+                load_status_task
+            ).otherwise(
+                sfn.Fail(self, f"Snowpipe Ingest Failed {suffix}", error="JobFailed", cause="Snowpipe ingest failed")
+            )
+            return check_ingest
+
         # define glue task
         structured_curated_glue_task = tasks.GlueStartJobRun(
             self, "job-structured-curate-bigdata",
@@ -143,6 +226,99 @@ class OrchestrationStack(Stack):
             integration_pattern=sfn.IntegrationPattern.RUN_JOB,  # .sync waits for job to complete
             result_path="$.glue_result"
         )
+        # glue batch tasks .. one job run converts every object listed in the manifest
+        glue_batch_tasks = {}
+        for name, job_name in (
+            ("job-structured-curate-bigdata-batch", structured_curated_glue_name),
+            ("job-semistructured-curate-bigdata-batch", semi_structured_curated_glue_name),
+            ("job-unstructured-curate-bigdata-batch", unstructured_curated_glue_stack_name),
+            ("job-structured-model-bigdata-batch", structured_application_glue_name),
+            ("job-unstructured-model-bigdata-batch", unstructured_application_glue_stack_name)
+        ):
+            glue_batch_tasks[name] = tasks.GlueStartJobRun(
+                self, name,
+                glue_job_name=job_name,
+                arguments=sfn.TaskInput.from_object({
+                    "--JOB_NAME" : job_name,
+                    "--SOURCE_BUCKET": sfn.JsonPath.string_at("$.bucketName"),
+                    "--MANIFEST_KEY": sfn.JsonPath.string_at("$.manifestKey"),
+                    "--DEST_BUCKET": sfn.JsonPath.string_at("$.destBucket"),
+                    "--DEST_PREFIX": sfn.JsonPath.string_at("$.destPrefix")
+                }),
+                integration_pattern=sfn.IntegrationPattern.RUN_JOB,  # .sync waits for job to complete
+                result_path="$.glue_result"
+            )
+            # per file runs of the same job may still be going
+            glue_batch_tasks[name].add_retry(
+                errors=["Glue.ConcurrentRunsExceededException"],
+                interval=Duration.seconds(60),
+                max_attempts=10,
+                backoff_rate=1.5
+            )
+
+        # chunked conversion (src/shared/pipeline/chunked.py) .. its own state machine because a
+        # Distributed Map cannot run inside the inline Map that fans out the files of a micro batch
+        chunked_plan_task = tasks.LambdaInvoke(
+            self, "job-structured-curate-chunked-plan",
+            lambda_function=chunked_plan_lambda_fn,
+            output_path="$.Payload"
+        )
+
+        chunked_convert_task = tasks.LambdaInvoke(
+            self, "job-structured-curate-chunked-part",
+            lambda_function=chunked_convert_lambda_fn,
+            output_path="$.Payload"
+        )
+
+        chunked_commit_task = tasks.LambdaInvoke(
+            self, "job-structured-curate-chunked-commit",
+            lambda_function=chunked_commit_lambda_fn,
+            output_path="$.Payload"
+        )
+
+        # parts only carry their range, the source and header are added per item
+        chunked_parts_map = sfn.DistributedMap(
+            self, "Convert Chunked Parts",
+            items_path="$.parts",
+            item_selector={
+                "bucketName.$": "$.bucketName",
+                "objectKey.$": "$.objectKey",
+                "etag.$": "$.etag",
+                "header.$": "$.header",
+                "destBucket.$": "$.destBucket",
+                "start.$": "$$.Map.Item.Value.start",
+                "end.$": "$$.Map.Item.Value.end",
+                "partNumber.$": "$$.Map.Item.Value.partNumber",
+                "partKey.$": "$$.Map.Item.Value.partKey"
+            },
+            max_concurrency=CHUNKED_MAX_CONCURRENCY,
+            # one part runs well under the 5 minute limit of express child executions
+            map_execution_type=sfn.StateMachineType.EXPRESS,
+            result_path="$.partResults"
+        )
+        chunked_parts_map.item_processor(chunked_convert_task)
+
+        chunked_state_machine = sfn.StateMachine(
+            self, "chunked-conversion",
+            state_machine_name="data-platform-chunked-conversion-state-machine",
+            definition_body=sfn.DefinitionBody.from_chainable(
+                chunked_plan_task.next(chunked_parts_map).next(chunked_commit_task)
+            ),
+            logs=sfn.LogOptions(
+                destination=logs.LogGroup(self, "ChunkedStateMachineLogs", retention=logs.RetentionDays.ONE_WEEK),
+                level=sfn.LogLevel.ERROR
+            ),
+            tracing_enabled=True #enable x-ray tracing
+        )
+
+        structured_curated_chunked_task = tasks.StepFunctionsStartExecution(
+            self, "job-structured-curate-chunked",
+            state_machine=chunked_state_machine,
+            input=sfn.TaskInput.from_json_path_at("$"),
+            integration_pattern=sfn.IntegrationPattern.RUN_JOB,  # .sync waits for the commit
+            result_path="$.chunked_result"
+        )
+
         # define choice per size
         file_size_choice = Choice(self, "Check File Size")
 
@@ -161,6 +337,9 @@ class OrchestrationStack(Stack):
         success = sfn.Succeed(self, "Success")
         failure = sfn.Fail(self, "Failure", error="JobFailed", cause="Downstream task failed")
 
+        # small and big files share one load status loop inside the file Map
+        snowpipe_load_status_file = snowpipe_load_status("File", success)
+
         file_size_choice.when(
             Condition.number_less_than("$.fileSize", SIZE_THRESHOLD),
             bucket_choice
@@ -176,7 +355,7 @@ class OrchestrationStack(Stack):
             data_format_curated
         ).when(
             Condition.string_matches("$.bucketNameLower", "*application*"),
-            snowflake_model_claims_fact_fn_task_small.next(success)
+            snowflake_model_claims_fact_fn_task_small.next(snowpipe_load_status_file)
         ).otherwise(failure)
 
         bucket_big_data_choice.when(
@@ -187,7 +366,7 @@ class OrchestrationStack(Stack):
             data_format_curated_big_data
         ).when(
             Condition.string_matches("$.bucketNameLower", "*application*"),
-            snowflake_model_claims_fact_fn_task_big.next(success)
+            snowflake_model_claims_fact_fn_task_big.next(snowpipe_load_status_file)
         ).otherwise(failure)
 
         data_format_stage.when(
@@ -234,11 +413,190 @@ class OrchestrationStack(Stack):
             failure
         ).otherwise(success)
 
+        # the meta lambda routes on measured runtimes (src/shared/pipeline/routing.py)
+        route_choice = Choice(self, "Check Route")
+        route_choice.when(
+            Condition.and_(
+                Condition.is_present("$.route"),
+                Condition.string_equals("$.route", "glue")
+            ),
+            bucket_big_data_choice
+        ).when(
+            Condition.and_(
+                Condition.is_present("$.route"),
+                Condition.string_equals("$.route", "chunked")
+            ),
+            structured_curated_chunked_task.next(check_task_success)
+        ).when(
+            Condition.is_present("$.route"),
+            bucket_choice
+        ).otherwise(
+            file_size_choice
+        )
+
+        # one glue run per manifest, picked by layer and dataset format
+        glue_batch_choice = Choice(self, "Check Glue Batch")
+        glue_batch_done = sfn.Succeed(self, "Glue Batch Done")
+        for bucket_pattern, data_format, name in (
+            ("*stage*", "structured", "job-structured-curate-bigdata-batch"),
+            ("*stage*", "semi-structured", "job-semistructured-curate-bigdata-batch"),
+            ("*stage*", "unstructured", "job-unstructured-curate-bigdata-batch"),
+            ("*curated*", "structured", "job-structured-model-bigdata-batch"),
+            ("*curated*", "unstructured", "job-unstructured-model-bigdata-batch")
+        ):
+            glue_batch_choice.when(
+                Condition.and_(
+                    Condition.string_matches("$.bucketNameLower", bucket_pattern),
+                    Condition.string_equals("$.dataFormat", data_format)
+                ),
+                glue_batch_tasks[name].next(glue_batch_done)
+            )
+        glue_batch_choice.otherwise(
+            sfn.Fail(self, "Glue Batch Failed", error="JobFailed", cause="No Glue job for batch")
+        )
+
+        # micro batches carry a list of files .. single objects are wrapped into a list of one
+        batch_choice = Choice(self, "Check Batch")
+        wrap_single_file = sfn.Pass(
+            self, "Wrap Single File",
+            parameters={"files.$": "States.Array($)", "glueBatches": []}
+        )
+        fan_out_files = sfn.Map(
+            self, "Fan Out Files",
+            items_path="$.files",
+            max_concurrency=MAP_MAX_CONCURRENCY,
+            result_path=sfn.JsonPath.DISCARD
+        )
+        fan_out_files.item_processor(route_choice)
+
+        fan_out_glue_batches = sfn.Map(
+            self, "Fan Out Glue Batches",
+            items_path="$.glueBatches",
+            max_concurrency=GLUE_BATCH_MAX_CONCURRENCY,
+            result_path=sfn.JsonPath.DISCARD
+        )
+        fan_out_glue_batches.item_processor(glue_batch_choice)
+
+        # glue batches and lambda files of one micro batch run side by side
+        process_batch = sfn.Parallel(self, "Process Batch", result_path=sfn.JsonPath.DISCARD)
+        process_batch.branch(fan_out_glue_batches)
+        process_batch.branch(fan_out_files)
+        process_batch.next(sfn.Succeed(self, "Batch Done"))
+
+        check_batch_ingest = snowpipe_load_status("Batch", sfn.Succeed(self, "Batch Ingest Done"))
+
+        batch_choice.when(
+            Condition.and_(
+                Condition.is_present("$.files"),
+                Condition.string_matches("$.bucketNameLower", "*application*")
+            ),
+            snowflake_model_claims_fact_fn_task_batch.next(check_batch_ingest)
+        ).when(
+            Condition.is_present("$.files"),
+            process_batch
+        ).otherwise(
+            wrap_single_file.next(process_batch)
+        )
+
+
+        # ledger claims of the execution (ledgerKeys) .. marked done on success, released on failure so
+        # the retried notification can claim them again
+        ledger_key = {"ledgerKey": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$.ledgerKey"))}
+        ledger_status = {"#status": "status"}
+        ledger_retry = {
+            "errors": ["DynamoDB.ProvisionedThroughputExceededException", "DynamoDB.RequestLimitExceeded",
+                       "DynamoDB.InternalServerErrorException"],
+            "interval": Duration.seconds(2),
+            "max_attempts": 5,
+            "backoff_rate": 2
+        }
+
+        complete_claim = tasks.DynamoUpdateItem(
+            self, "Complete Ledger Claim",
+            table=self.ledger_table,
+            key=ledger_key,
+            # the state machine has no epoch clock .. done claims expire relative to the claim
+            update_expression="SET #status = :done, expiresAt = claimedAt + :done_seconds, "
+                              "executionArn = :execution_arn",
+            condition_expression="#status = :in_flight",
+            expression_attribute_names=ledger_status,
+            expression_attribute_values={
+                ":done": tasks.DynamoAttributeValue.from_string("done"),
+                ":in_flight": tasks.DynamoAttributeValue.from_string("in-flight"),
+                ":done_seconds": tasks.DynamoAttributeValue.from_number(self.ledger_done_ttl_seconds),
+                ":execution_arn": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$$.Execution.Id"))
+            },
+            result_path=sfn.JsonPath.DISCARD
+        )
+        complete_claim.add_retry(**ledger_retry)
+        # an expired claim may have been taken by another execution .. leave it to that one
+        complete_claim.add_catch(
+            sfn.Pass(self, "Ledger Claim Not In Flight"),
+            errors=["DynamoDB.ConditionalCheckFailedException"],
+            result_path=sfn.JsonPath.DISCARD
+        )
+
+        release_claim = tasks.DynamoDeleteItem(
+            self, "Release Ledger Claim",
+            table=self.ledger_table,
+            key=ledger_key,
+            condition_expression="#status = :in_flight",
+            expression_attribute_names=ledger_status,
+            expression_attribute_values={":in_flight": tasks.DynamoAttributeValue.from_string("in-flight")},
+            result_path=sfn.JsonPath.DISCARD
+        )
+        release_claim.add_retry(**ledger_retry)
+        release_claim.add_catch(
+            sfn.Pass(self, "Ledger Claim Not Released"),
+            errors=["DynamoDB.ConditionalCheckFailedException"],
+            result_path=sfn.JsonPath.DISCARD
+        )
+
+        complete_claims = sfn.Map(
+            self, "Complete Ledger Claims",
+            items_path="$.ledgerKeys",
+            item_selector={"ledgerKey.$": "$$.Map.Item.Value"},
+            max_concurrency=LEDGER_MAX_CONCURRENCY,
+            result_path=sfn.JsonPath.DISCARD
+        )
+        complete_claims.item_processor(complete_claim)
+
+        release_claims = sfn.Map(
+            self, "Release Ledger Claims",
+            items_path="$.ledgerKeys",
+            item_selector={"ledgerKey.$": "$$.Map.Item.Value"},
+            max_concurrency=LEDGER_MAX_CONCURRENCY,
+            result_path=sfn.JsonPath.DISCARD
+        )
+        release_claims.item_processor(release_claim)
+
+        # the error of the run, not of the release, fails the execution
+        run_failed = sfn.Fail(self, "Run Failed", error_path="$.runError.Error", cause_path="$.runError.Cause")
+        release_claims.add_catch(run_failed, result_path="$.releaseError")
+        check_release = Choice(self, "Check Ledger Release")
+        check_release.when(
+            Condition.is_present("$.ledgerKeys"),
+            release_claims.next(run_failed)
+        ).otherwise(run_failed)
+
+        run_done = sfn.Succeed(self, "Run Done")
+        check_complete = Choice(self, "Check Ledger Complete")
+        check_complete.when(
+            Condition.is_present("$.ledgerKeys"),
+            complete_claims.next(run_done)
+        ).otherwise(run_done)
+
+        # every path above ends in a Succeed or a Fail of this branch .. the claims are settled once per execution
+        run = sfn.Parallel(self, "Run", result_path=sfn.JsonPath.DISCARD)
+        run.branch(batch_choice)
+        run.add_catch(check_release, result_path="$.runError")
+        run.next(check_complete)
 
         self.state_machine = sfn.StateMachine(
             self, id,
             state_machine_name="data-platform-orchestration-state-machine",
-            definition_body=sfn.DefinitionBody.from_chainable(file_size_choice),
+            definition_body=sfn.DefinitionBody.from_chainable(run),
+            timeout=STATE_MACHINE_TIMEOUT,
             logs=sfn.LogOptions(
                 destination=logs.LogGroup(self, "StateMachineLogs", retention=logs.RetentionDays.ONE_WEEK),
                 level=sfn.LogLevel.ALL
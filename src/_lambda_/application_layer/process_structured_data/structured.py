@@ -1,16 +1,19 @@
-import json
-import boto3
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
-import logging
-import io
-import os 
+import os
 
-s3 = boto3.client('s3')
-logger = logging.getLogger()
-logger.setLevel(logging.ERROR)
+from pipeline import convert, fact_model, runtime
 
+# files at or above this size are converted block by block instead of in memory
+STREAMING_MIN_BYTES = int(os.environ.get("STREAMING_MIN_BYTES", str(64 * 1024 * 1024)))
+
+
+def use_streaming(event) -> bool:
+    # an explicit engine from the state machine wins over the size heuristic
+    if event.get("engine"):
+        return event["engine"] == "streaming"
+    return event.get("fileSize", 0) >= STREAMING_MIN_BYTES
+
+
+@runtime.step_handler
 def handler(event, context):
     """
     Expected event:
@@ -21,43 +24,14 @@ def handler(event, context):
         "contentType": "text/csv",
         "fileSize": 123456,
         "destBucket": "destination-bucket",
-        "destPrefix": "curated/"
+        "destPrefix": "application/",
+        "engine": "streaming"  # optional .. "streaming" or "in-memory", defaults by fileSize
     }
     """
-    try:
-        # Read CSV from S3
-        response = s3.get_object(Bucket=event["bucketName"], Key=event["objectKey"])
-        content = response["Body"].read().decode("utf-8")
-
-        # Convert CSV to Parquet
-        df = pd.read_csv(io.StringIO(content))
-        table = pa.Table.from_pandas(df)
-        buffer = io.BytesIO()
-        pq.write_table(table, buffer)
-
-        # Build destination key
-        base_key = event["objectKey"].rsplit(".", 1)[0]  # remove .csv
-        dest_key = f"{event['destPrefix']}{base_key}.parquet"
-
-        # Upload Parquet to destination bucket
-        s3.put_object(
-            Bucket=event["destBucket"],
-            Key=dest_key,
-            Body=buffer.getvalue(),
-            ContentType="application/parquet"
-        )
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps('Successful Step Functions execution! This goes to the next state.')
-        }
-
-    except Exception as e:
-        error_log = {
-            "errorMessage": str(e),
-            "awsRequestId": context.aws_request_id,
-            "objectKey": event.get("objectKey"),
-            "bucketName": event.get("bucketName")
-        }
-        logger.error(json.dumps(error_log))
-        raise e
+    # Convert CSV to Parquet (pyarrow only, see pipeline/convert.py) .. datasets with a fact model
+    # (pipeline/fact_model.py) are written as fact rows with their dimension keys resolved
+    facts = fact_model.builder_for_key(event["objectKey"])
+    if use_streaming(event):
+        convert.csv_streaming(runtime.client("s3"), event, convert.dest_key(event), facts=facts)
+    else:
+        convert.csv_in_memory(runtime.client("s3"), event, convert.dest_key(event), facts=facts)
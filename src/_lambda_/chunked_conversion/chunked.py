@@ -0,0 +1,51 @@
+from pipeline import chunked, convert, runtime
+
+
+@runtime.step_handler
+def plan_handler(event, context):
+    """
+    Expected event:
+    {
+        "bucketName": "source-bucket",
+        "objectKey": "path/to/file.csv",
+        "fileSize": 123456,
+        "destBucket": "destination-bucket",
+        "destPrefix": "curated/",
+        "chunkMB": 128  # optional .. defaults from CHUNKED_CHUNK_MB
+    }
+    """
+    # Split the CSV into newline aligned byte ranges, one Distributed Map item each
+    chunk_bytes = int(event.get("chunkMB", chunked.CHUNK_BYTES // (1024 * 1024))) * 1024 * 1024
+    return chunked.plan(runtime.client("s3"), event, convert.dest_key(event, suffix="/"), chunk_bytes)
+
+
+@runtime.step_handler
+def convert_handler(event, context):
+    """
+    Expected event (one Distributed Map item):
+    {
+        "bucketName": "source-bucket",
+        "objectKey": "path/to/file.csv",
+        "etag": "\\"9b2cf535f27731c974343645a3985328\\"",
+        "header": "claim_id,member_id,...\\n",
+        "destBucket": "destination-bucket",
+        "start": 1048,
+        "end": 134218776,
+        "partNumber": 1,
+        "partKey": "curated/path/to/file/part-00001.parquet"
+    }
+    """
+    # Convert one range to one Parquet part
+    return chunked.convert_part(runtime.client("s3"), event)
+
+
+@runtime.step_handler
+def commit_handler(event, context):
+    """
+    Expected event: the plan_handler output plus
+    {
+        "partResults": [{"partNumber": 1, "key": "curated/path/to/file/part-00001.parquet", "rows": 1000, "bytes": 4096}]
+    }
+    """
+    # Check every part landed, drop stale ones and write the manifest
+    return chunked.commit(runtime.client("s3"), event, event["partResults"])
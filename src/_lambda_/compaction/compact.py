@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+
+from pipeline import compaction, metrics, runtime
+
+logger = logging.getLogger()
+logger.setLevel(logging.ERROR)
+
+# stop starting partitions when less than this is left .. the next scheduled run picks them up
+STOP_MARGIN_MS = int(os.environ.get("STOP_MARGIN_SECONDS", "120")) * 1000
+
+MB = 1024 * 1024
+
+
+@metrics.cold_start
+def handler(event, context):
+    """
+    Expected event:
+    {
+        "bucketName": "curated-bucket",
+        "prefix": "claims/type=structured/",
+        "targetFileMB": 128,  # optional .. defaults from COMPACTION_* env
+        "smallFileMB": 32,
+        "minFiles": 4,
+        "deleteAfterSeconds": 900,
+        "dryRun": false
+    }
+    """
+    try:
+        prefix = event.get("prefix", "claims/type=structured/")
+        dimensions = {
+            "Dataset": metrics.dataset_for_key(prefix),
+            "Layer": metrics.layer_for_bucket(event["bucketName"])
+        }
+        with metrics.invocation(dimensions):
+            report = compaction.compact_prefix(
+                runtime.client("s3"),
+                event["bucketName"],
+                prefix,
+                target_bytes=int(event.get("targetFileMB", compaction.TARGET_FILE_BYTES // MB)) * MB,
+                small_bytes=int(event.get("smallFileMB", compaction.SMALL_FILE_BYTES // MB)) * MB,
+                min_files=int(event.get("minFiles", compaction.MIN_FILES)),
+                delete_after_seconds=int(event.get("deleteAfterSeconds", compaction.DELETE_AFTER_SECONDS)),
+                dry_run=bool(event.get("dryRun", False)),
+                should_stop=lambda: context.get_remaining_time_in_millis() < STOP_MARGIN_MS
+            )
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps(report)
+        }
+
+    except Exception as e:
+        error_log = {
+            "errorMessage": str(e),
+            "awsRequestId": context.aws_request_id,
+            "prefix": event.get("prefix"),
+            "bucketName": event.get("bucketName")
+        }
+        logger.error(json.dumps(error_log))
+        raise e
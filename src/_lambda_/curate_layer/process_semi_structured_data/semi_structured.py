@@ -1,16 +1,18 @@
-import json
-import boto3
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
-import logging
-import io
 import os
 
-s3 = boto3.client('s3')
-logger = logging.getLogger()
-logger.setLevel(logging.ERROR)
+from pipeline import convert, runtime
 
+FLATTEN_NESTED = os.environ.get("FLATTEN_NESTED", "false").lower() == "true"
+
+
+def use_streaming(event) -> bool:
+    # an explicit engine from the state machine wins over the file suffix
+    if event.get("engine"):
+        return event["engine"] == "streaming"
+    return event["objectKey"].lower().endswith(convert.NDJSON_SUFFIXES)
+
+
+@runtime.step_handler
 def handler(event, context):
     """
     Expected event:
@@ -21,43 +23,14 @@ def handler(event, context):
         "contentType": "application/json",
         "fileSize": 123456,
         "destBucket": "destination-bucket",
-        "destPrefix": "curated/"
+        "destPrefix": "curated/",
+        "engine": "streaming",  # optional .. NDJSON only, defaults by .ndjson / .jsonl suffix
+        "flatten": true  # optional .. nested structs to columns, defaults to FLATTEN_NESTED
     }
     """
-    try:
-        # Read JSON from S3
-        response = s3.get_object(Bucket=event["bucketName"], Key=event["objectKey"])
-        content = response["Body"].read().decode("utf-8")
-
-        # Convert JSON to Parquet
-        df = pd.read_json(io.StringIO(content))
-        table = pa.Table.from_pandas(df)
-        buffer = io.BytesIO()
-        pq.write_table(table, buffer)
-
-        # Build destination key
-        base_key = event["objectKey"].rsplit(".", 1)[0]
-        dest_key = f"{event['destPrefix']}{base_key}.parquet"
-
-        # Upload to destination bucket
-        s3.put_object(
-            Bucket=event["destBucket"],
-            Key=dest_key,
-            Body=buffer.getvalue(),
-            ContentType="application/parquet"
-        )
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps('Successful Step Functions execution! This goes to the next state.')
-        }
-
-    except Exception as e:
-        error_log = {
-            "errorMessage": str(e),
-            "awsRequestId": context.aws_request_id,
-            "objectKey": event.get("objectKey"),
-            "bucketName": event.get("bucketName")
-        }
-        logger.error(json.dumps(error_log))
-        raise e
+    # Convert JSON to Parquet (pyarrow only, see pipeline/convert.py)
+    flatten_nested = event.get("flatten", FLATTEN_NESTED)
+    if use_streaming(event):
+        convert.ndjson_streaming(runtime.client("s3"), event, convert.dest_key(event), flatten_nested)
+    else:
+        convert.json_in_memory(runtime.client("s3"), event, convert.dest_key(event), flatten_nested)
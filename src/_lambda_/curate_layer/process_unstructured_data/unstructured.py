@@ -1,12 +1,8 @@
-import boto3
-import json
-import logging
-import os
+from pipeline import partitioning, runtime
+from pipeline.s3_copy import copy_object
 
-s3 = boto3.client('s3')
-logger = logging.getLogger()
-logger.setLevel(logging.ERROR)
 
+@runtime.step_handler
 def handler(event, context):
     """
     Expected event:
@@ -20,30 +16,12 @@ def handler(event, context):
         "destPrefix": "curated/"
     }
     """
-    try:
-        # Read the object from the source bucket
-        response = s3.get_object(Bucket=event["bucketName"], Key=event["objectKey"])
-        content = response["Body"].read()  # ✅ Read as bytes, not text
-
-        # Write it to the destination bucket
-        s3.put_object(
-            Bucket=event["destBucket"],
-            Key=f"{event['destPrefix']}{event['objectKey']}",
-            Body=content,
-            ContentType=event.get("contentType", "binary/octet-stream")
-        )
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps('Successful Step Functions execution! This goes to the next state.')
-        }
-
-    except Exception as e:
-        error_log = {
-            "errorMessage": str(e),
-            "awsRequestId": context.aws_request_id,
-            "objectKey": event.get("objectKey"),
-            "bucketName": event.get("bucketName")
-        }
-        logger.error(json.dumps(error_log))
-        raise e
+    # Server-side copy to the destination bucket .. bytes never pass through the function
+    # (multipart UploadPartCopy above the 5 GB single copy limit, content type and metadata kept)
+    copy_object(
+        runtime.client("s3"),
+        source_bucket=event["bucketName"],
+        source_key=event["objectKey"],
+        dest_bucket=event["destBucket"],
+        dest_key=partitioning.object_key(event["destPrefix"], event["objectKey"])
+    )
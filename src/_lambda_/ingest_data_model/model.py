@@ -1,29 +1,132 @@
 import os
 import json
 import time
+import uuid
 import base64
-import jwt
-import requests
+
+from pipeline import metrics, snowpipe_status
+
+# Snowpipe accepts at most 5000 files per insertFiles request
+MAX_FILES_PER_REQUEST = 5000
+
+# key pair JWTs are valid for at most one hour .. refresh a minute before expiry
+JWT_LIFETIME_SECONDS = int(os.environ.get("JWT_LIFETIME_SECONDS", "3540"))
+JWT_REFRESH_MARGIN_SECONDS = 60
+
+# load status: polled for up to LOAD_STATUS_POLL_SECONDS per invocation (under the function timeout), the state
+# machine waits and invokes again until every file settled or LOAD_STATUS_TIMEOUT_SECONDS after the submission
+LOAD_STATUS_POLL_SECONDS = float(os.environ.get("LOAD_STATUS_POLL_SECONDS", "50"))
+LOAD_STATUS_TIMEOUT_SECONDS = float(os.environ.get("LOAD_STATUS_TIMEOUT_SECONDS", "3600"))
+
+# kept at module scope so warm invocations skip config parsing, JWT signing and the TLS handshake
+_config = None
+_jwt = {"token": None, "expires_at": 0}
+_session = None
+
+
+def get_config() -> dict:
+    global _config
+    if _config is None:
+        _config = {
+            "account": os.environ["SNOWFLAKE_ACCOUNT"],
+            "user": os.environ["SNOWFLAKE_USER"],
+            "private_key": base64.b64decode(os.environ["SNOWFLAKE_PRIVATE_KEY"]),
+            "snowflake_pipe": json.loads(os.environ["SNOWFLAKE_PIPE"]),
+            # override to point the loader at a local stand-in (benchmarks)
+            "base_url": os.environ.get("SNOWFLAKE_BASE_URL")
+        }
+    return _config
+
 
 def generate_jwt():
-    private_key = base64.b64decode(os.environ["SNOWFLAKE_PRIVATE_KEY"])
-    account = os.environ["SNOWFLAKE_ACCOUNT"]
-    user = os.environ["SNOWFLAKE_USER"]
+    import jwt  # PyJWT + cryptography, only needed when a token is signed
+
+    config = get_config()
+    account = config["account"]
+    user = config["user"]
+    now = int(time.time())
 
     payload = {
         "iss": f"{account}.{user}",
         "sub": f"{account}.{user}",
-        "iat": int(time.time()),
-        "exp": int(time.time()) + 60
+        "iat": now,
+        "exp": now + JWT_LIFETIME_SECONDS
     }
 
-    return jwt.encode(payload, private_key, algorithm="RS256")
+    _jwt["token"] = jwt.encode(payload, config["private_key"], algorithm="RS256")
+    _jwt["expires_at"] = payload["exp"]
+    return _jwt["token"]
+
 
-def create_post_url(key: str, account: str, snowflake_pipe: dict) -> str:
+def get_jwt(force_refresh: bool = False):
+    if force_refresh or _jwt["token"] is None or time.time() >= _jwt["expires_at"] - JWT_REFRESH_MARGIN_SECONDS:
+        return generate_jwt()
+    return _jwt["token"]
+
+
+def get_session():
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # keep-alive pool reused across warm invocations
+        _session = requests.Session()
+        _session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return _session
+
+
+def create_post_url(key: str, account: str, snowflake_pipe: dict, base_url: str = None) -> str:
+    base_url = base_url or f"https://{account}.snowflakecomputing.com"
     if "claims/model/fact/" in key.lower():
-        return f"https://{account}.snowflakecomputing.com/v1/data/pipes/{snowflake_pipe['FACT_CLAIMS']}/insertFiles"
+        return f"{base_url}/v1/data/pipes/{snowflake_pipe['FACT_CLAIMS']}/insertFiles"
     return ""
 
+
+def event_object_keys(event) -> list:
+    # batch mode: a micro batch from the meta lambda carries a list of files
+    if "files" in event:
+        return [f["objectKey"] for f in event["files"]]
+    if "objectKeys" in event:
+        return list(event["objectKeys"])
+    return [event["objectKey"]]
+
+
+def insert_files(url: str, paths: list) -> list:
+    """Submit paths to one pipe, up to MAX_FILES_PER_REQUEST per insertFiles call."""
+    responses = []
+    for start in range(0, len(paths), MAX_FILES_PER_REQUEST):
+        body = {"files": [{"path": path} for path in paths[start:start + MAX_FILES_PER_REQUEST]]}
+
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"Bearer {get_jwt(force_refresh=attempt > 0)}",
+                "Content-Type": "application/json"
+            }
+            response = get_session().post(url, params={"requestId": str(uuid.uuid4())}, headers=headers, json=body)
+            # a rejected token (e.g. key rotation) gets one retry with a freshly signed JWT
+            if response.status_code != 401:
+                break
+
+        print(f"Snowpipe response: {response.status_code} - {response.text}")
+
+        if response.status_code != 200:
+            raise Exception(f"Snowpipe failed: {response.text}")
+        responses.append(response.json())
+    return responses
+
+
+def snowpipe_get(url: str, params: dict):
+    """GET an insertReport / loadHistoryScan url, a rejected token gets one retry like insert_files."""
+    for attempt in range(2):
+        headers = {"Authorization": f"Bearer {get_jwt(force_refresh=attempt > 0)}", "Accept": "application/json"}
+        response = get_session().get(url, params=params, headers=headers)
+        if response.status_code != 401:
+            break
+    return response
+
+
+@metrics.cold_start
 def lambda_handler(event, context):
     """
     Expected event:
@@ -36,33 +139,36 @@ def lambda_handler(event, context):
         "destBucket": "N/A",
         "destPrefix": "N/A"
     }
+    or a batch:
+    {
+        "files": [{"objectKey": "path/to/file1.parquet", ...}, ...]
+    }
     """
     try:
-        snowflake_pipe = json.loads(os.environ["SNOWFLAKE_PIPE"])
-        account = os.environ["SNOWFLAKE_ACCOUNT"]
-
-        jwt_token = generate_jwt()
-        url = create_post_url(event["objectKey"], account, snowflake_pipe)
-
-        if not url:
-            raise ValueError(f"No matching Snowpipe found for key: {event['objectKey']}")
+        with metrics.invocation(metrics.event_dimensions(event)):
+            config = get_config()
+            object_keys = event_object_keys(event)
 
-        headers = {
-            "Authorization": f"Bearer {jwt_token}",
-            "Content-Type": "application/json"
-        }
-
-        body = {"files": [{"path": event["objectKey"]}]}
-        response = requests.post(url, headers=headers, json=body)
+            # group keys per pipe so each pipe gets as few insertFiles calls as possible
+            paths_per_url = {}
+            for object_key in object_keys:
+                url = create_post_url(object_key, config["account"], config["snowflake_pipe"], config["base_url"])
+                if not url:
+                    raise ValueError(f"No matching Snowpipe found for key: {object_key}")
+                paths_per_url.setdefault(url, []).append(object_key)
 
-        print(f"Snowpipe response: {response.status_code} - {response.text}")
+            submitted_at = time.time()
+            for url, paths in paths_per_url.items():
+                with metrics.phase("InsertFiles"):
+                    insert_files(url, paths)
+                metrics.add("Files", len(paths))
 
-        if response.status_code != 200:
-            raise Exception(f"Snowpipe failed: {response.text}")
-        
+        # a 200 only means the files are queued .. load_status_handler follows them through the pipes
         return {
             "statusCode": 200,
-            "body": f"Successfully triggered Snowpipe for {event['objectKey']}"
+            "body": f"Successfully triggered Snowpipe for {len(object_keys)} file(s)",
+            "submittedAt": submitted_at,
+            "pipes": {snowpipe_status.pipe_url(url): paths for url, paths in paths_per_url.items()}
         }
 
     except Exception as e:
@@ -70,3 +176,28 @@ def lambda_handler(event, context):
             "statusCode": 500,
             "error": str(e)
         }
+
+
+@metrics.cold_start
+def load_status_handler(event, context):
+    """
+    Expected event (the lambda_handler output, loadStatus is added by the previous poll):
+    {
+        "statusCode": 200,
+        "submittedAt": 1700000000.0,
+        "pipes": {"https://<account>.snowflakecomputing.com/v1/data/pipes/<pipe>": ["path/to/file1.parquet", ...]},
+        "loadStatus": {"state": "pending", "pipes": {...}, "files": {...}, "failed": [...], "nextPollSeconds": 4}
+    }
+    Returns the event with loadStatus updated, pipes dropped (loadStatus tracks the pending paths, one copy keeps
+    the state under the 256 KB payload limit) .. loadStatus.state is "pending", "loaded", "failed" or "timeout".
+    """
+    status = event.get("loadStatus") or snowpipe_status.new_status(event["pipes"])
+    # dimensions of the submitted files, the event itself carries no object key
+    object_keys = [path for state in status["pipes"].values() for path in state["pending"][:1]]
+    with metrics.invocation(metrics.event_dimensions({"objectKeys": object_keys})):
+        poller = snowpipe_status.LoadStatusPoller(snowpipe_get)
+        with metrics.phase("LoadStatus"):
+            settled = poller.poll(status["pipes"], event["submittedAt"], LOAD_STATUS_POLL_SECONDS)
+        snowpipe_status.update(status, settled, event["submittedAt"], time.time(), LOAD_STATUS_TIMEOUT_SECONDS)
+        print(f"Snowpipe load status: {status['state']} {status['files']}")
+    return {**{name: value for name, value in event.items() if name != "pipes"}, "loadStatus": status}
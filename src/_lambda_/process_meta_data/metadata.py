@@ -1,91 +1,377 @@
 import json
 import urllib.parse
-import boto3
 import os
+import time
+import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import compaction, glue_sources, ledger, metrics, routing, runtime
 
-s3 = boto3.client('s3')
-step_functions = boto3.client('stepfunctions')
 logger = logging.getLogger()
 logger.setLevel(logging.ERROR)
 
+# object versions already processed are skipped, those in flight retried later (LEDGER_TABLE / LEDGER_PATH, off
+# when unset) .. the state machine marks claims done or releases them when the execution ends
+dispatch_ledger = ledger.from_env()
+
 STEP_FUNCTIONS_STATE_MACHINE_ARN = os.environ.get("STATE_MACHINE_ARN")
 
+# bounded pool for the HEAD + StartExecution round trips of one notification batch
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "16"))
 
-def handler(event, context):
+# "single" starts one execution per object, "batch" coalesces objects into one execution per micro batch
+DISPATCH_MODE = os.environ.get("DISPATCH_MODE", "single").lower()
+
+# micro batch limits per bucket layer, set by the stack (data_lake_stack/buckets.py DISPATCH_BATCH_LIMITS)
+# .. the time window itself is enforced by the SQS event source
+BATCH_LIMITS = json.loads(os.environ.get("BATCH_LIMITS", "{}"))
+
+# StartExecution input is limited to 256 KB .. the files of a batch stay under this, the rest is left for the
+# batch envelope and the glue batch entries that replace glue routed files
+MAX_INPUT_BYTES = int(os.environ.get("MAX_INPUT_BYTES", str(240 * 1024)))
+
+# glue routed files of a micro batch become one Glue job run per dataset, listed in a manifest object
+# (kept outside the notification prefixes so writing it does not trigger another dispatch)
+GLUE_MANIFEST_PREFIX = os.environ.get("GLUE_MANIFEST_PREFIX", "_manifests/glue/")
+GLUE_BATCH_MAX_FILES = int(os.environ.get("GLUE_BATCH_MAX_FILES", "500"))
+
+# describe_record result for objects that are acknowledged but not dispatched
+SKIPPED = {"skipped": True}
+
+# describe_record result for objects another execution is still processing
+DEFERRED = {"deferred": True}
+
+
+class MicroBatcher:
+    """
+    Buffer items until the file count, total object bytes or serialized input bytes limit is reached.
+    add() returns the batches closed by the new item, flush() returns whatever is left.
+    """
+
+    def __init__(self, max_files: int, max_bytes: int, max_input_bytes: int = MAX_INPUT_BYTES):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_input_bytes = max_input_bytes
+        self.items = []
+        self.total_bytes = 0
+        self.input_bytes = 0
+
+    def add(self, item, size: int, input_bytes: int = 0) -> list:
+        closed = []
+        # close the open batch first when the new item would overflow it
+        if self.items and (self.total_bytes + size > self.max_bytes
+                           or self.input_bytes + input_bytes > self.max_input_bytes):
+            closed.append(self.flush())
+
+        self.items.append(item)
+        self.total_bytes += size
+        self.input_bytes += input_bytes
+
+        if (len(self.items) >= self.max_files or self.total_bytes >= self.max_bytes
+                or self.input_bytes >= self.max_input_bytes):
+            closed.append(self.flush())
+        return closed
+
+    def flush(self) -> list:
+        batch = self.items
+        self.items = []
+        self.total_bytes = 0
+        self.input_bytes = 0
+        return batch
+
+
+def layer_for_bucket(bucket_name: str) -> str:
+    bucket_name_lower = bucket_name.lower()
+    for layer in ("stage", "curated", "application"):
+        if layer in bucket_name_lower:
+            return layer
+    raise ValueError(f"Unknown data lake layer for bucket: {bucket_name}")
+
+
+def build_step_functions_input(bucket_name: str, object_key: str, content_type: str, file_size: int) -> dict:
+    prefix = '/'.join(object_key.split("/")[:-1])
+    layer = layer_for_bucket(bucket_name)
+
+    if layer == "stage":
+        dest_bucket, dest_prefix = os.environ.get("CURATED_BUCKET"), prefix
+    elif layer == "curated":
+        dest_bucket, dest_prefix = os.environ.get("APPLICATION_BUCKET"), prefix
+    else:
+        dest_bucket, dest_prefix = "N/A", "N/A"
+
+    step_functions_input = {
+        "bucketName": bucket_name,
+        "bucketNameLower": bucket_name.lower(),
+        "objectKey": object_key,
+        "contentType": content_type,
+        "fileSize": file_size,
+        "destBucket": dest_bucket,
+        "destPrefix": dest_prefix
+    }
+
+    # lambda / streaming / glue from the routing table .. without a route the state machine checks fileSize
+    route = routing.decide(layer, object_key, file_size)
+    if route:
+        step_functions_input.update(route.as_input())
+    return step_functions_input
+
+
+def iter_s3_records(event: dict):
+    """
+    Yield (item_identifier, s3_record) for a direct S3 notification or an SQS batch of S3 notifications.
+    SQS messages are identified by messageId so failures can be reported back to the queue.
+    """
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            body = json.loads(record['body'])
+            # s3:TestEvent is sent once when the notification is configured
+            for s3_record in body.get('Records', []):
+                yield record['messageId'], s3_record
+        else:
+            object_key = urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8')
+            yield object_key, record
+
+
+def is_sqs_event(event: dict) -> bool:
+    """SQS batches report failed messages through batchItemFailures, direct S3 invokes can only fail."""
+    return any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', []))
+
+
+def log_error(e: Exception, context, bucket_name: str, object_key: str):
+    error_log = {
+        "errorMessage": str(e),
+        "awsRequestId": getattr(context, "aws_request_id", "N/A"),
+        "objectKey": object_key if object_key else "Not available",
+        "bucketName": bucket_name if bucket_name else "Not available"
+    }
+    logger.error(json.dumps(error_log))
+
+
+def describe_record(record: dict, context) -> dict:
+    """
+    HEAD the object behind one S3 record and build its state machine input.
+    Returns None when the lookup fails, SKIPPED for compaction output (its rows were already dispatched)
+    and for object versions the ledger has done, DEFERRED for those still claimed by another execution.
+    """
     bucket_name = None
     object_key = None
     try:
-        bucket_name = event['Records'][0]['s3']['bucket']['name']
-        object_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-        prefix = '/'.join(object_key.split("/")[:-1])
+        bucket_name = record['s3']['bucket']['name']
+        object_key = urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8')
 
-        response = s3.head_object(Bucket=bucket_name, Key=object_key)
+        response = runtime.client('s3').head_object(Bucket=bucket_name, Key=object_key)
+        if compaction.is_compacted(response.get('Metadata')):
+            return SKIPPED
         content_type = response['ContentType']
         file_size = response['ContentLength']  # File size in bytes
 
-        # Prepare input for state machine
-        if "stage" in bucket_name.lower():
-            step_functions_input = {
-                "bucketName": bucket_name,
-                "bucketNameLower": bucket_name.lower(),
-                "objectKey": object_key,
-                "contentType": content_type,
-                "fileSize": file_size,
-                "destBucket": os.environ.get("CURATED_BUCKET"),
-                "destPrefix": prefix
-            }
-            step_functions.start_execution(
-                stateMachineArn=STEP_FUNCTIONS_STATE_MACHINE_ARN,
-                input=json.dumps(step_functions_input)
-            )
-            return {
-                'statusCode': 200,
-                'body': json.dumps('Successful step functions execution!')
-            }
-        elif "curated" in bucket_name.lower():
-            step_functions_input = {
-                "bucketName": bucket_name,
-                "bucketNameLower": bucket_name.lower(),
-                "objectKey": object_key,
-                "contentType": content_type,
-                "fileSize": file_size,
-                "destBucket": os.environ.get("APPLICATION_BUCKET"),
-                "destPrefix": prefix
-            }
-            step_functions.start_execution(
-                stateMachineArn=STEP_FUNCTIONS_STATE_MACHINE_ARN,
-                input=json.dumps(step_functions_input)
-            )
-            return {
-                'statusCode': 200,
-                'body': json.dumps('Successful step functions execution!')
-            }
-        elif "application" in bucket_name.lower():
-            step_functions_input = {
+        step_functions_input = build_step_functions_input(bucket_name, object_key, content_type, file_size)
+
+        if dispatch_ledger is not None:
+            entry_key = ledger.ledger_key(bucket_name, object_key, response.get('ETag'))
+            if not dispatch_ledger.claim(entry_key):
+                # in flight .. the claim is released if that execution fails, so look again later
+                return SKIPPED if dispatch_ledger.status(entry_key) == ledger.DONE else DEFERRED
+            # settled by the state machine (a micro batch lists the keys of all its files)
+            step_functions_input["ledgerKeys"] = [entry_key]
+        return step_functions_input
+
+    except Exception as e:
+        log_error(e, context, bucket_name, object_key)
+        return None
+
+
+def start_execution(step_functions_input: dict, context) -> bool:
+    try:
+        runtime.client('stepfunctions').start_execution(
+            stateMachineArn=STEP_FUNCTIONS_STATE_MACHINE_ARN,
+            input=json.dumps(step_functions_input)
+        )
+        return True
+
+    except Exception as e:
+        log_error(e, context, step_functions_input.get("bucketName"), step_functions_input.get("objectKey"))
+        return False
+
+
+def build_glue_batches(files: list) -> tuple:
+    """
+    Split glue routed files off a micro batch and group them per bucket, dataset format and destination.
+    Each group is written to a manifest for one Glue job run. Returns (remaining files, glue batches).
+    """
+    remaining, groups = [], {}
+    for f in files:
+        if f.get("route") != "glue":
+            remaining.append(f)
+            continue
+        group_key = (f["bucketName"], routing.data_format_for_key(f["objectKey"]), f["destBucket"], f["destPrefix"])
+        groups.setdefault(group_key, []).append(f)
+
+    glue_batches = []
+    for (bucket_name, data_format, dest_bucket, dest_prefix), group in groups.items():
+        for start in range(0, len(group), GLUE_BATCH_MAX_FILES):
+            chunk = group[start:start + GLUE_BATCH_MAX_FILES]
+            manifest_key = f"{GLUE_MANIFEST_PREFIX}{time.strftime('%Y/%m/%d')}/{uuid.uuid4()}.json"
+            glue_sources.write_manifest(runtime.client('s3'), bucket_name, manifest_key, [f["objectKey"] for f in chunk])
+            glue_batches.append({
                 "bucketName": bucket_name,
                 "bucketNameLower": bucket_name.lower(),
-                "objectKey": object_key,
-                "contentType": content_type,
-                "fileSize": file_size,
-                "destBucket": "N/A",
-                "destPrefix": "N/A"
-            }
-            step_functions.start_execution(
-                stateMachineArn=STEP_FUNCTIONS_STATE_MACHINE_ARN,
-                input=json.dumps(step_functions_input)
-            )
-            return {
-                'statusCode': 200,
-                'body': json.dumps('Successful step functions execution!')
-            }
+                "dataFormat": data_format,
+                "manifestKey": manifest_key,
+                "destBucket": dest_bucket,
+                "destPrefix": dest_prefix,
+                "fileCount": len(chunk),
+                "totalBytes": sum(f["fileSize"] for f in chunk)
+            })
+    return remaining, glue_batches
+
+
+def build_batch_input(layer: str, files: list) -> dict:
+    batch_input = {
+        "layer": layer,
+        "bucketNameLower": files[0]["bucketNameLower"],
+        "fileCount": len(files),
+        "totalBytes": sum(f["fileSize"] for f in files)
+    }
+    ledger_keys = [entry_key for f in files for entry_key in f.get("ledgerKeys", [])]
+    if ledger_keys:
+        # glue routed files leave the file list .. their claims are settled with the rest of the batch
+        batch_input["ledgerKeys"] = ledger_keys
+        files = [{k: v for k, v in f.items() if k != "ledgerKeys"} for f in files]
+    batch_input["files"], batch_input["glueBatches"] = build_glue_batches(files)
+    return batch_input
 
+
+def start_batch(layer: str, files: list, context) -> bool:
+    try:
+        batch_input = build_batch_input(layer, files)
     except Exception as e:
-        error_log = {
-            "errorMessage": str(e),
-            "awsRequestId": getattr(context, "aws_request_id", "N/A"),
-            "objectKey": object_key if object_key else "Not available",
-            "bucketName": bucket_name if bucket_name else "Not available"
+        log_error(e, context, files[0].get("bucketName"), f"{len(files)} file(s)")
+        return False
+    return start_execution(batch_input, context)
+
+
+def dispatch_batches(described: list, executor: ThreadPoolExecutor, context) -> set:
+    """
+    Coalesce described objects into one execution per layer micro batch.
+    Returns the item identifiers whose execution could not be started.
+    """
+    batchers = {}
+    batches = []
+    for item_identifier, step_functions_input in described:
+        layer = layer_for_bucket(step_functions_input["bucketName"])
+        if layer not in batchers:
+            limits = BATCH_LIMITS[layer]
+            batchers[layer] = MicroBatcher(limits["maxFiles"], limits["maxBytes"])
+        # the file's share of the execution input .. its JSON plus the list separator
+        input_bytes = len(json.dumps(step_functions_input)) + 2
+        for batch in batchers[layer].add((item_identifier, step_functions_input), step_functions_input["fileSize"],
+                                         input_bytes):
+            batches.append((layer, batch))
+
+    # the SQS batching window already bounded how long these waited .. send what is left
+    for layer, batcher in batchers.items():
+        batch = batcher.flush()
+        if batch:
+            batches.append((layer, batch))
+
+    started = list(executor.map(
+        lambda entry: start_batch(entry[0], [item[1] for item in entry[1]], context),
+        batches
+    ))
+
+    failed = set()
+    for (_, batch), ok in zip(batches, started):
+        if not ok:
+            failed.update(item_identifier for item_identifier, _ in batch)
+    return failed
+
+
+def release_claims(described: list, failed: set, context):
+    """
+    Release the claims of objects whose execution could not be started so the retry can claim them.
+    Started executions keep their claims in flight until the state machine settles them.
+    """
+    for item_identifier, step_functions_input in described:
+        if item_identifier not in failed:
+            continue
+        for entry_key in step_functions_input.get("ledgerKeys", []):
+            try:
+                dispatch_ledger.release(entry_key)
+            except Exception as e:
+                # an unreleased claim expires after LEDGER_IN_FLIGHT_SECONDS
+                log_error(e, context, step_functions_input.get("bucketName"), step_functions_input.get("objectKey"))
+
+
+@metrics.cold_start
+def handler(event, context):
+    records = list(iter_s3_records(event))
+    if not records:
+        return {
+            'statusCode': 200,
+            'batchItemFailures': [],
+            'body': json.dumps('No records in event')
         }
-        logger.error(json.dumps(error_log))
-        raise e
\ No newline at end of file
+
+    first_record = records[0][1]['s3']
+    dimensions = {
+        "Dataset": metrics.dataset_for_key(urllib.parse.unquote_plus(first_record['object']['key'])),
+        "Layer": metrics.layer_for_bucket(first_record['bucket']['name'])
+    }
+    with metrics.invocation(dimensions), ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(records))) as executor:
+        with metrics.phase("Describe"):
+            inputs = list(executor.map(lambda entry: describe_record(entry[1], context), records))
+
+        failed = {item_identifier for (item_identifier, _), step_functions_input in zip(records, inputs)
+                  if step_functions_input is None}
+        described = [(item_identifier, step_functions_input)
+                     for (item_identifier, _), step_functions_input in zip(records, inputs)
+                     if step_functions_input not in (None, SKIPPED, DEFERRED)]
+        skipped = {item_identifier for (item_identifier, _), step_functions_input in zip(records, inputs)
+                   if step_functions_input is SKIPPED}
+        deferred = {item_identifier for (item_identifier, _), step_functions_input in zip(records, inputs)
+                    if step_functions_input is DEFERRED}
+
+        with metrics.phase("Dispatch"):
+            if DISPATCH_MODE == "batch":
+                failed.update(dispatch_batches(described, executor, context))
+            else:
+                started = list(executor.map(lambda entry: start_execution(entry[1], context), described))
+                failed.update(item_identifier for (item_identifier, _), ok in zip(described, started) if not ok)
+
+        if dispatch_ledger is not None and failed:
+            with metrics.phase("Ledger"):
+                release_claims(described, failed, context)
+
+        metrics.add("Records", len(records))
+        metrics.add("Skipped", len(skipped))
+        metrics.add("Failed", len(failed))
+        metrics.add("Deferred", len(deferred))
+        # bytes of the objects handed to the state machine
+        metrics.add("BytesIn", sum(step_functions_input["fileSize"] for _, step_functions_input in described),
+                    metrics.BYTES)
+
+    # deferred messages go back to the queue .. a direct duplicate of an object in flight is dropped
+    retried = failed | deferred if is_sqs_event(event) else failed
+    batch_item_failures = [{"itemIdentifier": item_identifier} for item_identifier in sorted(retried)]
+    item_count = len({item_identifier for item_identifier, _ in records})
+    dispatched = {item_identifier for item_identifier, _ in described} - failed
+
+    # nothing succeeded .. fail the invocation so the whole batch is retried
+    if len(failed) == item_count:
+        raise RuntimeError(f"All {item_count} record(s) failed: {json.dumps(batch_item_failures)}")
+    # an async S3 invoke ignores batchItemFailures .. only a raised error gets the event retried
+    # (with LEDGER_TABLE set records already dispatched are deferred or skipped on the retry,
+    # without the ledger the retry starts a second execution for each of them)
+    if failed and not is_sqs_event(event):
+        raise RuntimeError(f"{len(failed)} of {item_count} record(s) failed: {json.dumps(batch_item_failures)}")
+
+    return {
+        'statusCode': 200,
+        'batchItemFailures': batch_item_failures,
+        'body': json.dumps(
+            f'Dispatched {len(dispatched)} of {item_count} record(s)'
+            f' ({len(skipped - dispatched - failed)} skipped, {len(deferred - dispatched - failed)} deferred)!'
+        )
+    }
@@ -1,28 +1,81 @@
+import json
 import sys
+import boto3
 from awsglue.context import GlueContext
+from awsglue.job import Job
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
-from pyspark.sql.functions import col
 
-# Get job arguments
-args = getResolvedOptions(sys.argv, ['JOB_NAME', 'SOURCE_BUCKET', 'SOURCE_KEY', 'DEST_BUCKET', 'DEST_PREFIX'])
+# shared pipeline package is shipped with --extra-py-files
+from pipeline import compaction, fact_model, glue_sources, parquet_profile, partitioning, schema_registry
+
+# Get job arguments .. sources are one of SOURCE_KEY / SOURCE_KEYS / MANIFEST_KEY / SOURCE_PREFIX,
+# --REFERENCE_BUCKET (dimension snapshots for the fact keys) is optional
+args = getResolvedOptions(
+    sys.argv,
+    ['JOB_NAME', 'SOURCE_BUCKET', 'DEST_BUCKET', 'DEST_PREFIX'] + glue_sources.present_args(sys.argv)
+    + (['REFERENCE_BUCKET'] if '--REFERENCE_BUCKET' in sys.argv else [])
+)
 
 # Initialize Spark and Glue contexts
 sc = SparkContext()
 glueContext = GlueContext(sc)
 spark = glueContext.spark_session
+partitioning.enable_dynamic_overwrite(spark)
+
+job = Job(glueContext)
+job.init(args['JOB_NAME'], args)
 
 # Construct S3 paths
-source_path = f"s3://{args['SOURCE_BUCKET']}/{args['SOURCE_KEY']}"
-dest_path = f"s3://{args['DEST_BUCKET']}/processed/"
+source_keys = glue_sources.source_keys(args, boto3.client('s3'))
+dest_path = partitioning.dest_path(args['DEST_BUCKET'], args['DEST_PREFIX'])
+# partition value of this run's output (pipeline/partitioning.py)
+run = partitioning.ingest_run(source_keys)
+
+if source_keys:
+    # Read CSV data from source bucket .. all listed objects in one Spark job, no inferSchema
+    df = spark.read.option("header", "true").csv(glue_sources.s3_paths(args['SOURCE_BUCKET'], source_keys))
+    dataset_key = source_keys[0]
+else:
+    # Read the prefix .. the job bookmark skips objects converted by earlier runs, compaction outputs hold
+    # rows that were read as their inputs (pipeline/compaction.py)
+    df = glueContext.create_dynamic_frame.from_options(
+        connection_type="s3",
+        connection_options={
+            "paths": [f"s3://{args['SOURCE_BUCKET']}/{args['SOURCE_PREFIX']}"],
+            "recurse": True,
+            "exclusions": json.dumps(compaction.INCREMENTAL_EXCLUSIONS)
+        },
+        format="csv",
+        format_options={"withHeader": True},
+        transformation_ctx="source"
+    ).toDF()
+    dataset_key = args['SOURCE_PREFIX']
+
+if not df.columns or not df.head(1):
+    print("No new objects to process")
+else:
+    # Cast to the declared dataset schema so every run writes the same Parquet schema
+    # (date columns of a fact model stay text, their keys are derived from it)
+    model = fact_model.model_for_key(dataset_key)
+    columns = schema_registry.columns_for_key(dataset_key)
+    if columns:
+        df = schema_registry.conform_spark(df, fact_model.source_columns(model, columns) if model else columns)
 
-# Read CSV data from source bucket
-df = spark.read.option("header", "true").csv(source_path)
+    # FACT_* rows like the application Lambda writes them (pipeline/fact_model.py) .. dimension keys from
+    # broadcast joins on the same snapshots
+    df = fact_model.glue_build(spark, df, dataset_key, args, boto3.client('cloudwatch'))
 
-# Basic transformation: filter out rows with nulls in a specific column
-# df_cleaned = df.filter(col("amount_allowed").isNotNull())
+    # Write the cleaned data to destination bucket in Parquet format
+    # partitioned by service month + ingest run, only the partitions of this run are replaced
+    df, partition_columns = partitioning.add_partition_columns(df, run)
+    # codec, row group size and sort order from the dataset's Parquet profile
+    profile = parquet_profile.profile_for_key(dataset_key)
+    df = parquet_profile.spark_sort(df, profile, partition_columns)
+    df.write.mode("overwrite").partitionBy(*partition_columns) \
+        .options(**parquet_profile.spark_write_options(profile)).parquet(dest_path)
 
-# Write the cleaned data to destination bucket in Parquet format
-df.write.mode("overwrite").parquet(dest_path)
+    print(f"✅ Data processed and written to {dest_path}")
 
-print(f"✅ Data processed and written to {dest_path}")
+# Record what this run read in the job bookmark
+job.commit()
@@ -1,23 +1,59 @@
 import sys
+import boto3
+from concurrent.futures import ThreadPoolExecutor
 from awsglue.context import GlueContext
+from awsglue.job import Job
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
-from pyspark.sql.functions import col
 
-# Get job arguments
-args = getResolvedOptions(sys.argv, ['JOB_NAME', 'SOURCE_BUCKET', 'SOURCE_KEY', 'DEST_BUCKET'])
+# shared pipeline package is shipped with --extra-py-files
+from pipeline import glue_sources, partitioning
+from pipeline.s3_copy import copy_object
+
+# objects copied concurrently .. each copy is server-side, the driver only issues requests
+COPY_WORKERS = 16
+
+# Get job arguments .. sources are one of SOURCE_KEY / SOURCE_KEYS / MANIFEST_KEY / SOURCE_PREFIX
+args = getResolvedOptions(
+    sys.argv,
+    ['JOB_NAME', 'SOURCE_BUCKET', 'DEST_BUCKET', 'DEST_PREFIX'] + glue_sources.present_args(sys.argv)
+)
 
 # Initialize Spark and Glue contexts
 sc = SparkContext()
 glueContext = GlueContext(sc)
-spark = glueContext.spark_session
 
-# Construct S3 paths
-source_path = f"s3://{args['SOURCE_BUCKET']}/{args['SOURCE_KEY']}"
-dest_path = f"s3://{args['DEST_BUCKET']}/processed/"
+job = Job(glueContext)
+job.init(args['JOB_NAME'], args)
+
+s3 = boto3.client('s3')
+
+
+def already_copied(key: str) -> bool:
+    # binary objects carry no bookmarkable records .. an object of the same size at the destination counts as done
+    try:
+        source = s3.head_object(Bucket=args['SOURCE_BUCKET'], Key=key)
+        dest = s3.head_object(Bucket=args['DEST_BUCKET'], Key=partitioning.object_key(args['DEST_PREFIX'], key))
+    except s3.exceptions.ClientError:
+        return False
+    return source["ContentLength"] == dest["ContentLength"]
+
+
+source_keys = glue_sources.source_keys(args, s3)
+if not source_keys:
+    # prefix run .. only pick up what earlier runs did not copy
+    source_keys = [key for key in glue_sources.list_prefix(s3, args['SOURCE_BUCKET'], args['SOURCE_PREFIX'])
+                   if not already_copied(key)]
+
+# Copy the binary objects server-side to the destination bucket
+with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+    list(executor.map(
+        lambda key: copy_object(
+            s3, args['SOURCE_BUCKET'], key, args['DEST_BUCKET'], partitioning.object_key(args['DEST_PREFIX'], key)
+        ),
+        source_keys
+    ))
 
-binary_df = spark.read.format("binaryFile").load(source_path)
+print(f"✅ {len(source_keys)} object(s) copied to {partitioning.dest_path(args['DEST_BUCKET'], args['DEST_PREFIX'])}")
 
-# Write the binary content to another S3 location
-binary_df.write.mode("overwrite").format("binaryFile").save(dest_path)
-print(f"✅ Data processed and written to {dest_path}")
\ No newline at end of file
+job.commit()
@@ -0,0 +1,81 @@
+import sys
+import uuid
+import boto3
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+
+# shared pipeline package is shipped with --extra-py-files
+from pipeline import compaction, parquet_profile
+
+MB = 1024 * 1024
+
+# Get job arguments .. sizes default through the job's default arguments
+args = getResolvedOptions(
+    sys.argv,
+    ['JOB_NAME', 'BUCKET', 'PREFIX', 'TARGET_FILE_MB', 'SMALL_FILE_MB', 'MIN_FILES', 'DELETE_AFTER_SECONDS']
+)
+
+# Initialize Spark and Glue contexts
+sc = SparkContext()
+glueContext = GlueContext(sc)
+spark = glueContext.spark_session
+
+job = Job(glueContext)
+job.init(args['JOB_NAME'], args)
+
+s3 = boto3.client('s3')
+
+
+def spark_merge(s3, bucket, sources, dest_key, profile):
+    # same contract as compaction.arrow_merge .. for bins too big for one Lambda
+    partition_path = f"s3://{bucket}/{dest_key.rsplit('/', 1)[0]}"
+    tmp_prefix = f"{compaction.TMP_PREFIX}{uuid.uuid4().hex}/"
+
+    # basePath = the partition itself, so no partition columns are added from the path
+    df = spark.read.option("mergeSchema", "true").option("basePath", partition_path) \
+        .parquet(*[f"s3://{bucket}/{obj.key}" for obj in sources])
+    rows = df.count()
+
+    # one Spark partition -> one file, sorted as a whole
+    df = parquet_profile.spark_sort(df.coalesce(1), profile)
+    df.write.mode("overwrite").options(**parquet_profile.spark_write_options(profile)) \
+        .parquet(f"s3://{bucket}/{tmp_prefix}")
+
+    tmp_keys = [obj["Key"] for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=tmp_prefix)
+                for obj in page.get("Contents", [])]
+    try:
+        part_files = [key for key in tmp_keys if key.endswith(".parquet")]
+        if len(part_files) != 1:
+            raise RuntimeError(f"Expected one Parquet file under {tmp_prefix}, found {len(part_files)}")
+
+        # server-side copy into the partition with the compaction marker
+        s3.copy_object(
+            Bucket=bucket,
+            Key=dest_key,
+            CopySource={"Bucket": bucket, "Key": part_files[0]},
+            MetadataDirective="REPLACE",
+            Metadata=compaction.compacted_metadata(sources),
+            ContentType="application/parquet"
+        )
+    finally:
+        compaction.delete_keys(s3, bucket, tmp_keys)
+    return rows
+
+
+report = compaction.compact_prefix(
+    s3,
+    args['BUCKET'],
+    args['PREFIX'],
+    target_bytes=int(args['TARGET_FILE_MB']) * MB,
+    small_bytes=int(args['SMALL_FILE_MB']) * MB,
+    min_files=int(args['MIN_FILES']),
+    delete_after_seconds=int(args['DELETE_AFTER_SECONDS']),
+    merge=spark_merge
+)
+
+print(f"✅ {len(report['compacted'])} partition(s) compacted under s3://{args['BUCKET']}/{args['PREFIX']}, "
+      f"{len(report['conflicts'])} conflict(s), {report['deleted']} object(s) deleted")
+
+job.commit()
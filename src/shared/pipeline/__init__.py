@@ -0,0 +1,4 @@
+import time
+
+# when a handler module first imported the package .. pipeline.metrics measures import time from here
+IMPORT_STARTED = time.perf_counter()
@@ -0,0 +1,317 @@
+"""
+Chunked CSV -> Parquet conversion for files too big for one Lambda and too small for a Glue job's startup.
+
+    plan      split the object into newline aligned byte ranges of about CHUNKED_CHUNK_MB .. only a few small
+              ranged GETs around each boundary, the object itself is not read
+    convert   one range per Lambda (Distributed Map item): a ranged GET pinned to the planned ETag, parsed with
+              the dataset's declared types, checked against its quality rules (pipeline/quality.py, unique per
+              part only) and written as <dest>/part-00001.parquet
+    commit    check every part is there, drop parts a previous attempt left beyond the part count and
+              write <dest>/_manifest.json last as the commit marker (parts, rows, source version)
+
+Part keys are fixed by the plan, so a retried part or a re-run overwrites instead of duplicating.
+Ranges split on newlines .. quoted fields must not contain line breaks (true for the claims extracts).
+Unregistered datasets are inferred per part and may end up with different types per part, the chunked route
+is only offered for registered datasets (routing_table.json).
+
+The same steps run locally on a process pool, source and destination may be S3 or local paths:
+    python -m pipeline.chunked --source s3://stage-bucket/claims/type=structured/x.csv --dest s3://curated-bucket/claims/type=structured/x/ --workers 8
+    python -m pipeline.chunked --source ./claims/type=structured/x.csv --dest ./out/x/ --chunk-mb 64
+"""
+import csv
+import json
+import os
+import time
+
+from pipeline import convert, metrics, parquet_profile, quality, schema_registry
+from pipeline.s3_io import S3MultipartWriter, S3RangeReader
+
+CHUNK_BYTES = int(os.environ.get("CHUNKED_CHUNK_MB", "128")) * 1024 * 1024
+
+# bytes read per probe when looking for the next line break
+PROBE_BYTES = 64 * 1024
+
+MANIFEST_NAME = "_manifest.json"
+PART_PREFIX = "part-"
+
+
+def part_key(dest_prefix: str, part_number: int) -> str:
+    return f"{dest_prefix}{PART_PREFIX}{part_number:05d}.parquet"
+
+
+def next_line_start(read_range, offset: int, size: int, probe_bytes: int = PROBE_BYTES) -> int:
+    """Offset right after the first line break at or after offset (size when there is none)."""
+    while offset < size:
+        data = read_range(offset, min(offset + probe_bytes, size))
+        index = data.find(b"\n")
+        if index >= 0:
+            return offset + index + 1
+        offset += len(data)
+    return size
+
+
+def split_ranges(read_range, size: int, chunk_bytes: int = CHUNK_BYTES, probe_bytes: int = PROBE_BYTES) -> tuple:
+    """
+    read_range(start, end) returns the bytes [start, end).
+    Returns (header line, [(start, end), ..]) .. every range starts at a line start and ends after a line break
+    (or at the end of the object), the header is not part of any range.
+    """
+    header_end = next_line_start(read_range, 0, size, probe_bytes)
+    header = read_range(0, header_end)
+
+    boundaries = [header_end]
+    while boundaries[-1] + chunk_bytes < size:
+        boundaries.append(next_line_start(read_range, boundaries[-1] + chunk_bytes, size, probe_bytes))
+    boundaries.append(size)
+    return header, [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def column_names(header: bytes) -> list:
+    return next(csv.reader([header.decode("utf-8-sig").rstrip("\r\n")]))
+
+
+def parse_range(data, header: bytes, object_key: str):
+    """One range of rows (no header) as a conformed Arrow table."""
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    columns = schema_registry.columns_for_key(object_key)
+    with metrics.phase(metrics.PARSE):
+        table = pv.read_csv(
+            pa.BufferReader(data),
+            read_options=pv.ReadOptions(column_names=column_names(header)),
+            convert_options=schema_registry.csv_convert_options(columns)
+        )
+    with metrics.phase(metrics.ARROW):
+        table = schema_registry.conform_arrow(table, columns) if columns else table
+    return table
+
+
+def write_part(table, sink, object_key: str):
+    with metrics.phase(metrics.PARQUET_WRITE):
+        parquet_profile.write_table(table, sink, parquet_profile.profile_for_key(object_key))
+    metrics.add("Rows", table.num_rows)
+
+
+# S3 (the Lambdas)
+
+def s3_read_range(s3, bucket: str, key: str, etag: str):
+    def read_range(start: int, end: int) -> bytes:
+        with metrics.phase(metrics.GET_OBJECT):
+            return s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}", IfMatch=etag)["Body"].read()
+    return read_range
+
+
+def plan(s3, event: dict, dest_prefix: str, chunk_bytes: int = CHUNK_BYTES) -> dict:
+    """
+    The state machine event plus the parts for the Distributed Map. Parts only carry their range and key,
+    the Map's ItemSelector adds the source, pinned ETag and header .. keeps the state under the 256 KB payload limit.
+    """
+    head = s3.head_object(Bucket=event["bucketName"], Key=event["objectKey"])
+    size, etag = head["ContentLength"], head["ETag"]
+    header, ranges = split_ranges(s3_read_range(s3, event["bucketName"], event["objectKey"], etag), size, chunk_bytes)
+
+    return {
+        **event,
+        "etag": etag,
+        "fileSize": size,
+        "header": header.decode("utf-8"),
+        "destKey": dest_prefix,
+        "partCount": len(ranges),
+        "parts": [{
+            "start": start,
+            "end": end,
+            "partNumber": part_number,
+            "partKey": part_key(dest_prefix, part_number)
+        } for part_number, (start, end) in enumerate(ranges, start=1)]
+    }
+
+
+def convert_part(s3, part: dict) -> dict:
+    """part: one Map item .. bucketName, objectKey, etag, header, destBucket plus start, end, partNumber, partKey."""
+    with S3RangeReader(s3, part["bucketName"], part["objectKey"], part["end"] - part["start"],
+                       start=part["start"], etag=part["etag"]) as reader:
+        data = reader.read_into_buffer()
+    parsed = parse_range(data, part["header"].encode("utf-8"), part["objectKey"])
+    table = convert.check_quality(s3, part, part["partKey"], parsed)
+
+    with S3MultipartWriter(s3, part["destBucket"], part["partKey"], content_type="application/parquet") as sink:
+        write_part(table, sink, part["objectKey"])
+        written = sink.tell()
+    return {"partNumber": part["partNumber"], "key": part["partKey"], "rows": table.num_rows,
+            "quarantined": parsed.num_rows - table.num_rows, "bytes": written}
+
+
+def manifest(planned: dict, results: list) -> dict:
+    results = sorted(results, key=lambda result: result["partNumber"])
+    return {
+        "source": {
+            "bucket": planned["bucketName"],
+            "key": planned["objectKey"],
+            "etag": planned["etag"],
+            "size": planned["fileSize"]
+        },
+        "parts": [{"key": result["key"], "rows": result["rows"], "bytes": result["bytes"]} for result in results],
+        "rows": sum(result["rows"] for result in results),
+        "quarantined": sum(result.get("quarantined", 0) for result in results),
+        "committedAt": int(time.time())
+    }
+
+
+def commit(s3, planned: dict, results: list) -> dict:
+    """
+    planned: the plan() output, results: what convert_part returned per part.
+    Fails when a part is missing, deletes stale parts of an earlier, longer plan, then writes the manifest.
+    """
+    from pipeline.compaction import delete_keys
+
+    bucket, dest_prefix = planned["destBucket"], planned["destKey"]
+    expected = {part["partKey"] for part in planned["parts"]}
+    listed = set()
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=f"{dest_prefix}{PART_PREFIX}"):
+        listed.update(obj["Key"] for obj in page.get("Contents", []))
+
+    missing = expected - listed
+    if missing or len(results) != len(expected):
+        raise RuntimeError(f"{len(missing) or len(expected) - len(results)} part(s) of {dest_prefix} missing")
+    delete_keys(s3, bucket, sorted(listed - expected))
+
+    document = manifest(planned, results)
+    with metrics.phase(metrics.PUT_OBJECT):
+        s3.put_object(
+            Bucket=bucket,
+            Key=f"{dest_prefix}{MANIFEST_NAME}",
+            Body=json.dumps(document, indent=2).encode("utf-8"),
+            ContentType="application/json"
+        )
+    return {"destKey": dest_prefix, "partCount": len(results), "rows": document["rows"],
+            "quarantined": document["quarantined"]}
+
+
+# local runs
+
+def s3_uri(uri: str) -> tuple:
+    """(bucket, key) of an s3:// URI, None for a local path."""
+    if not uri.startswith("s3://"):
+        return None
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def local_read_range(path: str):
+    def read_range(start: int, end: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+    return read_range
+
+
+def local_part(part: dict) -> dict:
+    """convert_part for a process pool worker .. S3 or local source and destination."""
+    from pipeline import runtime
+
+    source, dest = s3_uri(part["source"]), s3_uri(part["dest"])
+    if source and dest:
+        return convert_part(runtime.client("s3"), {**part, "bucketName": source[0], "objectKey": source[1],
+                                                   "destBucket": dest[0], "partKey": dest[1]})
+
+    if source:
+        data = s3_read_range(runtime.client("s3"), *source, part["etag"])(part["start"], part["end"])
+    else:
+        data = local_read_range(part["source"])(part["start"], part["end"])
+    parsed = parse_range(data, part["header"].encode("utf-8"), part["source"])
+
+    if dest:
+        table = convert.check_quality(runtime.client("s3"), {"objectKey": part["source"], "destBucket": dest[0]},
+                                      dest[1], parsed)
+        with S3MultipartWriter(runtime.client("s3"), *dest, content_type="application/parquet") as sink:
+            write_part(table, sink, part["source"])
+            written = sink.tell()
+    else:
+        table = parsed
+        checker = convert.quality_checker({"objectKey": part["source"]})
+        if checker is not None:
+            # <dest>/quarantine/part-00001.parquet
+            table, quarantined = checker.check(parsed)
+            if quarantined.num_rows:
+                import pyarrow.parquet as pq
+
+                quarantine_dir = os.path.join(os.path.dirname(part["dest"]), quality.QUARANTINE_PREFIX)
+                os.makedirs(quarantine_dir, exist_ok=True)
+                pq.write_table(quarantined, os.path.join(quarantine_dir, os.path.basename(part["dest"])))
+        os.makedirs(os.path.dirname(part["dest"]) or ".", exist_ok=True)
+        write_part(table, part["dest"], part["source"])
+        written = os.path.getsize(part["dest"])
+    return {"partNumber": part["partNumber"], "key": part["dest"], "rows": table.num_rows,
+            "quarantined": parsed.num_rows - table.num_rows, "bytes": written}
+
+
+def run_local(source: str, dest: str, chunk_bytes: int = CHUNK_BYTES, workers: int = None) -> dict:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from pipeline import runtime
+
+    dest = dest if dest.endswith("/") else dest + "/"
+    source_s3, dest_s3 = s3_uri(source), s3_uri(dest)
+    s3 = runtime.client("s3") if source_s3 or dest_s3 else None
+    if source_s3:
+        head = s3.head_object(Bucket=source_s3[0], Key=source_s3[1])
+        size, etag = head["ContentLength"], head["ETag"]
+        read_range = s3_read_range(s3, *source_s3, etag)
+    else:
+        size, etag = os.path.getsize(source), None
+        read_range = local_read_range(source)
+
+    started = time.perf_counter()
+    header, ranges = split_ranges(read_range, size, chunk_bytes)
+    parts = [{
+        "source": source,
+        "etag": etag,
+        "header": header.decode("utf-8"),
+        "start": start,
+        "end": end,
+        "partNumber": part_number,
+        "dest": part_key(dest, part_number)
+    } for part_number, (start, end) in enumerate(ranges, start=1)]
+
+    # workers build their own clients .. boto3 clients do not survive a fork
+    with ProcessPoolExecutor(max_workers=workers, initializer=runtime.reset_clients) as executor:
+        results = list(executor.map(local_part, parts))
+
+    planned = {"bucketName": source_s3[0] if source_s3 else None, "objectKey": source, "etag": etag,
+               "fileSize": size, "destBucket": dest_s3[0] if dest_s3 else None,
+               "destKey": dest_s3[1] if dest_s3 else dest,
+               "parts": [{"partKey": s3_uri(part["dest"])[1] if dest_s3 else part["dest"]} for part in parts]}
+    if dest_s3:
+        results = [{**result, "key": s3_uri(result["key"])[1]} for result in results]
+        summary = commit(s3, planned, results)
+    else:
+        os.makedirs(dest, exist_ok=True)
+        expected = {part["dest"] for part in parts}
+        for name in os.listdir(dest):
+            if name.startswith(PART_PREFIX) and os.path.join(dest, name) not in expected:
+                os.remove(os.path.join(dest, name))
+        document = manifest(planned, results)
+        with open(os.path.join(dest, MANIFEST_NAME), "w") as f:
+            json.dump(document, f, indent=2)
+        summary = {"destKey": dest, "partCount": len(results), "rows": document["rows"],
+                   "quarantined": document["quarantined"]}
+    return {**summary, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chunked CSV -> Parquet conversion on a local process pool")
+    parser.add_argument("--source", required=True, help="s3://bucket/key.csv or a local CSV")
+    parser.add_argument("--dest", required=True, help="s3://bucket/prefix/ or a local directory for the parts")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024))
+    parser.add_argument("--workers", type=int, help="processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("METRICS_ENABLED", "false")
+    print(json.dumps(run_local(args.source, args.dest, args.chunk_mb * 1024 * 1024, args.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Small Parquet file compaction for the curated and application buckets.
+
+Every partition (directory of Parquet files) under a prefix with at least min_files files below small_bytes
+gets those files merged into compacted-<id>.parquet files of about target_bytes, sorted by the dataset's
+Parquet profile. The swap is one conditional PUT of the partition manifest (_compaction_manifest.json):
+
+    files     compacted outputs that are live
+    replaced  {key, etag, replacedAt} of merged inputs .. no longer live
+
+A reader lists the partition after reading the manifest and keeps (live_objects)
+    plain files not in replaced, compacted-* files listed in files
+so before the swap it sees the inputs only, after it the outputs only .. never both.
+Replaced inputs and orphaned outputs of a failed run are deleted delete_after_seconds later.
+
+Readers never list a compacted prefix themselves:
+    whole prefix (current state)     live_keys_under(), also behind glue_sources.list_prefix
+    new objects (incremental)        skip compacted-* outputs, their rows arrived as the inputs .. the metadata
+                                     dispatcher checks x-amz-meta-compacted, Glue bookmarked prefix reads pass
+                                     INCREMENTAL_EXCLUSIONS, Snowpipe only loads the keys sent to insertFiles
+
+    python -m pipeline.compaction --bucket curated-bucket --prefix claims/type=structured/ --dry-run
+"""
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from pipeline import metrics, parquet_profile
+from pipeline.s3_io import S3MultipartWriter
+
+MB = 1024 * 1024
+
+MANIFEST_NAME = "_compaction_manifest.json"
+COMPACTED_PREFIX = "compacted-"
+COMPACTED_METADATA_KEY = "compacted"
+# Spark / Glue working files .. path segments starting with _ are never partition data
+TMP_PREFIX = "_compaction/tmp/"
+
+TARGET_FILE_BYTES = int(os.environ.get("COMPACTION_TARGET_MB", "128")) * MB
+SMALL_FILE_BYTES = int(os.environ.get("COMPACTION_SMALL_MB", "32")) * MB
+MIN_FILES = int(os.environ.get("COMPACTION_MIN_FILES", "4"))
+DELETE_AFTER_SECONDS = int(os.environ.get("COMPACTION_DELETE_AFTER_SECONDS", "900"))
+READ_CONCURRENCY = int(os.environ.get("COMPACTION_READ_CONCURRENCY", "8"))
+
+# DynamicFrame "exclusions" (glob) of incremental prefix reads
+INCREMENTAL_EXCLUSIONS = [f"**/{COMPACTED_PREFIX}*.parquet"]
+
+
+class ManifestConflict(RuntimeError):
+    """Another run changed the partition manifest since it was read."""
+
+
+class ParquetObject(NamedTuple):
+    key: str
+    size: int
+    etag: str
+    modified: float  # epoch seconds
+
+
+class PartitionPlan(NamedTuple):
+    partition: str
+    objects: list  # everything listed, live or not
+    manifest: dict
+    etag: str  # of the manifest, None when there is none yet
+    bins: list  # lists of ParquetObject merged into one file each
+
+
+def is_compacted(metadata: dict) -> bool:
+    """User metadata of a HEAD response."""
+    return (metadata or {}).get(COMPACTED_METADATA_KEY) == "true"
+
+
+def manifest_key(partition: str) -> str:
+    return f"{partition}{MANIFEST_NAME}"
+
+
+def empty_manifest() -> dict:
+    return {"version": 0, "files": [], "replaced": []}
+
+
+def read_manifest(s3, bucket: str, partition: str) -> tuple:
+    """(manifest, etag) .. etag is None when the partition was never compacted."""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=manifest_key(partition))
+    except s3.exceptions.NoSuchKey:
+        return empty_manifest(), None
+    return json.loads(response["Body"].read()), response["ETag"]
+
+
+def write_manifest(s3, bucket: str, partition: str, manifest: dict, etag: str) -> str:
+    """Replace the manifest only if it is still the one read (etag) .. returns the new etag."""
+    from botocore.exceptions import ClientError
+
+    manifest = {**manifest, "version": manifest.get("version", 0) + 1, "updatedAt": int(time.time())}
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        response = s3.put_object(
+            Bucket=bucket,
+            Key=manifest_key(partition),
+            Body=json.dumps(manifest).encode("utf-8"),
+            ContentType="application/json",
+            **condition
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise ManifestConflict(f"Manifest of {partition} changed during compaction") from e
+        raise
+    return response["ETag"]
+
+
+def hidden(key: str) -> bool:
+    # _manifests/, _compaction/, _SUCCESS, .crc .. anything Spark / Hive would skip as well
+    return any(part.startswith(("_", ".")) for part in key.split("/"))
+
+
+def list_partitions(s3, bucket: str, prefix: str) -> dict:
+    """partition (key prefix ending in /) -> [ParquetObject]"""
+    partitions = {}
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if not key.endswith(".parquet") or hidden(key):
+                continue
+            partition = key[:key.rfind("/") + 1]
+            partitions.setdefault(partition, []).append(
+                ParquetObject(key, obj["Size"], obj["ETag"], obj["LastModified"].timestamp())
+            )
+    return partitions
+
+
+def is_live(obj: ParquetObject, manifest: dict) -> bool:
+    if any(entry["key"] == obj.key and entry["etag"] == obj.etag for entry in manifest["replaced"]):
+        return False
+    if obj.key.rsplit("/", 1)[-1].startswith(COMPACTED_PREFIX):
+        return obj.key in manifest["files"]
+    return True
+
+
+def live_objects(objects: list, manifest: dict) -> list:
+    return [obj for obj in objects if is_live(obj, manifest)]
+
+
+def live_keys(s3, bucket: str, partition: str) -> list:
+    """What a reader of one partition should open .. the manifest is read before listing."""
+    manifest, _ = read_manifest(s3, bucket, partition)
+    objects = list_partitions(s3, bucket, partition).get(partition, [])
+    return [obj.key for obj in live_objects(objects, manifest)]
+
+
+def live_keys_under(s3, bucket: str, prefix: str) -> list:
+    """
+    Every key under prefix a reader of the whole prefix should open, the partitions' manifests are read before
+    the objects are listed (as in live_keys). Hidden keys (_*, .*) below prefix are skipped like Spark does,
+    objects other than Parquet files pass through.
+    """
+    manifests = {}
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(f"/{MANIFEST_NAME}"):
+                partition = obj["Key"][:-len(MANIFEST_NAME)]
+                manifests[partition] = read_manifest(s3, bucket, partition)[0]
+
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/") or hidden(key[len(prefix):]):
+                continue
+            partition = key[:key.rfind("/") + 1]
+            if key.endswith(".parquet"):
+                parquet = ParquetObject(key, obj["Size"], obj["ETag"], obj["LastModified"].timestamp())
+                if not is_live(parquet, manifests.get(partition, empty_manifest())):
+                    continue
+            keys.append(key)
+    return keys
+
+
+def plan_bins(objects: list, target_bytes: int = TARGET_FILE_BYTES, small_bytes: int = SMALL_FILE_BYTES,
+              min_files: int = MIN_FILES) -> list:
+    """
+    Pack the small files of one partition, oldest first, into bins of at most target_bytes.
+    Nothing is planned below min_files small files, single file bins are dropped.
+    """
+    small = sorted((obj for obj in objects if obj.size < small_bytes), key=lambda obj: (obj.modified, obj.key))
+    if len(small) < max(min_files, 2):
+        return []
+
+    bins, current, current_bytes = [], [], 0
+    for obj in small:
+        if current and current_bytes + obj.size > target_bytes:
+            bins.append(current)
+            current, current_bytes = [], 0
+        current.append(obj)
+        current_bytes += obj.size
+    bins.append(current)
+    return [group for group in bins if len(group) > 1]
+
+
+def plan(s3, bucket: str, prefix: str, target_bytes: int = TARGET_FILE_BYTES,
+         small_bytes: int = SMALL_FILE_BYTES, min_files: int = MIN_FILES) -> list:
+    plans = []
+    for partition, objects in sorted(list_partitions(s3, bucket, prefix).items()):
+        manifest, etag = read_manifest(s3, bucket, partition)
+        bins = plan_bins(live_objects(objects, manifest), target_bytes, small_bytes, min_files)
+        plans.append(PartitionPlan(partition, objects, manifest, etag, bins))
+    return plans
+
+
+def compacted_metadata(sources: list) -> dict:
+    return {COMPACTED_METADATA_KEY: "true", "source-files": str(len(sources))}
+
+
+def arrow_merge(s3, bucket: str, sources: list, dest_key: str, profile) -> int:
+    """Read the bin into memory, sort it as a whole and write one file .. returns the row count."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def read(obj):
+        with metrics.phase(metrics.GET_OBJECT):
+            data = s3.get_object(Bucket=bucket, Key=obj.key)["Body"].read()
+        metrics.add("BytesIn", len(data), metrics.BYTES)
+        with metrics.phase(metrics.PARSE):
+            return pq.read_table(pa.BufferReader(data))
+
+    with ThreadPoolExecutor(max_workers=READ_CONCURRENCY) as executor:
+        tables = list(executor.map(read, sources))
+
+    # columns added to the dataset later are null filled in the older files, conflicting types fail the bin
+    with metrics.phase(metrics.ARROW):
+        table = pa.concat_tables(tables, promote_options="default")
+    with S3MultipartWriter(s3, bucket, dest_key, content_type="application/parquet",
+                           metadata=compacted_metadata(sources)) as sink:
+        with metrics.phase(metrics.PARQUET_WRITE):
+            parquet_profile.write_table(table, sink, profile)
+    metrics.add("Rows", table.num_rows)
+    return table.num_rows
+
+
+def delete_keys(s3, bucket: str, keys: list):
+    for start in range(0, len(keys), 1000):
+        response = s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True}
+        )
+        if response.get("Errors"):
+            raise RuntimeError(f"Could not delete {len(response['Errors'])} object(s): {response['Errors'][0]}")
+
+
+def compact_partition(s3, bucket: str, partition_plan: PartitionPlan, merge=arrow_merge) -> dict:
+    """Merge every bin of the plan, then swap all outputs in with one manifest write."""
+    profile = parquet_profile.profile_for_key(partition_plan.partition)
+    outputs, replaced, rows = [], [], 0
+    try:
+        for sources in partition_plan.bins:
+            dest_key = f"{partition_plan.partition}{COMPACTED_PREFIX}{uuid.uuid4().hex}.parquet"
+            rows += merge(s3, bucket, sources, dest_key, profile)
+            outputs.append(dest_key)
+            replaced.extend(sources)
+
+        now = int(time.time())
+        replaced_keys = {obj.key for obj in replaced}
+        manifest = {
+            **partition_plan.manifest,
+            "files": [key for key in partition_plan.manifest["files"] if key not in replaced_keys] + outputs,
+            "replaced": partition_plan.manifest["replaced"] + [
+                {"key": obj.key, "etag": obj.etag, "replacedAt": now} for obj in replaced
+            ]
+        }
+        etag = write_manifest(s3, bucket, partition_plan.partition, manifest, partition_plan.etag)
+    except Exception:
+        # outputs are not live before the swap .. drop them right away
+        delete_keys(s3, bucket, outputs)
+        raise
+
+    return {
+        "partition": partition_plan.partition,
+        "inputFiles": len(replaced),
+        "inputBytes": sum(obj.size for obj in replaced),
+        "outputFiles": len(outputs),
+        "rows": rows,
+        "manifest": manifest,
+        "etag": etag
+    }
+
+
+def cleanup_partition(s3, bucket: str, partition: str, objects: list, manifest: dict, etag: str,
+                      delete_after_seconds: int = DELETE_AFTER_SECONDS) -> int:
+    """
+    Delete replaced inputs and orphaned compacted outputs once they are older than the grace period,
+    and forget tombstones of objects that are gone. Returns the number of deleted objects.
+    """
+    if etag is None:
+        return 0
+    now = time.time()
+    listed = {(obj.key, obj.etag): obj for obj in objects}
+
+    expired, kept = [], []
+    for entry in manifest["replaced"]:
+        if (entry["key"], entry["etag"]) not in listed:
+            continue  # already deleted
+        (expired if now - entry["replacedAt"] >= delete_after_seconds else kept).append(entry)
+
+    # outputs of a run that failed before its swap (a running compaction's outputs are younger)
+    orphans = [obj.key for obj in objects
+               if obj.key.rsplit("/", 1)[-1].startswith(COMPACTED_PREFIX)
+               and obj.key not in manifest["files"] and now - obj.modified >= delete_after_seconds]
+
+    # delete before forgetting the tombstones, otherwise the inputs would be live again in between
+    delete_keys(s3, bucket, [entry["key"] for entry in expired] + orphans)
+    if kept != manifest["replaced"]:
+        write_manifest(s3, bucket, partition, {**manifest, "replaced": kept}, etag)
+    return len(expired) + len(orphans)
+
+
+def compact_prefix(s3, bucket: str, prefix: str, target_bytes: int = TARGET_FILE_BYTES,
+                   small_bytes: int = SMALL_FILE_BYTES, min_files: int = MIN_FILES,
+                   delete_after_seconds: int = DELETE_AFTER_SECONDS, dry_run: bool = False,
+                   merge=arrow_merge, should_stop=None) -> dict:
+    """
+    Plan, compact and clean up every partition under prefix.
+    should_stop() is checked between partitions (Lambda time budget) .. the rest is left for the next run.
+    """
+    report = {"bucket": bucket, "prefix": prefix, "partitions": 0, "compacted": [], "conflicts": [],
+              "deleted": 0, "pending": []}
+    for partition_plan in plan(s3, bucket, prefix, target_bytes, small_bytes, min_files):
+        report["partitions"] += 1
+        if dry_run:
+            if partition_plan.bins:
+                report["pending"].append({
+                    "partition": partition_plan.partition,
+                    "bins": [[obj.key for obj in sources] for sources in partition_plan.bins]
+                })
+            continue
+        if should_stop and should_stop():
+            report["pending"].append({"partition": partition_plan.partition})
+            continue
+
+        manifest, etag = partition_plan.manifest, partition_plan.etag
+        if partition_plan.bins:
+            try:
+                result = compact_partition(s3, bucket, partition_plan, merge)
+            except ManifestConflict:
+                report["conflicts"].append(partition_plan.partition)
+                continue
+            manifest, etag = result.pop("manifest"), result.pop("etag")
+            report["compacted"].append(result)
+
+        try:
+            report["deleted"] += cleanup_partition(
+                s3, bucket, partition_plan.partition, partition_plan.objects, manifest, etag, delete_after_seconds
+            )
+        except ManifestConflict:
+            report["conflicts"].append(partition_plan.partition)
+    return report
+
+
+def main(argv=None):
+    import argparse
+    import boto3
+
+    parser = argparse.ArgumentParser(description="Compact small Parquet files under a prefix")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="claims/type=structured/")
+    parser.add_argument("--target-mb", type=int, default=TARGET_FILE_BYTES // MB)
+    parser.add_argument("--small-mb", type=int, default=SMALL_FILE_BYTES // MB)
+    parser.add_argument("--min-files", type=int, default=MIN_FILES)
+    parser.add_argument("--delete-after", type=int, default=DELETE_AFTER_SECONDS,
+                        help="seconds replaced files stay readable after the swap")
+    parser.add_argument("--dry-run", action="store_true", help="only print the plan")
+    args = parser.parse_args(argv)
+
+    report = compact_prefix(
+        boto3.client("s3"), args.bucket, args.prefix, args.target_mb * MB, args.small_mb * MB,
+        args.min_files, args.delete_after, args.dry_run
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+CSV / JSON -> Parquet engine shared by the structured and semi-structured Lambdas.
+
+pyarrow only (no pandas) and imported inside the functions, so importing this module costs nothing
+until a conversion runs. Registered datasets (schema_registry) are parsed with their declared types,
+unregistered ones are inferred by pyarrow.
+
+Every converter takes the S3 client and the state machine event and writes s3://destBucket/dest_key.
+Rows failing the dataset's quality rules (pipeline/quality.py) go to s3://destBucket/quarantine/dest_key instead.
+The CSV converters optionally write fact rows instead of the conformed columns (facts, pipeline/fact_model.py).
+Phases (GetObject, Parse, Arrow, Quality, Lookup, ParquetWrite, PutObject), bytes and rows go to pipeline.metrics.
+"""
+import json
+import os
+
+from pipeline import metrics, parquet_profile, partitioning, quality, schema_registry
+from pipeline import s3_io
+from pipeline.s3_io import S3MultipartWriter, S3RangeReader
+
+# CSV / NDJSON bytes parsed per block when streaming .. blocks are collected into row groups (parquet_profile)
+STREAMING_BLOCK_BYTES = int(os.environ.get("STREAMING_BLOCK_MB", "32")) * 1024 * 1024
+
+# objects from this size (event fileSize) are downloaded as concurrent byte ranges (s3_io.S3RangeReader)
+RANGE_GET_MIN_BYTES = int(os.environ.get("RANGE_GET_MIN_MB", "64")) * 1024 * 1024
+
+# only newline delimited JSON can be read block by block
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+# schemas inferred for unregistered JSON datasets, kept across warm invocations (dataset prefix -> schema)
+SCHEMA_CACHE = {}
+
+
+def dest_key(event: dict, suffix: str = ".parquet") -> str:
+    base_key = event["objectKey"].rsplit(".", 1)[0]  # remove .csv / .json
+    return partitioning.object_key(event["destPrefix"], base_key) + suffix
+
+
+def open_object(s3, event: dict):
+    return s3_io.open_object(s3, event["bucketName"], event["objectKey"], event.get("fileSize"), RANGE_GET_MIN_BYTES)
+
+
+def read_object(s3, event: dict) -> bytes:
+    """The whole source object .. a bytearray filled in place when it was fetched as ranges."""
+    with open_object(s3, event) as body:
+        return body.read_into_buffer() if isinstance(body, S3RangeReader) else body.read()
+
+
+def quality_checker(event: dict):
+    """ArrowChecker for the event's dataset, None when no rules apply."""
+    rules = quality.rules_for_key(event["objectKey"])
+    if not rules:
+        return None
+    return quality.ArrowChecker(rules, quality.load_reference_keys)
+
+
+class QuarantineWriter:
+    """Failing rows of one output file .. the Parquet upload only starts with the first quarantined row."""
+
+    def __init__(self, s3, bucket: str, key: str):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = quality.quarantine_key(key)
+        self.sink = None
+        self.writer = None
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.sink is None:
+            return False
+        if exc_type is None:
+            self.writer.close()
+            self.sink.close()
+        else:
+            self.sink.abort()
+        return False
+
+    def write(self, table):
+        if not table.num_rows:
+            return
+        import pyarrow.parquet as pq
+
+        with metrics.phase(metrics.PARQUET_WRITE):
+            if self.writer is None:
+                self.sink = S3MultipartWriter(self.s3, self.bucket, self.key, content_type="application/parquet")
+                self.writer = pq.ParquetWriter(self.sink, table.schema)
+            self.writer.write_table(table)
+        self.rows += table.num_rows
+
+
+def check_quality(s3, event: dict, key: str, table):
+    """The rows of table that pass the dataset's rules .. the others are quarantined."""
+    checker = quality_checker(event)
+    if checker is None:
+        return table
+    table, quarantined = checker.check(table)
+    with QuarantineWriter(s3, event["destBucket"], key) as quarantine:
+        quarantine.write(quarantined)
+    checker.report(quarantine.rows)
+    return table
+
+
+def upload_table(s3, event: dict, key: str, table):
+    """
+    Write the whole table (sorted by its profile) straight into a multipart upload .. parts go up
+    while later row groups are still encoded, small outputs end up as one PUT.
+    """
+    with S3MultipartWriter(s3, event["destBucket"], key, content_type="application/parquet") as sink:
+        with metrics.phase(metrics.PARQUET_WRITE):
+            parquet_profile.write_table(table, sink, parquet_profile.profile_for_key(event["objectKey"]))
+    metrics.add("Rows", table.num_rows)
+
+
+def stream_batches(s3, event: dict, key: str, reader, conform, facts=None):
+    """
+    Write sorted row groups of the profile size and upload finished parts as they fill up.
+    Quality rules run per batch, unique values are remembered across batches. facts (a fact_model.FactBuilder)
+    turns every checked batch into fact rows.
+    """
+    import pyarrow as pa
+
+    checker = quality_checker(event)
+    with S3MultipartWriter(s3, event["destBucket"], key, content_type="application/parquet") as sink, \
+            QuarantineWriter(s3, event["destBucket"], key) as quarantine:
+        schema = conform(reader.schema.empty_table()).schema
+        if facts is not None:
+            schema = facts.build(schema.empty_table()).schema
+        writer = parquet_profile.ProfiledParquetWriter(
+            sink, schema, parquet_profile.profile_for_key(event["objectKey"])
+        )
+        try:
+            batches = iter(reader)
+            while True:
+                with metrics.phase(metrics.PARSE):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                with metrics.phase(metrics.ARROW):
+                    table = conform(pa.Table.from_batches([batch]))
+                if checker is not None:
+                    table, quarantined = checker.check(table)
+                    quarantine.write(quarantined)
+                if facts is not None:
+                    table = facts.build(table)
+                with metrics.phase(metrics.PARQUET_WRITE):
+                    writer.write_table(table)
+                metrics.add("Rows", table.num_rows)
+        finally:
+            with metrics.phase(metrics.PARQUET_WRITE):
+                writer.close()
+    if checker is not None:
+        checker.report(quarantine.rows)
+    if facts is not None:
+        facts.report()
+
+
+def conformer(columns):
+    def conform(table):
+        return schema_registry.conform_arrow(table, columns) if columns else table
+    return conform
+
+
+# CSV
+
+def csv_columns(event: dict, facts=None):
+    """Declared columns of the source .. a fact model reads its date columns as text."""
+    columns = schema_registry.columns_for_key(event["objectKey"])
+    return facts.source_columns(columns) if facts is not None and columns else columns
+
+
+def csv_in_memory(s3, event: dict, key: str, facts=None):
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    columns = csv_columns(event, facts)
+    data = read_object(s3, event)
+    # declared columns are parsed with their type .. no inference pass
+    with metrics.phase(metrics.PARSE):
+        table = pv.read_csv(pa.BufferReader(data), convert_options=schema_registry.csv_convert_options(columns))
+    with metrics.phase(metrics.ARROW):
+        table = conformer(columns)(table)
+    table = check_quality(s3, event, key, table)
+    if facts is not None:
+        table = facts.build(table)
+        facts.report()
+    upload_table(s3, event, key, table)
+
+
+def csv_streaming(s3, event: dict, key: str, block_bytes: int = STREAMING_BLOCK_BYTES, facts=None):
+    import pyarrow.csv as pv
+
+    columns = csv_columns(event, facts)
+    # only one block is held in memory at a time (plus the ranges read ahead for big objects)
+    with open_object(s3, event) as body:
+        with metrics.phase(metrics.PARSE):
+            reader = pv.open_csv(
+                body,
+                read_options=pv.ReadOptions(block_size=block_bytes),
+                convert_options=schema_registry.csv_convert_options(columns)
+            )
+        stream_batches(s3, event, key, reader, conformer(columns), facts)
+
+
+# JSON
+
+def dataset_prefix(object_key: str) -> str:
+    return object_key.rsplit("/", 1)[0] + "/" if "/" in object_key else ""
+
+
+def explicit_schema(object_key: str, columns):
+    if columns:
+        return schema_registry.arrow_schema(columns)
+    return SCHEMA_CACHE.get(dataset_prefix(object_key))
+
+
+def cache_schema(object_key: str, schema):
+    import pyarrow as pa
+
+    # all-null fields say nothing about the real type .. leave them to inference next time
+    fields = [field for field in schema if not pa.types.is_null(field.type)]
+    SCHEMA_CACHE[dataset_prefix(object_key)] = pa.schema(fields)
+
+
+def flatten(table):
+    """Flatten nested structs into parent_child columns until none are left."""
+    import pyarrow as pa
+
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+    return table.rename_columns([name.replace(".", "_") for name in table.column_names])
+
+
+def json_conformer(columns, flatten_nested: bool):
+    def conform(table):
+        if flatten_nested:
+            table = flatten(table)
+        return schema_registry.conform_arrow(table, columns) if columns else table
+    return conform
+
+
+def json_table(data: bytes):
+    """
+    A JSON array of records, a {column: {index: value}} / {column: [values]} object
+    (what pandas.read_json accepted) or newline delimited records.
+    """
+    import pyarrow as pa
+    import pyarrow.json as pj
+
+    try:
+        document = json.loads(data)
+    except ValueError:
+        # several documents .. one record per line
+        return pj.read_json(pa.BufferReader(data))
+
+    if isinstance(document, list):
+        return pa.Table.from_pylist(document)
+    if isinstance(document, dict) and all(isinstance(values, (dict, list)) for values in document.values()):
+        return pa.table({
+            name: list(values.values()) if isinstance(values, dict) else values
+            for name, values in document.items()
+        })
+    return pa.Table.from_pylist([document])
+
+
+def json_in_memory(s3, event: dict, key: str, flatten_nested: bool = False):
+    columns = schema_registry.columns_for_key(event["objectKey"])
+    data = read_object(s3, event)
+    with metrics.phase(metrics.PARSE):
+        table = json_table(data)
+    with metrics.phase(metrics.ARROW):
+        table = json_conformer(columns, flatten_nested)(table)
+    upload_table(s3, event, key, check_quality(s3, event, key, table))
+
+
+def ndjson_streaming(s3, event: dict, key: str, flatten_nested: bool = False,
+                     block_bytes: int = STREAMING_BLOCK_BYTES):
+    import pyarrow.json as pj
+
+    columns = schema_registry.columns_for_key(event["objectKey"])
+    # only one block is held in memory at a time
+    # (use_threads=False, the streaming reader is single threaded anyway)
+    with open_object(s3, event) as body:
+        with metrics.phase(metrics.PARSE):
+            reader = pj.open_json(
+                body,
+                read_options=pj.ReadOptions(block_size=block_bytes, use_threads=False),
+                parse_options=pj.ParseOptions(
+                    explicit_schema=explicit_schema(event["objectKey"], columns),
+                    unexpected_field_behavior="infer"
+                )
+            )
+        if not columns:
+            cache_schema(event["objectKey"], reader.schema)
+        stream_batches(s3, event, key, reader, json_conformer(columns, flatten_nested))
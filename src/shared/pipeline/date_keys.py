@@ -0,0 +1,155 @@
+"""
+DIM_DATE keys (DATE_ID, yyyymmdd INT) from date columns with Arrow compute kernels .. no Python loop over rows.
+
+    integers            already keys, passed through
+    dates / timestamps  year * 10000 + month * 100 + day
+    text                parsed with strptime in the formats declared for the column (schema_registry
+                        Column.date_formats, all FORMATS when none are declared)
+
+Every value is read the same way whatever file or container it comes in: formats are declared, not detected.
+A value two declared formats read as different days (01/02/2024 under %m/%d/%Y and %d/%m/%Y) is ambiguous and
+gets a null key, as do values no declared format parses .. the fact model counts both as Unparsed.<column>.
+Empty text is a null date. Formats whose separators differ can never read the same text, so only formats sharing
+their separators (overlapping) parse every value, the others only what is still left.
+
+strptime rolls impossible days over (2024-02-30 -> 2024-03-01), so values landing on day 1-3 are checked against
+the day written in the text and get a null key when they differ.
+
+spark_date_keys is the Glue twin for text columns: the same formats as Spark datetime patterns, the same rules.
+"""
+import re
+
+# formats a column can be declared with .. all of them for a date column without a declaration
+FORMATS = (
+    "%Y-%m-%d", "%Y%m%d", "%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d", "%d.%m.%Y", "%d-%b-%Y",
+    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%m/%d/%Y %H:%M:%S"
+)
+
+# FORMATS as Spark datetime patterns .. one letter fields take one or two digits like strptime
+SPARK_PATTERNS = {
+    "%Y-%m-%d": "yyyy-M-d", "%Y%m%d": "yyyyMMdd", "%m/%d/%Y": "M/d/yyyy", "%d/%m/%Y": "d/M/yyyy",
+    "%Y/%m/%d": "yyyy/M/d", "%d.%m.%Y": "d.M.yyyy", "%d-%b-%Y": "d-MMM-yyyy",
+    "%Y-%m-%dT%H:%M:%S": "yyyy-M-d'T'H:m:s", "%Y-%m-%d %H:%M:%S": "yyyy-M-d H:m:s",
+    "%m/%d/%Y %H:%M:%S": "M/d/yyyy H:m:s"
+}
+
+# strptime directives as regex .. the day is captured to catch rolled over dates
+DIRECTIVES = {
+    "%Y": r"\d{4}", "%m": r"\d{1,2}", "%d": r"(?P<day>\d{1,2})", "%b": r"[A-Za-z]+",
+    "%H": r"\d{1,2}", "%M": r"\d{1,2}", "%S": r"\d{1,2}"
+}
+
+
+def separators(date_format: str) -> str:
+    """The literal characters of a format .. text read by two formats has the same ones in both."""
+    return re.sub(r"%[A-Za-z]", "", date_format)
+
+
+def overlapping(formats) -> set:
+    """The formats sharing their separators with another one of formats."""
+    formats = list(formats)
+    return {date_format for date_format in formats
+            if sum(separators(other) == separators(date_format) for other in formats) > 1}
+
+
+def day_pattern(date_format: str) -> str:
+    return r"^\s*" + re.sub(r"%[A-Za-z]", lambda match: DIRECTIVES[match.group(0)], re.escape(date_format)) + "$"
+
+
+def keys_of(dates):
+    """yyyymmdd int64 of a date or timestamp array."""
+    import pyarrow.compute as pc
+
+    return pc.add(pc.add(pc.multiply(pc.year(dates), 10000), pc.multiply(pc.month(dates), 100)), pc.day(dates))
+
+
+def parse(values, date_format: str):
+    """Keys of a string array in one format, null where it does not parse or names an impossible day."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    timestamps = pc.strptime(values, format=date_format, unit="s", error_is_null=True)
+    keys = keys_of(timestamps)
+    if "%d" not in date_format:
+        return keys
+
+    day = pc.day(timestamps)
+    suspect = pc.fill_null(pc.less_equal(day, 3), False)
+    if not pc.any(suspect).as_py():
+        return keys
+    written = pc.struct_field(pc.extract_regex(values.filter(suspect), day_pattern(date_format)), "day")
+    rolled = pc.fill_null(pc.not_equal(written.cast(pa.int64()), day.filter(suspect)), True)
+    # the flags of the suspect rows scattered back to row order
+    return pc.if_else(pc.replace_with_mask(suspect, suspect, rolled), pa.scalar(None, pa.int64()), keys)
+
+
+def blank_to_null(values):
+    """Empty text as null (CSV fields read as strings are never null)."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if hasattr(values, "combine_chunks"):
+        values = values.combine_chunks()
+    if not pa.types.is_string(values.type):
+        return values
+    return pc.if_else(pc.equal(values, ""), pa.scalar(None, pa.string()), values)
+
+
+def date_keys(values, formats=FORMATS):
+    """
+    yyyymmdd int64 keys of an Arrow array (or chunked array) of ints, dates, timestamps or text,
+    text read in formats (the column's declared formats).
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if hasattr(values, "combine_chunks"):
+        values = values.combine_chunks()
+    if pa.types.is_integer(values.type):
+        return values.cast(pa.int64())
+    if pa.types.is_date(values.type) or pa.types.is_timestamp(values.type):
+        return keys_of(values)
+    values = blank_to_null(values if pa.types.is_string(values.type) else values.cast(pa.string()))
+
+    rivals = overlapping(formats)
+    valid = pc.is_valid(values)
+    keys = pa.nulls(len(values), pa.int64())
+    ambiguous = None
+    for date_format in formats:
+        # overlapping formats read every value to find the ambiguous ones, the rest only what is left
+        todo = valid if date_format in rivals else pc.and_(valid, pc.is_null(keys))
+        if not pc.any(todo).as_py():
+            continue
+        parsed = pc.replace_with_mask(pa.nulls(len(values), pa.int64()), todo, parse(values.filter(todo), date_format))
+        if date_format in rivals:
+            differs = pc.fill_null(pc.not_equal(keys, parsed), False)
+            ambiguous = differs if ambiguous is None else pc.or_(ambiguous, differs)
+        keys = pc.coalesce(keys, parsed)
+    if ambiguous is None:
+        return keys
+    return pc.if_else(ambiguous, pa.scalar(None, pa.int64()), keys)
+
+
+def enable_strict_parsing(spark):
+    # impossible days (2024-02-30) parse to null instead of failing the job on the legacy parser check
+    spark.conf.set("spark.sql.legacy.timeParserPolicy", "CORRECTED")
+
+
+def spark_date_keys(values, formats=FORMATS):
+    """
+    yyyymmdd bigint keys of a Spark text column (enable_strict_parsing first), read in formats like date_keys ..
+    empty text, values no format parses and values overlapping formats read differently get a null key.
+    """
+    from pyspark.sql.functions import coalesce, date_format, lit, to_timestamp, when
+
+    text = when(values != "", values)
+    parsed = {candidate: date_format(to_timestamp(text, SPARK_PATTERNS[candidate]), "yyyyMMdd").cast("bigint")
+              for candidate in formats}
+    keys = coalesce(*parsed.values())
+    rivals = [candidate for candidate in formats if candidate in overlapping(formats)]
+    ambiguous = [parsed[first].isNotNull() & parsed[second].isNotNull() & (parsed[first] != parsed[second])
+                 for index, first in enumerate(rivals) for second in rivals[index + 1:]
+                 if separators(first) == separators(second)]
+    for condition in ambiguous:
+        keys = when(condition, lit(None).cast("bigint")).otherwise(keys)
+    return keys
@@ -0,0 +1,204 @@
+"""
+Dimension snapshots cached across warm invocations, for key lookups in the Lambdas.
+
+A snapshot is one Parquet file per dimension, s3://<REFERENCE_BUCKET>/<REFERENCE_PREFIX><dimension>.parquet
+(quality.reference_key), unloaded from the DIM_* tables with their column names. Two tiers per container:
+
+    memory  Arrow tables of the columns asked for, LRU evicted above DIMENSION_CACHE_MB
+    /tmp    the downloaded Parquet files under DIMENSION_CACHE_DIR, LRU (by mtime) evicted above
+            DIMENSION_CACHE_TMP_MB .. a table evicted from memory is read back memory mapped, not downloaded
+
+Entries are keyed by the snapshot's ETag. The ETag is revalidated with a HEAD at most every
+DIMENSION_REVALIDATE_SECONDS per dimension, a new ETag drops the dimension from both tiers.
+Downloads are byte ranges pinned to that ETag (s3_io.S3RangeReader), so a snapshot replaced mid-download fails
+instead of mixing versions.
+
+lookup() and member() probe the dimension with the distinct values of a batch instead of hashing the dimension,
+so a batch costs one linear scan of the key column however many millions of keys the dimension has.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from pipeline import metrics, quality
+from pipeline.s3_io import S3RangeReader
+
+MB = 1024 * 1024
+
+MEMORY_BYTES = int(os.environ.get("DIMENSION_CACHE_MB", "1024")) * MB
+TMP_DIR = os.environ.get("DIMENSION_CACHE_DIR", "/tmp/dimensions")
+# keep below the function's ephemeral storage (512 MB unless the stack raises it)
+TMP_BYTES = int(os.environ.get("DIMENSION_CACHE_TMP_MB", "384")) * MB
+REVALIDATE_SECONDS = int(os.environ.get("DIMENSION_REVALIDATE_SECONDS", "60"))
+
+UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def snapshot_path(directory: str, dimension: str, etag: str) -> str:
+    return os.path.join(directory, f"{dimension.lower()}-{UNSAFE_CHARACTERS.sub('', etag)}.parquet")
+
+
+class DimensionCache:
+    """
+    Snapshot tables by (dimension, columns, types). table() is safe to call from several threads,
+    a dimension is downloaded once however many callers ask for it.
+    """
+
+    def __init__(self, bucket: str, s3=None, memory_bytes: int = MEMORY_BYTES, tmp_dir: str = TMP_DIR,
+                 tmp_bytes: int = TMP_BYTES, revalidate_seconds: int = REVALIDATE_SECONDS, clock=time.monotonic):
+        self.bucket = bucket
+        self._s3 = s3
+        self.memory_bytes = memory_bytes
+        self.tmp_dir = tmp_dir
+        self.tmp_bytes = tmp_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.clock = clock
+        self.tables = OrderedDict()  # (dimension, columns, types) -> (etag, table), least recently used first
+        self.versions = {}  # dimension -> (etag, size, validated at)
+        self.lock = threading.Lock()
+
+    @property
+    def s3(self):
+        from pipeline import runtime
+
+        return self._s3 or runtime.client("s3")
+
+    @property
+    def cached_bytes(self) -> int:
+        return sum(table.nbytes for _, table in self.tables.values())
+
+    def version(self, dimension: str) -> tuple:
+        """(etag, size) of the snapshot .. from a HEAD when the last one is older than revalidate_seconds."""
+        known = self.versions.get(dimension)
+        if known is not None and self.clock() - known[2] < self.revalidate_seconds:
+            return known[:2]
+
+        with metrics.phase(metrics.GET_OBJECT):
+            head = self.s3.head_object(Bucket=self.bucket, Key=quality.reference_key(dimension))
+        etag, size = head["ETag"], head["ContentLength"]
+        if known is not None and known[0] != etag:
+            self.invalidate(dimension)
+        self.versions[dimension] = (etag, size, self.clock())
+        return etag, size
+
+    def invalidate(self, dimension: str):
+        """Drop every cached table and file of a dimension."""
+        for entry in [entry for entry in self.tables if entry[0] == dimension]:
+            del self.tables[entry]
+        self.versions.pop(dimension, None)
+        prefix = f"{dimension.lower()}-"
+        if os.path.isdir(self.tmp_dir):
+            for name in os.listdir(self.tmp_dir):
+                if name.startswith(prefix) and name.endswith(".parquet"):
+                    os.remove(os.path.join(self.tmp_dir, name))
+
+    def download(self, dimension: str, etag: str, size: int) -> str:
+        """The snapshot as a local file .. reused when this ETag is already in /tmp."""
+        path = snapshot_path(self.tmp_dir, dimension, etag)
+        if os.path.exists(path):
+            os.utime(path)
+            metrics.add("DimensionCacheDiskHits", 1)
+            return path
+
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.evict_files(size)
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+        try:
+            with S3RangeReader(self.s3, self.bucket, quality.reference_key(dimension), size,
+                               etag=etag, object_size=size) as body, open(partial, "wb") as f:
+                for chunk in body.chunks():
+                    f.write(chunk)
+            # readers never see a half written snapshot
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            # a snapshot replaced after the HEAD fails the pinned ranges .. the next call looks again
+            self.versions.pop(dimension, None)
+            raise
+        metrics.add("DimensionCacheDownloads", 1)
+        return path
+
+    def evict_files(self, incoming: int):
+        """Remove the least recently used snapshots until incoming bytes fit under tmp_bytes."""
+        files = [os.path.join(self.tmp_dir, name) for name in os.listdir(self.tmp_dir) if name.endswith(".parquet")]
+        files = sorted(files, key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in files)
+        while files and total + incoming > self.tmp_bytes:
+            path = files.pop(0)
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def evict_tables(self):
+        # the most recently used table stays even when it is bigger than the budget on its own
+        while len(self.tables) > 1 and self.cached_bytes > self.memory_bytes:
+            self.tables.popitem(last=False)
+
+    def table(self, dimension: str, columns: list, types: dict = None):
+        """
+        Columns of a dimension snapshot as one Arrow table (contiguous arrays), types maps column -> Arrow type
+        to cast to once when the table is loaded instead of on every lookup.
+        """
+        import pyarrow.parquet as pq
+
+        types = types or {}
+        entry = (dimension, tuple(columns), tuple(sorted((name, str(type_)) for name, type_ in types.items())))
+        with self.lock:
+            etag, size = self.version(dimension)
+            cached = self.tables.get(entry)
+            if cached is not None and cached[0] == etag:
+                self.tables.move_to_end(entry)
+                metrics.add("DimensionCacheMemoryHits", 1)
+                return cached[1]
+
+            path = self.download(dimension, etag, size)
+            table = pq.read_table(path, columns=list(columns), memory_map=True)
+            for name, arrow_type in types.items():
+                if table.schema.field(name).type != arrow_type:
+                    table = table.set_column(table.schema.get_field_index(name), name,
+                                             table.column(name).cast(arrow_type))
+            table = table.combine_chunks()
+            self.tables[entry] = (etag, table)
+            self.evict_tables()
+            return table
+
+
+_cache = None
+
+
+def get_cache():
+    """The container's DimensionCache over REFERENCE_BUCKET, None without a bucket."""
+    global _cache
+    if _cache is None and quality.REFERENCE_BUCKET:
+        _cache = DimensionCache(quality.REFERENCE_BUCKET)
+    return _cache
+
+
+def _contiguous(values):
+    return values.combine_chunks() if hasattr(values, "combine_chunks") else values
+
+
+def lookup(values, natural, surrogate):
+    """
+    surrogate[i] for the first i where natural[i] == value, per value (null when the value is not a key).
+    Only the distinct values are hashed, the dimension is scanned once.
+    """
+    import pyarrow.compute as pc
+
+    values, natural, surrogate = _contiguous(values), _contiguous(natural), _contiguous(surrogate)
+    distinct = pc.unique(values.drop_null())
+    # the dimension rows whose key occurs in this batch .. at most len(distinct) of them
+    matched = pc.is_in(natural, value_set=distinct)
+    return surrogate.filter(matched).take(pc.index_in(values, value_set=natural.filter(matched)))
+
+
+def member(values, keys):
+    """Boolean array, true where the value is one of keys (null values are false)."""
+    import pyarrow.compute as pc
+
+    values = _contiguous(values)
+    keys = _contiguous(keys)
+    matched = keys.filter(pc.is_in(keys, value_set=pc.unique(values.drop_null())))
+    return pc.fill_null(pc.is_in(values, value_set=matched), False)
@@ -0,0 +1,235 @@
+"""
+FACT_* rows built in the application Lambda, so Snowflake only copies them in.
+
+A model maps conformed curate columns onto the fact table's columns (upper case, in DDL order, the autoincrement
+ID left out). Dimension keys are resolved with vectorised lookups against the dimension snapshots
+(pipeline/dimension_cache.py):
+
+    Lookup(column, dimension, natural, surrogate, target)
+        target = <dimension>.<surrogate> of the row whose <natural> equals the source column
+
+Date columns (FactModel.date_keys) are read as text and turned into DIM_DATE keys first, in the formats the
+dataset declares for them (schema_registry Column.date_formats, pipeline/date_keys.py) .. values that do not parse
+or are ambiguous count as Unparsed.<column>.
+Keys come out with the source column's type, values without a dimension row get a null key and count as
+Unresolved.<target>. The DIM_* tables key on the source ids today (natural == surrogate), a dimension with its
+own surrogate only changes its Lookup.
+Without REFERENCE_BUCKET keys are passed through unresolved.
+
+The Glue application job builds the same fact rows with spark_build: the same date keys, the same snapshots
+broadcast joined, the same upper case columns (glue_build).
+"""
+from typing import NamedTuple
+
+from pipeline import date_keys, dimension_cache, metrics, quality, schema_registry
+
+
+class Lookup(NamedTuple):
+    column: str  # source column (conformed name)
+    dimension: str
+    natural: str  # snapshot columns
+    surrogate: str
+    target: str  # fact column
+
+
+class FactModel(NamedTuple):
+    name: str
+    columns: tuple  # fact columns in table order .. plain ones are the upper case source column
+    lookups: tuple = ()
+    date_keys: tuple = ()  # source columns holding dates .. yyyymmdd keys before the lookups
+
+
+# 02_fact_structure.sql + BILLED_AMOUNT from 05_alter_structure.sql
+FACT_CLAIMS = FactModel(
+    "FACT_CLAIMS",
+    columns=(
+        "ALLOWED_AMOUNT", "COINSURANCE_AMOUNT", "CLAIM_ID", "DATE_OF_SERVICE", "DEDUCTIBLE_AMOUNT",
+        "PATIENT_ID", "PAID_AMOUNT", "PAID_DATE", "PROVIDER_ID", "BILLED_AMOUNT"
+    ),
+    lookups=(
+        Lookup("patient_id", "DIM_PATIENT", "PATIENT_ID", "PATIENT_ID", "PATIENT_ID"),
+        Lookup("provider_id", "DIM_PROVIDER", "PROVIDER_ID", "PROVIDER_ID", "PROVIDER_ID"),
+        Lookup("date_of_service", "DIM_DATE", "DATE_ID", "DATE_ID", "DATE_OF_SERVICE"),
+        Lookup("paid_date", "DIM_DATE", "DATE_ID", "DATE_ID", "PAID_DATE")
+    ),
+    date_keys=("date_of_service", "paid_date")
+)
+
+MODELS = {
+    "claims/type=structured/": FACT_CLAIMS
+}
+
+
+def source_columns(model: FactModel, columns: list) -> list:
+    """Declared columns with the date columns read as text, the keys are derived from them."""
+    return [column._replace(sql_type="STRING") if column.name in model.date_keys else column for column in columns]
+
+
+def model_for_key(object_key: str):
+    """Fact model of the dataset an object belongs to (longest matching prefix), None when there is none."""
+    matches = [prefix for prefix in MODELS if prefix in object_key]
+    if not matches:
+        return None
+    return MODELS[max(matches, key=len)]
+
+
+class FactBuilder:
+    """Builds fact tables batch by batch .. unresolved counts add up in self.unresolved."""
+
+    def __init__(self, model: FactModel, cache=None, date_formats: dict = None):
+        self.model = model
+        self.cache = cache
+        self.date_formats = date_formats or {}  # column -> declared formats
+        self.unresolved = {lookup.target: 0 for lookup in model.lookups}
+        self.unparsed = {column: 0 for column in model.date_keys}
+
+    def source_columns(self, columns: list) -> list:
+        """Declared columns with the date columns read as text, the keys are derived in build()."""
+        return source_columns(self.model, columns)
+
+    def derive_date_keys(self, table):
+        import pyarrow.compute as pc
+
+        for column in self.model.date_keys:
+            if column not in table.column_names:
+                continue
+            values = date_keys.blank_to_null(table.column(column))
+            keys = date_keys.date_keys(values, self.date_formats.get(column) or date_keys.FORMATS)
+            self.unparsed[column] += pc.sum(pc.and_(pc.is_valid(values), pc.is_null(keys))).as_py() or 0
+            table = table.set_column(table.column_names.index(column), column, keys)
+        return table
+
+    def resolve(self, lookup: Lookup, values):
+        import pyarrow.compute as pc
+
+        if self.cache is None:
+            return values
+        snapshot = self.cache.table(
+            lookup.dimension,
+            list(dict.fromkeys((lookup.natural, lookup.surrogate))),
+            {lookup.natural: values.type, lookup.surrogate: values.type}
+        )
+        keys = dimension_cache.lookup(values, snapshot.column(lookup.natural), snapshot.column(lookup.surrogate))
+        self.unresolved[lookup.target] += pc.sum(pc.and_(pc.is_valid(values), pc.is_null(keys))).as_py() or 0
+        return keys
+
+    def build(self, table):
+        """Fact table of a conformed batch .. fact columns missing from the source are nulls."""
+        import pyarrow as pa
+
+        with metrics.phase(metrics.ARROW):
+            table = self.derive_date_keys(table)
+        with metrics.phase(metrics.LOOKUP):
+            resolved = {lookup.target: self.resolve(lookup, table.column(lookup.column).combine_chunks())
+                        for lookup in self.model.lookups if lookup.column in table.column_names}
+            arrays = []
+            for name in self.model.columns:
+                if name in resolved:
+                    arrays.append(resolved[name])
+                elif name.lower() in table.column_names:
+                    arrays.append(table.column(name.lower()))
+                else:
+                    arrays.append(pa.nulls(table.num_rows, pa.null()))
+            return pa.Table.from_arrays(arrays, names=list(self.model.columns))
+
+    def report(self):
+        for target, count in self.unresolved.items():
+            metrics.add(f"Unresolved.{target}", count)
+        for column, count in self.unparsed.items():
+            metrics.add(f"Unparsed.{column.upper()}", count)
+
+
+def builder_for_key(object_key: str):
+    """FactBuilder over the container's dimension cache, None when the dataset has no fact model."""
+    model = model_for_key(object_key)
+    if model is None:
+        return None
+    return FactBuilder(model, dimension_cache.get_cache(), schema_registry.date_formats_for_key(object_key))
+
+
+# Spark (Glue)
+
+def spark_build(df, model: FactModel, snapshot_frame=None, date_formats: dict = None) -> tuple:
+    """
+    (fact DataFrame, count per metric) .. the Spark twin of FactBuilder.build and report.
+    snapshot_frame(dimension, columns) returns the snapshot DataFrame or None (keys passed through).
+    """
+    from pyspark.sql.functions import broadcast, col, lit, when
+    from pyspark.sql.functions import sum as sum_
+
+    snapshot_frame = snapshot_frame or (lambda dimension, columns: None)
+    flags = {}  # metric -> boolean flag column
+    for column in model.date_keys:
+        if column not in df.columns:
+            continue
+        text = col(f"`{column}`")
+        keys = date_keys.spark_date_keys(text, (date_formats or {}).get(column) or date_keys.FORMATS)
+        flag = f"_unparsed_{column}"
+        df = df.withColumn(flag, text.isNotNull() & (text != "") & keys.isNull()).withColumn(column, keys)
+        flags[f"Unparsed.{column.upper()}"] = flag
+
+    # fact columns under temporary names .. Spark resolves PATIENT_ID and patient_id to the same column
+    resolved = {}
+    for index, lookup in enumerate(model.lookups):
+        if lookup.column not in df.columns:
+            continue
+        value = col(f"`{lookup.column}`")
+        resolved[lookup.target] = f"_fact_{lookup.target}"
+        snapshot = snapshot_frame(lookup.dimension, list(dict.fromkeys((lookup.natural, lookup.surrogate))))
+        if snapshot is None:
+            df = df.withColumn(resolved[lookup.target], value)
+            continue
+        # one row per natural key, cast to the source column's type like the Lambda lookup
+        value_type = df.schema[lookup.column].dataType
+        natural, key = f"_natural_{index}", f"_key_{index}"
+        snapshot = snapshot.select(
+            col(lookup.natural).cast(value_type).alias(natural), col(lookup.surrogate).cast(value_type).alias(key)
+        ).dropDuplicates([natural])
+        flag = f"_unresolved_{lookup.target}"
+        df = df.join(broadcast(snapshot), value == col(natural), "left") \
+            .withColumn(resolved[lookup.target], col(key)) \
+            .withColumn(flag, value.isNotNull() & col(key).isNull()) \
+            .drop(natural, key)
+        flags[f"Unresolved.{lookup.target}"] = flag
+
+    counts = {}
+    if flags:
+        row = df.agg(*[sum_(when(col(flag), 1).otherwise(0)).alias(name) for name, flag in flags.items()]).collect()[0]
+        counts = {name: int(row[name] or 0) for name in flags}
+
+    selected = []
+    for name in model.columns:
+        if name in resolved:
+            selected.append(col(resolved[name]).alias(name))
+        elif name.lower() in df.columns:
+            selected.append(col(f"`{name.lower()}`").alias(name))
+        else:
+            # Parquet has no void type in Spark .. a typed null column instead of the Lambda's null type
+            selected.append(lit(None).cast("string").alias(name))
+    return df.select(*selected), counts
+
+
+def spark_snapshot_frame(spark, bucket: str):
+    """snapshot_frame for spark_build reading the dimension snapshots, None without a bucket."""
+    if not bucket:
+        return None
+    return lambda dimension, columns: spark.read.parquet(f"s3://{bucket}/{quality.reference_key(dimension)}") \
+        .select(*columns)
+
+
+def glue_build(spark, df, dataset_key: str, args: dict, cloudwatch):
+    """
+    Fact rows of a Glue job's DataFrame, the rows the application Lambda writes .. df itself when the dataset
+    has no fact model. Unresolved / unparsed counts go to CloudWatch.
+    """
+    model = model_for_key(dataset_key)
+    if model is None:
+        return df
+    date_keys.enable_strict_parsing(spark)
+    facts, counts = spark_build(df, model, spark_snapshot_frame(spark, args.get('REFERENCE_BUCKET')),
+                                schema_registry.date_formats_for_key(dataset_key))
+    metrics.put_counts(cloudwatch, counts, {
+        "Dataset": metrics.dataset_for_key(dataset_key),
+        "Layer": metrics.layer_for_bucket(args['SOURCE_BUCKET'])
+    })
+    return facts
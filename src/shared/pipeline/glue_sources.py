@@ -0,0 +1,66 @@
+"""
+Source objects of one Glue job run.
+
+A run converts either
+    --SOURCE_KEY     one object (what the per file state machine path sends)
+    --SOURCE_KEYS    a JSON list of keys
+    --MANIFEST_KEY   an object in SOURCE_BUCKET listing the keys (JSON list, {"objectKeys": [..]} or one key per line)
+    --SOURCE_PREFIX  everything under a prefix .. job bookmarks skip what earlier runs already converted
+so hundreds of objects share one Spark session instead of paying the Glue startup per object.
+"""
+import json
+
+SOURCE_ARGS = ["SOURCE_KEY", "SOURCE_KEYS", "MANIFEST_KEY", "SOURCE_PREFIX"]
+
+
+def present_args(argv: list) -> list:
+    """The optional source arguments passed to this run .. getResolvedOptions fails on missing ones."""
+    names = [name for name in SOURCE_ARGS if f"--{name}" in argv]
+    if not names:
+        raise ValueError(f"One of {', '.join('--' + name for name in SOURCE_ARGS)} is required")
+    return names
+
+
+def parse_manifest(body: str) -> list:
+    try:
+        manifest = json.loads(body)
+    except ValueError:
+        return [line.strip() for line in body.splitlines() if line.strip()]
+    if isinstance(manifest, dict):
+        manifest = manifest.get("objectKeys") or manifest.get("files") or []
+    return [entry["objectKey"] if isinstance(entry, dict) else entry for entry in manifest]
+
+
+def read_manifest(s3, bucket: str, key: str) -> list:
+    return parse_manifest(s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8"))
+
+
+def write_manifest(s3, bucket: str, key: str, object_keys: list):
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps({"objectKeys": object_keys}).encode("utf-8"),
+        ContentType="application/json"
+    )
+
+
+def source_keys(args: dict, s3=None) -> list:
+    """Explicit keys of this run, or [] for a --SOURCE_PREFIX run."""
+    if args.get("SOURCE_KEYS"):
+        return list(json.loads(args["SOURCE_KEYS"]))
+    if args.get("MANIFEST_KEY"):
+        return read_manifest(s3, args["SOURCE_BUCKET"], args["MANIFEST_KEY"])
+    if args.get("SOURCE_KEY"):
+        return [args["SOURCE_KEY"]]
+    return []
+
+
+def list_prefix(s3, bucket: str, prefix: str) -> list:
+    """Keys under prefix as compaction leaves them live .. never the inputs and outputs of a merge together."""
+    from pipeline import compaction
+
+    return compaction.live_keys_under(s3, bucket, prefix)
+
+
+def s3_paths(bucket: str, keys: list) -> list:
+    return [f"s3://{bucket}/{key}" for key in keys]
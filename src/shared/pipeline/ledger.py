@@ -0,0 +1,176 @@
+"""
+Idempotency ledger for the metadata dispatcher.
+
+S3 notifications arrive at least once and the stage bucket is versioned, so the same object version can be
+announced more than once. Every object version is claimed under bucket/key@etag before it is dispatched:
+
+    in-flight  claimed, held by the execution that processes the object .. expires after in_flight_seconds
+               (longer than the state machine timeout, a timed out execution never reaches its Catch)
+    done       processed, expires done_seconds after the claim (TTL eviction keeps the ledger small)
+
+A claim only succeeds when no unexpired entry exists, so duplicates of work that is done are skipped and
+duplicates of work in flight are retried later. A re-upload with different content has a new ETag and is
+processed again.
+
+The meta Lambda claims and releases claims whose execution could not be started. In AWS the state machine
+settles the rest (orchestration_stack/step_function_construct.py): a DynamoDB UpdateItem marks the claims of a
+successful execution done, a DeleteItem on the Catch path releases them for the retry. complete() is the same
+update for local runs.
+
+DynamoDBLedger is used in AWS (LEDGER_TABLE, TTL on expiresAt), SQLiteLedger (LEDGER_PATH) locally.
+"""
+import json
+import os
+import threading
+import time
+
+from pipeline import runtime
+
+IN_FLIGHT = "in-flight"
+DONE = "done"
+
+IN_FLIGHT_SECONDS = int(os.environ.get("LEDGER_IN_FLIGHT_SECONDS", "900"))
+DONE_SECONDS = int(os.environ.get("LEDGER_DONE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def ledger_key(bucket: str, key: str, etag: str) -> str:
+    etag = (etag or "").strip('"')
+    return f"{bucket}/{key}@{etag}"
+
+
+class DynamoDBLedger:
+    """Table with a string partition key ledgerKey and TTL enabled on expiresAt."""
+
+    def __init__(self, table_name: str, client=None, in_flight_seconds: int = IN_FLIGHT_SECONDS,
+                 done_seconds: int = DONE_SECONDS, clock=time.time):
+        self._client = client
+        self.table_name = table_name
+        self.in_flight_seconds = in_flight_seconds
+        self.done_seconds = done_seconds
+        self.clock = clock
+
+    @property
+    def client(self):
+        # built on first use, not when the dispatcher module is imported
+        return self._client or runtime.client("dynamodb")
+
+    def claim(self, entry_key: str) -> bool:
+        now = int(self.clock())
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "ledgerKey": {"S": entry_key},
+                    "status": {"S": IN_FLIGHT},
+                    "claimedAt": {"N": str(now)},
+                    "expiresAt": {"N": str(now + self.in_flight_seconds)}
+                },
+                # DynamoDB deletes expired items lazily .. an expired entry counts as absent
+                ConditionExpression="attribute_not_exists(ledgerKey) OR expiresAt < :now",
+                ExpressionAttributeValues={":now": {"N": str(now)}}
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def complete(self, entry_key: str, detail: dict = None):
+        # the update of the state machine success path .. an expired or released claim is left alone
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={"ledgerKey": {"S": entry_key}},
+                UpdateExpression="SET #status = :done, expiresAt = claimedAt + :done_seconds, detail = :detail",
+                ConditionExpression="#status = :in_flight",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={
+                    ":done": {"S": DONE},
+                    ":in_flight": {"S": IN_FLIGHT},
+                    ":done_seconds": {"N": str(self.done_seconds)},
+                    ":detail": {"S": json.dumps(detail or {})}
+                }
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def release(self, entry_key: str):
+        # only an in-flight claim is released .. never a done entry
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={"ledgerKey": {"S": entry_key}},
+                ConditionExpression="#status = :in_flight",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={":in_flight": {"S": IN_FLIGHT}}
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def status(self, entry_key: str):
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={"ledgerKey": {"S": entry_key}},
+            ConsistentRead=True
+        ).get("Item")
+        if not item or int(item["expiresAt"]["N"]) < self.clock():
+            return None
+        return item["status"]["S"]
+
+
+class SQLiteLedger:
+    """Same contract in one SQLite file .. local runs, benchmarks and tests."""
+
+    def __init__(self, path: str = ":memory:", in_flight_seconds: int = IN_FLIGHT_SECONDS,
+                 done_seconds: int = DONE_SECONDS, clock=time.time):
+        import sqlite3
+
+        self.in_flight_seconds = in_flight_seconds
+        self.done_seconds = done_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        # the dispatcher describes records from a thread pool
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            "ledger_key TEXT PRIMARY KEY, status TEXT NOT NULL, expires_at INTEGER NOT NULL, detail TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ledger_expires_at ON ledger (expires_at)")
+
+    def claim(self, entry_key: str) -> bool:
+        now = int(self.clock())
+        with self.lock:
+            # TTL eviction
+            self.connection.execute("DELETE FROM ledger WHERE expires_at < ?", (now,))
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO ledger (ledger_key, status, expires_at) VALUES (?, ?, ?)",
+                (entry_key, IN_FLIGHT, now + self.in_flight_seconds)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, entry_key: str, detail: dict = None):
+        with self.lock:
+            # claim time + done_seconds, as in DynamoDB
+            self.connection.execute(
+                "UPDATE ledger SET status = ?, expires_at = expires_at + ?, detail = ? "
+                "WHERE ledger_key = ? AND status = ?",
+                (DONE, self.done_seconds - self.in_flight_seconds, json.dumps(detail or {}), entry_key, IN_FLIGHT)
+            )
+
+    def release(self, entry_key: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM ledger WHERE ledger_key = ? AND status = ?", (entry_key, IN_FLIGHT))
+
+    def status(self, entry_key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status FROM ledger WHERE ledger_key = ? AND expires_at >= ?", (entry_key, int(self.clock()))
+            ).fetchone()
+        return row[0] if row else None
+
+
+def from_env():
+    """LEDGER_TABLE -> DynamoDB, LEDGER_PATH -> SQLite, neither -> None (every notification is processed)."""
+    if os.environ.get("LEDGER_TABLE"):
+        return DynamoDBLedger(os.environ["LEDGER_TABLE"])
+    if os.environ.get("LEDGER_PATH"):
+        return SQLiteLedger(os.environ["LEDGER_PATH"])
+    return None
@@ -0,0 +1,228 @@
+"""
+CloudWatch Embedded Metric Format (EMF) records written to stdout.
+
+Lambda ships stdout to CloudWatch Logs, which extracts the metrics from EMF lines .. no API call,
+no client, no extra latency in the invocation. METRICS_ENABLED=false turns emission off (local runs).
+
+cold_start wraps a handler and emits once per execution environment, on its first invocation:
+    ImportMs            handler module import, from the first `pipeline` import to the handler definition
+    ClientInitMs        boto3 import + client construction done by pipeline.runtime so far
+    FirstInvocationMs   the first invocation itself (pays for lazy imports and clients)
+    InitMs              process start until the first invocation (runtime bootstrap included, Linux only)
+
+invocation opens one Phases recorder per handler run, emitted as a single record with Dataset / Layer
+dimensions when the run ends. Code anywhere below the handler reports into it through phase() and add(),
+both are no-ops outside an invocation:
+    <Phase>Ms           wall time per phase (GetObject, Parse, Arrow, Quality, Lookup, ParquetWrite, PutObject, Copy, ..)
+    BytesIn / BytesOut  object bytes read / written
+    Rows                rows written
+Phases nested on one thread are exclusive (time in PutObject inside ParquetWrite is not counted twice),
+phases on other threads (read ahead, parallel parts) overlap the caller's.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import pipeline
+from pipeline import schema_registry
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "DataStack/Pipeline")
+ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+MILLISECONDS = "Milliseconds"
+COUNT = "Count"
+BYTES = "Bytes"
+
+GET_OBJECT = "GetObject"
+PARSE = "Parse"
+ARROW = "Arrow"
+PARQUET_WRITE = "ParquetWrite"
+PUT_OBJECT = "PutObject"
+COPY = "Copy"
+QUALITY = "Quality"
+LOOKUP = "Lookup"
+
+LAYERS = ("stage", "curated", "application")
+
+# the recorder of the running invocation .. one invocation at a time per execution environment
+_current = None
+
+
+def function_name(fn=None) -> str:
+    # the deployed function name, or the handler module when run locally
+    return os.environ.get("AWS_LAMBDA_FUNCTION_NAME") or (fn.__module__ if fn else "local")
+
+
+def emf_record(metrics: dict, dimensions: dict, properties: dict = None, namespace: str = NAMESPACE) -> dict:
+    """metrics: name -> (value, unit) .. dimensions: name -> value, all metrics share one dimension set."""
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()]
+            }]
+        },
+        **(properties or {}),
+        **dimensions
+    }
+    for name, (value, _) in metrics.items():
+        record[name] = value
+    return record
+
+
+def emit(metrics: dict, dimensions: dict, properties: dict = None, stream=None):
+    if not ENABLED or not metrics:
+        return
+    line = json.dumps(emf_record(metrics, dimensions, properties), default=str)
+    (stream or sys.stdout).write(line + "\n")
+
+
+def dataset_for_key(object_key: str) -> str:
+    """Registered dataset prefix, else the first key segment .. keeps the dimension cardinality low."""
+    matches = [prefix for prefix in schema_registry.DATASETS if prefix in object_key]
+    if matches:
+        return max(matches, key=len).strip("/")
+    return object_key.split("/", 1)[0] if "/" in object_key else "root"
+
+
+def layer_for_bucket(bucket_name: str) -> str:
+    bucket_name_lower = (bucket_name or "").lower()
+    return next((layer for layer in LAYERS if layer in bucket_name_lower), "other")
+
+
+def event_dimensions(event: dict) -> dict:
+    """Dataset / Layer (of the bucket read from) of a state machine event .. the first file of a batch."""
+    source = event["files"][0] if event.get("files") else event
+    object_key = source.get("objectKey") or next(iter(event.get("objectKeys", [])), "")
+    return {
+        "Dataset": dataset_for_key(object_key),
+        "Layer": layer_for_bucket(source.get("bucketName", event.get("bucketName")))
+    }
+
+
+class Phases:
+    """Phase durations and counters of one invocation .. thread safe."""
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add(self, name: str, value, unit: str = COUNT):
+        with self.lock:
+            current = self.values.get(name)
+            self.values[name] = (value + (current[0] if current else 0), unit)
+
+    @contextmanager
+    def phase(self, name: str):
+        stack = self.local.__dict__.setdefault("stack", [])
+        started = time.perf_counter()
+        if stack:
+            # pause the enclosing phase
+            parent = stack[-1]
+            self.add(f"{parent[0]}Ms", (started - parent[1]) * 1000, MILLISECONDS)
+        frame = [name, started]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            stack.pop()
+            self.add(f"{name}Ms", (ended - frame[1]) * 1000, MILLISECONDS)
+            if stack:
+                stack[-1][1] = ended
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {name: (round(value, 2) if unit == MILLISECONDS else value, unit)
+                    for name, (value, unit) in self.values.items()}
+
+
+@contextmanager
+def invocation(dimensions: dict):
+    """Collect the phases of one handler run and emit them as one record when it ends (also on error)."""
+    global _current
+    phases = _current = Phases()
+    try:
+        yield phases
+    finally:
+        _current = None
+        emit(phases.metrics(), dimensions)
+
+
+def phase(name: str):
+    return _current.phase(name) if _current is not None else nullcontext()
+
+
+def add(name: str, value, unit: str = COUNT):
+    if _current is not None:
+        _current.add(name, value, unit)
+
+
+def put_counts(cloudwatch, counts: dict, dimensions: dict):
+    """Glue has no EMF extraction .. counts the Lambdas emit as EMF, sent with PutMetricData."""
+    data = list(counts.items())
+    for start in range(0, len(data), 1000):
+        cloudwatch.put_metric_data(
+            Namespace=NAMESPACE,
+            MetricData=[{
+                "MetricName": name,
+                "Dimensions": [{"Name": key, "Value": value} for key, value in dimensions.items()],
+                "Value": count,
+                "Unit": COUNT
+            } for name, count in data[start:start + 1000]]
+        )
+
+
+def process_age_seconds():
+    """Seconds since this process started, None where /proc is not available."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def cold_start(fn):
+    """Emit the cold start metrics of this execution environment on the first invocation."""
+    from pipeline import runtime
+
+    defined_at = time.perf_counter()
+    state = {"cold": True}
+
+    @wraps(fn)
+    def handler(event, context):
+        if not state["cold"]:
+            return fn(event, context)
+
+        state["cold"] = False
+        init_seconds = process_age_seconds()
+        started = time.perf_counter()
+        try:
+            return fn(event, context)
+        finally:
+            metrics = {
+                "ImportMs": (round((defined_at - pipeline.IMPORT_STARTED) * 1000, 2), MILLISECONDS),
+                "ClientInitMs": (round(sum(runtime.CLIENT_INIT_SECONDS.values()) * 1000, 2), MILLISECONDS),
+                "FirstInvocationMs": (round((time.perf_counter() - started) * 1000, 2), MILLISECONDS),
+                "ColdStart": (1, COUNT)
+            }
+            if init_seconds is not None:
+                metrics["InitMs"] = (round(init_seconds * 1000, 2), MILLISECONDS)
+            emit(
+                metrics,
+                {"FunctionName": function_name(fn)},
+                {"clientInitMs": {name: round(seconds * 1000, 2)
+                                  for name, seconds in runtime.CLIENT_INIT_SECONDS.items()}}
+            )
+
+    return handler
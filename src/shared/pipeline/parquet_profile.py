@@ -0,0 +1,149 @@
+"""
+Named Parquet writer profiles shared by the Lambdas (pyarrow) and the Glue jobs (Spark).
+
+A profile fixes the codec, the row group size, dictionary encoding, column statistics and a sort order.
+Sorted row groups with statistics give Snowflake / Spark tight min/max ranges to prune on.
+PARQUET_PROFILE overrides the profile for every dataset, benchmark/parquet_profiles.py compares them.
+"""
+import os
+from typing import NamedTuple
+
+MB = 1024 * 1024
+
+
+class ParquetProfile(NamedTuple):
+    name: str
+    compression: str = "snappy"
+    compression_level: int = None
+    row_group_mb: int = 128  # uncompressed bytes buffered per row group
+    dictionary: bool = True
+    statistics: bool = True
+    sort_by: tuple = ()  # columns missing from a table are skipped
+    data_page_kb: int = 1024
+
+
+PROFILES = {
+    # pyarrow / Spark defaults
+    "default": ParquetProfile("default"),
+    # FACT_CLAIMS .. date ranges prune first, claim ids inside a day
+    "claims": ParquetProfile(
+        "claims", compression="zstd", compression_level=3, row_group_mb=128,
+        sort_by=("date_of_service", "claim_id")
+    ),
+    "claims-by-id": ParquetProfile(
+        "claims-by-id", compression="zstd", compression_level=3, row_group_mb=128,
+        sort_by=("claim_id",)
+    ),
+    # smallest files for cold data, slower to write
+    "archive": ParquetProfile(
+        "archive", compression="zstd", compression_level=9, row_group_mb=256,
+        sort_by=("date_of_service", "claim_id")
+    ),
+    # fastest write, no sort
+    "fast": ParquetProfile("fast", compression="snappy", row_group_mb=64, dictionary=False)
+}
+
+# dataset prefix -> profile
+DATASET_PROFILES = {
+    "claims/": "claims"
+}
+
+
+def get_profile(name: str) -> ParquetProfile:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown Parquet profile: {name}")
+    return PROFILES[name]
+
+
+def profile_for_key(object_key: str) -> ParquetProfile:
+    if os.environ.get("PARQUET_PROFILE"):
+        return get_profile(os.environ["PARQUET_PROFILE"])
+    matches = [prefix for prefix in DATASET_PROFILES if prefix in object_key]
+    return get_profile(DATASET_PROFILES[max(matches, key=len)] if matches else "default")
+
+
+def arrow_writer_options(profile: ParquetProfile) -> dict:
+    return {
+        "compression": profile.compression,
+        "compression_level": profile.compression_level,
+        "use_dictionary": profile.dictionary,
+        "write_statistics": profile.statistics,
+        "data_page_size": profile.data_page_kb * 1024
+    }
+
+
+def sort_table(table, profile: ParquetProfile):
+    # matched case-insensitively .. fact tables (pipeline/fact_model.py) carry the upper case Snowflake names
+    names = {name.lower(): name for name in table.column_names}
+    sort_keys = [(names[name.lower()], "ascending") for name in profile.sort_by if name.lower() in names]
+    return table.sort_by(sort_keys) if sort_keys and table.num_rows else table
+
+
+def rows_per_group(table, profile: ParquetProfile) -> int:
+    if not table.num_rows:
+        return 1
+    return max(1, int(profile.row_group_mb * MB / max(table.nbytes / table.num_rows, 1)))
+
+
+class ProfiledParquetWriter:
+    """
+    pyarrow.parquet.ParquetWriter that buffers incoming tables until a row group of profile.row_group_mb
+    is collected, then sorts and writes it. Streaming readers hand over small blocks ..
+    this keeps row groups at the profile size and sorted within each group.
+    """
+
+    def __init__(self, sink, schema, profile: ParquetProfile):
+        import pyarrow.parquet as pq
+
+        self.profile = profile
+        self.writer = pq.ParquetWriter(sink, schema, **arrow_writer_options(profile))
+        self.pending = []
+        self.pending_bytes = 0
+
+    def write_table(self, table):
+        self.pending.append(table)
+        self.pending_bytes += table.nbytes
+        if self.pending_bytes >= self.profile.row_group_mb * MB:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+
+        if not self.pending:
+            return
+        table = sort_table(pa.concat_tables(self.pending), self.profile)
+        self.pending, self.pending_bytes = [], 0
+        self.writer.write_table(table, row_group_size=rows_per_group(table, self.profile))
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def write_table(table, sink, profile: ParquetProfile):
+    """Sort the whole table, then write it in row groups of the profile size."""
+    import pyarrow.parquet as pq
+
+    table = sort_table(table, profile)
+    pq.write_table(table, sink, row_group_size=rows_per_group(table, profile), **arrow_writer_options(profile))
+
+
+def spark_write_options(profile: ParquetProfile) -> dict:
+    """DataFrameWriter options .. parquet-mr always writes min/max statistics."""
+    options = {
+        "compression": profile.compression,
+        "parquet.block.size": str(profile.row_group_mb * MB),
+        "parquet.page.size": str(profile.data_page_kb * 1024),
+        "parquet.enable.dictionary": str(profile.dictionary).lower()
+    }
+    if profile.compression == "zstd" and profile.compression_level:
+        options["parquet.compression.codec.zstd.level"] = str(profile.compression_level)
+    return options
+
+
+def spark_sort(df, profile: ParquetProfile, partition_columns: list = ()):
+    # sorting inside each Spark partition is enough for per file min/max pruning, no global shuffle ..
+    # partitionBy columns go first, otherwise the writer re-sorts by them alone and drops this order
+    names = {name.lower(): name for name in df.columns}
+    sort_by = [names[name.lower()] for name in profile.sort_by if name.lower() in names]
+    return df.sortWithinPartitions(*partition_columns, *sort_by) if sort_by else df
@@ -0,0 +1,62 @@
+"""
+Partition layout for Parquet written by the Glue jobs, and destination keys of the Lambdas.
+
+    <dest prefix>/service_month=202401/ingest_run=3f9c2a1b7d4e8f60/part-*.parquet
+
+service_month (yyyymm of the yyyymmdd date_of_service key) is what readers prune on, datasets
+without a date_of_service fall back to ingest_date (yyyy-mm-dd of the run).
+ingest_run scopes the dynamic partition overwrite to one run: a re-run of the same sources replaces only what
+that run wrote, and two runs with rows in the same month never overwrite each other. It is one value per run
+(a manifest of hundreds of objects shares it), so the partition count grows with runs, not with source objects,
+and every run leaves its files side by side for compaction.
+"""
+import hashlib
+import time
+
+SERVICE_DATE_COLUMN = "date_of_service"
+SERVICE_MONTH_COLUMN = "service_month"
+INGEST_DATE_COLUMN = "ingest_date"
+INGEST_RUN_COLUMN = "ingest_run"
+
+
+def dest_path(bucket: str, prefix: str) -> str:
+    prefix = (prefix or "").strip("/")
+    return f"s3://{bucket}/{prefix}/" if prefix and prefix != "N/A" else f"s3://{bucket}/"
+
+
+def object_key(prefix: str, key: str) -> str:
+    """Key of a copy / conversion of key under a destination prefix, the source layout is kept below it."""
+    prefix = (prefix or "").strip("/")
+    if not prefix or prefix == "N/A" or key.startswith(f"{prefix}/"):
+        return key
+    return f"{prefix}/{key}"
+
+
+def enable_dynamic_overwrite(spark):
+    # mode("overwrite") only replaces the partitions present in the DataFrame being written
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+
+
+def ingest_run(source_keys: list) -> str:
+    """
+    Run scoped partition value .. the same source keys always give the same value, so a re-run replaces its own
+    partitions. A --SOURCE_PREFIX run (no explicit keys, the job bookmark skips what was read) gets its start time.
+    """
+    if not source_keys:
+        return time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    return hashlib.sha256("\n".join(sorted(source_keys)).encode("utf-8")).hexdigest()[:16]
+
+
+def add_partition_columns(df, run: str) -> tuple:
+    """Return (df, partition columns) with the service month / ingest date and the ingest run columns added."""
+    from pyspark.sql.functions import col, current_date, date_format, floor, lit
+
+    # conformed rows name it date_of_service, fact rows DATE_OF_SERVICE
+    service_date = next((name for name in df.columns if name.lower() == SERVICE_DATE_COLUMN), None)
+    if service_date is not None:
+        df = df.withColumn(SERVICE_MONTH_COLUMN, floor(col(service_date) / 100).cast("int"))
+        date_column = SERVICE_MONTH_COLUMN
+    else:
+        df = df.withColumn(INGEST_DATE_COLUMN, date_format(current_date(), "yyyy-MM-dd"))
+        date_column = INGEST_DATE_COLUMN
+    return df.withColumn(INGEST_RUN_COLUMN, lit(run)), [date_column, INGEST_RUN_COLUMN]
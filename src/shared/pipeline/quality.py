@@ -0,0 +1,348 @@
+"""
+Declarative data quality rules per dataset prefix, evaluated the same way by the Lambdas (Arrow compute kernels)
+and the Glue jobs (Spark column expressions).
+
+    not_null     the column has a value
+    in_range     min <= value <= max (either bound optional)
+    allowed      value is one of a fixed set
+    references   value is a key of a dimension (DIM_* key columns exported to REFERENCE_BUCKET)
+    unique       first occurrence of a value wins, later rows with the same value fail
+
+Nulls only fail not_null .. the other rules skip them. Rows failing any rule are written to the quarantine
+Parquet file (quarantine_key) with the names of the rules they failed in FAILED_RULES_COLUMN, the rest goes on.
+Per rule failure counts are reported as Quality.<rule> metrics plus QuarantinedRows.
+
+Reference keys are read from the dimension snapshots s3://<REFERENCE_BUCKET>/<REFERENCE_PREFIX><dimension>.parquet,
+cached per container and revalidated by ETag (pipeline/dimension_cache.py). Without REFERENCE_BUCKET the
+references rules are skipped.
+unique is checked across the whole file, except for the chunked route where every part is checked on its own.
+The distinct values of the file are held in memory, so files expected to have more rows than maxUniqueRows
+(routing_table.json) are routed to Glue.
+DATA_QUALITY=false turns the checks off (the application layer reads data the curate layer already checked).
+"""
+import os
+from decimal import Decimal
+from typing import NamedTuple
+
+from pipeline import metrics
+
+ENABLED = os.environ.get("DATA_QUALITY", "true").lower() == "true"
+
+REFERENCE_BUCKET = os.environ.get("REFERENCE_BUCKET")
+REFERENCE_PREFIX = os.environ.get("REFERENCE_PREFIX", "reference/")
+
+# outside the dataset prefixes .. compaction, Snowpipe and the bucket notifications never see it
+QUARANTINE_PREFIX = os.environ.get("QUARANTINE_PREFIX", "quarantine/")
+FAILED_RULES_COLUMN = "_failed_rules"
+
+
+class Rule(NamedTuple):
+    name: str
+    check: str
+    column: str
+    min: object = None
+    max: object = None
+    values: tuple = ()
+    dimension: str = None  # references: dimension table and its key column
+    key: str = None
+
+
+def not_null(column: str) -> Rule:
+    return Rule(f"{column}_not_null", "not_null", column)
+
+
+def in_range(column: str, min=None, max=None) -> Rule:
+    return Rule(f"{column}_in_range", "in_range", column, min=min, max=max)
+
+
+def allowed(column: str, values) -> Rule:
+    return Rule(f"{column}_allowed", "allowed", column, values=tuple(values))
+
+
+def references(column: str, dimension: str, key: str) -> Rule:
+    return Rule(f"{column}_references_{dimension.lower()}", "references", column, dimension=dimension, key=key)
+
+
+def unique(column: str) -> Rule:
+    return Rule(f"{column}_unique", "unique", column)
+
+
+# FACT_CLAIMS .. the NOT NULL filter is what the Glue curate job applied before the rules existed
+CLAIMS_RULES = [
+    not_null("claim_id"),
+    unique("claim_id"),
+    not_null("allowed_amount"),
+    not_null("patient_id"),
+    not_null("provider_id"),
+    not_null("date_of_service"),
+    references("patient_id", "DIM_PATIENT", "PATIENT_ID"),
+    references("provider_id", "DIM_PROVIDER", "PROVIDER_ID"),
+    in_range("date_of_service", 19000101, 21001231),
+    in_range("paid_date", 19000101, 21001231),
+    in_range("allowed_amount", min=0),
+    in_range("billed_amount", min=0),
+    in_range("coinsurance_amount", min=0),
+    in_range("deductible_amount", min=0),
+    in_range("paid_amount", min=0)
+]
+
+RULES = {
+    "claims/type=structured/": CLAIMS_RULES,
+    "claims/type=semi-structured/": CLAIMS_RULES
+}
+
+
+def rules_for_key(object_key: str) -> list:
+    """Rules of the dataset an object belongs to (longest matching prefix), None when checks are off or none apply."""
+    if not ENABLED:
+        return None
+    matches = [prefix for prefix in RULES if prefix in object_key]
+    if not matches:
+        return None
+    return RULES[max(matches, key=len)]
+
+
+def quarantine_key(dest_key: str) -> str:
+    return f"{QUARANTINE_PREFIX}{dest_key}"
+
+
+def reference_key(dimension: str) -> str:
+    return f"{REFERENCE_PREFIX}{dimension.lower()}.parquet"
+
+
+# Arrow (Lambda)
+
+def load_reference_keys(dimension: str, key: str, arrow_type=None):
+    """
+    Key column of a dimension as an Arrow array (cast to arrow_type once per snapshot), None without
+    REFERENCE_BUCKET .. see pipeline/dimension_cache.py.
+    """
+    from pipeline import dimension_cache
+
+    cache = dimension_cache.get_cache()
+    if cache is None:
+        return None
+    return cache.table(dimension, [key], {key: arrow_type} if arrow_type is not None else None).column(key)
+
+
+def bound(value, arrow_type):
+    """A rule's bound as a scalar of the column type .. decimals are built from text, a cast from int64 overflows."""
+    import pyarrow as pa
+
+    if pa.types.is_decimal(arrow_type):
+        return pa.scalar(Decimal(str(value)), arrow_type)
+    return pa.scalar(value).cast(arrow_type)
+
+
+def bound_array(values: tuple, arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_decimal(arrow_type):
+        return pa.array([Decimal(str(value)) for value in values], arrow_type)
+    return pa.array(values).cast(arrow_type)
+
+
+class ArrowChecker:
+    """
+    Evaluates rules on Arrow tables, one or many (the batches of one streamed file).
+    reference_keys(dimension, key, arrow_type) returns the dimension keys or None (rule skipped).
+    Values of unique columns are remembered across check() calls so duplicates in later batches are caught.
+    """
+
+    def __init__(self, rules: list, reference_keys=None):
+        self.rules = rules
+        self.reference_keys = reference_keys or (lambda dimension, key, arrow_type: None)
+        # sorted distinct values per unique column (numpy) .. grows with the file, see routing maxUniqueRows
+        self.seen = {rule.column: None for rule in rules if rule.check == "unique"}
+        self.counts = {rule.name: 0 for rule in rules}
+
+    def failures(self, table, rule):
+        """Boolean array, true where the row fails the rule .. None when the rule does not apply."""
+        import pyarrow.compute as pc
+
+        if rule.column not in table.column_names:
+            return None
+        values = table.column(rule.column)
+        if rule.check == "not_null":
+            return pc.is_null(values)
+        if rule.check == "in_range":
+            failed = None
+            if rule.min is not None:
+                failed = pc.less(values, bound(rule.min, values.type))
+            if rule.max is not None:
+                above = pc.greater(values, bound(rule.max, values.type))
+                failed = above if failed is None else pc.or_(failed, above)
+            return pc.fill_null(failed, False) if failed is not None else None
+        if rule.check == "allowed":
+            return pc.and_not(pc.is_valid(values), pc.is_in(values, value_set=bound_array(rule.values, values.type)))
+        if rule.check == "references":
+            keys = self.reference_keys(rule.dimension, rule.key, values.type)
+            if keys is None:
+                return None
+            from pipeline import dimension_cache
+
+            return pc.and_not(pc.is_valid(values), dimension_cache.member(values, keys))
+        if rule.check == "unique":
+            return self.duplicates(rule.column, values)
+        raise ValueError(f"Unknown check: {rule.check}")
+
+    def duplicates(self, column: str, values):
+        """Rows repeating a value seen earlier (in this table or an earlier one)."""
+        import numpy as np
+        import pyarrow as pa
+
+        values = values.combine_chunks() if isinstance(values, pa.ChunkedArray) else values
+        valid = values.is_valid().to_numpy(zero_copy_only=False)
+        present = values.drop_null().to_numpy(zero_copy_only=False)
+
+        # first occurrence of every distinct value of this table, probed against the sorted values seen so far
+        distinct, first = np.unique(present, return_index=True)
+        seen = self.seen[column]
+        if seen is None or not len(seen):
+            new = np.ones(len(distinct), dtype=bool)
+            self.seen[column] = distinct
+        else:
+            positions = np.searchsorted(seen, distinct)
+            new = (positions == len(seen)) | (seen[np.minimum(positions, len(seen) - 1)] != distinct)
+            # merged into the sorted array .. one copy of every distinct value, no history kept per batch
+            self.seen[column] = np.insert(seen, positions[new], distinct[new])
+
+        repeat = np.ones(len(present), dtype=bool)
+        repeat[first[new]] = False
+        failed = np.zeros(len(values), dtype=bool)
+        failed[valid] = repeat
+        return pa.array(failed)
+
+    def check(self, table) -> tuple:
+        """(valid rows, quarantined rows with FAILED_RULES_COLUMN) .. failure counts add up in self.counts."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        with metrics.phase(metrics.QUALITY):
+            reasons, any_failed = [], None
+            for rule in self.rules:
+                failed = self.failures(table, rule)
+                if failed is None:
+                    continue
+                count = pc.sum(failed).as_py() or 0
+                self.counts[rule.name] += count
+                if count:
+                    reasons.append(pc.if_else(failed, f"{rule.name},", ""))
+                    any_failed = failed if any_failed is None else pc.or_(any_failed, failed)
+
+            if any_failed is None:
+                return table, table.schema.empty_table().append_column(FAILED_RULES_COLUMN, pa.array([], pa.string()))
+            # (null_handling="skip" drops rows where every input is null in pyarrow 20, so no nulls here)
+            failed_rules = pc.utf8_rtrim(pc.binary_join_element_wise(*reasons, ""), characters=",")
+            quarantined = table.filter(any_failed).append_column(FAILED_RULES_COLUMN, failed_rules.filter(any_failed))
+            return table.filter(pc.invert(any_failed)), quarantined
+
+    def report(self, quarantined_rows: int):
+        for name, count in self.counts.items():
+            metrics.add(f"Quality.{name}", count)
+        metrics.add("QuarantinedRows", quarantined_rows)
+
+
+# Spark (Glue)
+
+def spark_check(df, rules: list, reference_frame=None) -> tuple:
+    """
+    (valid rows, quarantined rows with FAILED_RULES_COLUMN, failure count per rule) .. the Spark twin of
+    ArrowChecker. reference_frame(dimension, key) returns a DataFrame of dimension keys or None (rule skipped).
+    """
+    from pyspark.sql import Window
+    from pyspark.sql.functions import broadcast, col, concat_ws, lit, monotonically_increasing_id, row_number, when
+    from pyspark.sql.functions import sum as sum_
+
+    reference_frame = reference_frame or (lambda dimension, key: None)
+    flags = {}
+    for rule in rules:
+        if rule.column not in df.columns:
+            continue
+        value = col(f"`{rule.column}`")
+        if rule.check == "not_null":
+            flags[rule.name] = value.isNull()
+        elif rule.check == "in_range":
+            failed = lit(False)
+            if rule.min is not None:
+                failed = failed | (value < lit(rule.min))
+            if rule.max is not None:
+                failed = failed | (value > lit(rule.max))
+            flags[rule.name] = value.isNotNull() & failed
+        elif rule.check == "allowed":
+            flags[rule.name] = value.isNotNull() & ~value.isin(list(rule.values))
+        elif rule.check == "references":
+            keys = reference_frame(rule.dimension, rule.key)
+            if keys is None:
+                continue
+            marker = f"_ref_{rule.name}"
+            df = df.join(
+                broadcast(keys.select(col(rule.key).alias(marker)).distinct()),
+                value == col(marker),
+                "left"
+            )
+            flags[rule.name] = value.isNotNull() & col(marker).isNull()
+        elif rule.check == "unique":
+            # first occurrence in read order wins, like the Arrow checker
+            if "_rank_order" not in df.columns:
+                df = df.withColumn("_rank_order", monotonically_increasing_id())
+            order = Window.partitionBy(value).orderBy(col("_rank_order"))
+            df = df.withColumn(f"_rank_{rule.name}", row_number().over(order))
+            flags[rule.name] = value.isNotNull() & (col(f"_rank_{rule.name}") > 1)
+        else:
+            raise ValueError(f"Unknown check: {rule.check}")
+
+    # the counts and both outputs read the same flagged rows .. cached so the source is read once
+    df = df.withColumn(
+        FAILED_RULES_COLUMN,
+        concat_ws(",", *[when(flag, lit(name)) for name, flag in flags.items()]) if flags else lit("")
+    ).cache()
+
+    counts = {}
+    if flags:
+        row = df.agg(*[sum_(when(flag, 1).otherwise(0)).alias(name) for name, flag in flags.items()]).collect()[0]
+        counts = {name: int(row[name] or 0) for name in flags}
+
+    df = df.drop(*[name for name in df.columns if name.startswith(("_ref_", "_rank_"))])
+    failed = col(FAILED_RULES_COLUMN) != ""
+    return df.filter(~failed).drop(FAILED_RULES_COLUMN), df.filter(failed), counts
+
+
+def spark_reference_frame(spark, bucket: str):
+    """reference_frame for spark_check reading the dimension key files, None without a bucket."""
+    if not bucket:
+        return None
+    return lambda dimension, key: spark.read.parquet(f"s3://{bucket}/{reference_key(dimension)}").select(key)
+
+
+def glue_check(spark, df, dataset_key: str, args: dict, cloudwatch, run: str):
+    """
+    Valid rows of a Glue job's DataFrame .. quarantined rows are written under the quarantine prefix
+    of DEST_PREFIX (same partitions, run is the job's ingest_run) and the counts go to CloudWatch.
+    df itself when no rules apply.
+    """
+    from pipeline import partitioning
+
+    rules = rules_for_key(dataset_key)
+    if not rules:
+        return df
+    valid, quarantined, counts = spark_check(df, rules, spark_reference_frame(spark, args.get('REFERENCE_BUCKET')))
+    quarantined_rows = quarantined.count()
+    if quarantined_rows:
+        bucket = args['DEST_BUCKET']
+        dest_prefix = partitioning.dest_path(bucket, args['DEST_PREFIX'])[len(f"s3://{bucket}/"):]
+        quarantined, partition_columns = partitioning.add_partition_columns(quarantined, run)
+        quarantined.write.mode("overwrite").partitionBy(*partition_columns) \
+            .parquet(f"s3://{bucket}/{quarantine_key(dest_prefix)}")
+    put_metrics(cloudwatch, counts, quarantined_rows, {
+        "Dataset": metrics.dataset_for_key(dataset_key),
+        "Layer": metrics.layer_for_bucket(args['SOURCE_BUCKET'])
+    })
+    return valid
+
+
+def put_metrics(cloudwatch, counts: dict, quarantined_rows: int, dimensions: dict):
+    """The quality metrics the Lambdas emit, sent with PutMetricData."""
+    data = {f"Quality.{name}": count for name, count in counts.items()}
+    data["QuarantinedRows"] = quarantined_rows
+    metrics.put_counts(cloudwatch, data, dimensions)
@@ -0,0 +1,223 @@
+"""
+Lambda vs streaming Lambda vs chunked Lambdas vs Glue routing.
+
+Every route (layer/format) keeps measured figures per engine in routing_table.json:
+startupSeconds + size / throughputMBps predicts the runtime, baseMemoryMB + memoryPerMB * size the
+peak memory (streaming engines hold one block, so their memoryPerMB is ~0).
+Lambda engines are only candidates while the prediction fits the function memory and timeout with
+headroom .. the cheapest or fastest candidate wins (ROUTING_OBJECTIVE).
+The chunked engine (pipeline/chunked.py) converts chunkMB ranges on up to maxConcurrency Lambdas at once, its
+figures are per part: the prediction is startupSeconds (plan + commit) plus one part's runtime per wave of parts,
+and every part, not the whole file, has to fit a Lambda. Only registered datasets are chunked (see chunked.py).
+Datasets with a unique quality rule hold every distinct value of a file (of a part when chunked) in memory: routes
+with a bytesPerRow figure estimate the row count, and Lambda engines above quality.maxUniqueRows are rejected.
+Refit the table from recorded runs with benchmark/fit_routing.py.
+
+    python -m pipeline.routing --bucket stage-bucket --key claims/type=structured/x.csv --size 3GB
+"""
+import json
+import math
+import os
+from pathlib import Path
+from typing import NamedTuple
+
+from pipeline import quality, schema_registry
+
+DEFAULT_TABLE_PATH = Path(__file__).with_name("routing_table.json")
+
+ENGINES = ("lambda", "streaming", "chunked", "glue")
+LAMBDA_ENGINES = ("lambda", "streaming", "chunked")
+
+# what the curate / application Lambdas expect in event["engine"]
+HANDLER_ENGINE = {"lambda": "in-memory", "streaming": "streaming"}
+
+# only newline delimited JSON can be read block by block
+STREAMABLE_SUFFIXES = {"semi-structured": (".ndjson", ".jsonl")}
+
+MB = 1024 * 1024
+
+_table = None
+
+
+class Route(NamedTuple):
+    engine: str
+    expectedSeconds: float
+    expectedMemoryMB: float
+    expectedCost: float
+    reason: str = ""
+
+    def as_input(self) -> dict:
+        """Fields merged into the state machine input."""
+        route = {
+            "route": self.engine,
+            "routeEstimate": {
+                "expectedSeconds": round(self.expectedSeconds, 2),
+                "expectedMemoryMB": round(self.expectedMemoryMB),
+                "expectedCostUSD": round(self.expectedCost, 6),
+                "reason": self.reason
+            }
+        }
+        if self.engine in HANDLER_ENGINE:
+            route["engine"] = HANDLER_ENGINE[self.engine]
+        return route
+
+
+def load_routing_table(path=None) -> dict:
+    with open(path or os.environ.get("ROUTING_TABLE_PATH") or DEFAULT_TABLE_PATH) as f:
+        return json.load(f)
+
+
+def get_routing_table() -> dict:
+    # loaded once per container
+    global _table
+    if _table is None:
+        _table = load_routing_table()
+    return _table
+
+
+def data_format_for_key(object_key: str) -> str:
+    for data_format in ("semi-structured", "unstructured", "structured"):
+        if f"type={data_format}/" in object_key:
+            return data_format
+    return None
+
+
+def route_key(layer: str, object_key: str) -> str:
+    data_format = data_format_for_key(object_key)
+    return f"{layer}/{data_format}" if data_format else None
+
+
+def predict_seconds(figures: dict, size_bytes: int) -> float:
+    return figures["startupSeconds"] + size_bytes / MB / figures["throughputMBps"]
+
+
+def predict_memory_mb(figures: dict, size_bytes: int) -> float:
+    return figures["baseMemoryMB"] + figures.get("memoryPerMB", 0.0) * size_bytes / MB
+
+
+def chunked_parts(figures: dict, size_bytes: int) -> tuple:
+    """(part count, bytes per part) of a chunked conversion."""
+    parts = max(math.ceil(size_bytes / (figures["chunkMB"] * MB)), 1)
+    return parts, size_bytes / parts
+
+
+def predict(table: dict, engine: str, figures: dict, size_bytes: int) -> tuple:
+    """(seconds, peak memory MB per Lambda or job, cost) of one engine."""
+    if engine != "chunked":
+        seconds = predict_seconds(figures, size_bytes)
+        return seconds, predict_memory_mb(figures, size_bytes), predict_cost(table, engine, seconds)
+
+    parts, part_bytes = chunked_parts(figures, size_bytes)
+    part_seconds = predict_seconds({**figures, "startupSeconds": 0.0}, part_bytes)
+    waves = math.ceil(parts / figures["maxConcurrency"])
+    seconds = figures["startupSeconds"] + waves * part_seconds
+    # the plan and commit Lambdas are billed too, roughly one startup's worth
+    cost = parts * predict_cost(table, engine, part_seconds) + predict_cost(table, engine, figures["startupSeconds"])
+    return seconds, predict_memory_mb(figures, part_bytes), cost
+
+
+def predict_cost(table: dict, engine: str, seconds: float) -> float:
+    if engine == "glue":
+        glue = table["glue"]
+        billed_seconds = max(seconds, glue["minimumBilledSeconds"])
+        return glue["workers"] * glue["dpuPerWorker"] * billed_seconds / 3600 * glue["pricePerDPUHour"]
+    lambda_ = table["lambda"]
+    # billed for the configured memory, not the memory used
+    return seconds * lambda_["memoryMB"] / 1024 * lambda_["pricePerGBSecond"] + lambda_["pricePerRequest"]
+
+
+def expected_rows(route: dict, size_bytes: int) -> int:
+    """Rows of an object estimated from the route's bytesPerRow, None without the figure."""
+    if not route.get("bytesPerRow"):
+        return None
+    return math.ceil(size_bytes / route["bytesPerRow"])
+
+
+def has_unique_rule(object_key: str) -> bool:
+    return any(rule.check == "unique" for rule in quality.rules_for_key(object_key) or [])
+
+
+def candidate_engines(route: dict, data_format: str, object_key: str) -> list:
+    engines = [engine for engine in ENGINES if engine in route]
+    if "chunked" in engines and not schema_registry.columns_for_key(object_key):
+        engines.remove("chunked")
+    suffixes = STREAMABLE_SUFFIXES.get(data_format)
+    if suffixes and not object_key.lower().endswith(suffixes):
+        engines = [engine for engine in engines if engine != "streaming"]
+    return engines
+
+
+def decide(layer: str, object_key: str, size_bytes: int, table: dict = None, objective: str = None) -> Route:
+    """
+    Pick the engine for one object. Returns None when the table has no route for it,
+    the state machine then falls back to its size check.
+    """
+    table = table or get_routing_table()
+    objective = (objective or os.environ.get("ROUTING_OBJECTIVE") or table.get("objective", "latency")).lower()
+    key = route_key(layer, object_key)
+    if key not in table["routes"]:
+        return None
+
+    lambda_ = table["lambda"]
+    max_seconds = lambda_["timeoutSeconds"] * lambda_["headroom"]
+    max_memory_mb = lambda_["memoryMB"] * lambda_["headroom"]
+    # the unique check of a Lambda keeps the distinct values of what it converts .. Glue checks with a shuffle
+    max_unique_rows = table.get("quality", {}).get("maxUniqueRows") if has_unique_rule(object_key) else None
+
+    routes, rejected = [], []
+    for engine in candidate_engines(table["routes"][key], data_format_for_key(object_key), object_key):
+        figures = table["routes"][key][engine]
+        seconds, memory_mb, cost = predict(table, engine, figures, size_bytes)
+
+        if engine == "chunked":
+            parts, part_bytes = chunked_parts(figures, size_bytes)
+            part_seconds = predict_seconds({**figures, "startupSeconds": 0.0}, part_bytes)
+            if parts > figures["maxParts"] or part_seconds > max_seconds or memory_mb > max_memory_mb:
+                rejected.append(f"chunked needs {parts} parts of {part_seconds:.0f}s / {memory_mb:.0f}MB")
+                continue
+            rows = expected_rows(table["routes"][key], part_bytes)
+        elif engine in LAMBDA_ENGINES and (seconds > max_seconds or memory_mb > max_memory_mb):
+            rejected.append(f"{engine} needs {seconds:.0f}s / {memory_mb:.0f}MB")
+            continue
+        else:
+            rows = expected_rows(table["routes"][key], size_bytes)
+        if engine in LAMBDA_ENGINES and max_unique_rows and rows and rows > max_unique_rows:
+            rejected.append(f"{engine} would check {rows} rows for uniqueness")
+            continue
+        routes.append(Route(engine, seconds, memory_mb, cost))
+
+    if not routes:
+        raise ValueError(f"No feasible engine for {key} at {size_bytes} bytes: {'; '.join(rejected)}")
+
+    if objective == "cost":
+        best = min(routes, key=lambda route: (route.expectedCost, route.expectedSeconds))
+    else:
+        best = min(routes, key=lambda route: (route.expectedSeconds, route.expectedCost))
+    reason = f"{key} {size_bytes / MB:.1f}MB, lowest {objective}"
+    if rejected:
+        reason += f" ({'; '.join(rejected)})"
+    return best._replace(reason=reason)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Route one object offline")
+    parser.add_argument("--bucket", required=True, help="bucket name .. stage / curated / application decides the layer")
+    parser.add_argument("--key", required=True)
+    parser.add_argument("--size", required=True, help="bytes, or with a KB / MB / GB suffix")
+    parser.add_argument("--table", help="routing table JSON, defaults to the bundled one")
+    parser.add_argument("--objective", choices=("latency", "cost"))
+    args = parser.parse_args(argv)
+
+    units = {"KB": 1024, "MB": MB, "GB": 1024 * MB}
+    size = args.size.upper()
+    size_bytes = int(float(size[:-2]) * units[size[-2:]]) if size[-2:] in units else int(size)
+    layer = next((layer for layer in ("stage", "curated", "application") if layer in args.bucket.lower()), None)
+
+    route = decide(layer, args.key, size_bytes, load_routing_table(args.table), args.objective)
+    print(json.dumps(route.as_input() if route else {"route": None}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
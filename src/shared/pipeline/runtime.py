@@ -0,0 +1,83 @@
+"""
+Shared Lambda runtime helpers.
+
+boto3 is imported and clients are built on first use, not at module load, so an image only pays for what
+its handler actually calls. Clients are cached per process and reused by warm invocations.
+CLIENT_HOOKS are called with every new client (benchmarks attach their API timers there),
+CLIENT_INIT_SECONDS keeps the construction time per service for the cold start metrics.
+"""
+import json
+import logging
+import threading
+import time
+from functools import wraps
+
+from pipeline import metrics
+
+SUCCESS_BODY = 'Successful Step Functions execution! This goes to the next state.'
+
+CLIENT_HOOKS = []
+CLIENT_INIT_SECONDS = {}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+logger = logging.getLogger()
+logger.setLevel(logging.ERROR)
+
+
+def client(service_name: str):
+    """Cached boto3 client .. safe to call from the dispatcher's thread pool."""
+    cached = _clients.get(service_name)
+    if cached is not None:
+        return cached
+    with _clients_lock:
+        if service_name not in _clients:
+            started = time.perf_counter()
+            import boto3
+
+            new_client = boto3.client(service_name)
+            CLIENT_INIT_SECONDS[service_name] = time.perf_counter() - started
+            for hook in CLIENT_HOOKS:
+                hook(service_name, new_client)
+            _clients[service_name] = new_client
+        return _clients[service_name]
+
+
+def reset_clients():
+    """Drop cached clients, e.g. after switching credentials or endpoints in a local run."""
+    with _clients_lock:
+        _clients.clear()
+
+
+def log_error(e: Exception, context, event: dict):
+    error_log = {
+        "errorMessage": str(e),
+        "awsRequestId": getattr(context, "aws_request_id", "N/A"),
+        "objectKey": event.get("objectKey"),
+        "bucketName": event.get("bucketName")
+    }
+    logger.error(json.dumps(error_log))
+
+
+def step_handler(fn):
+    """
+    Wrap a state machine task: fn(event, context) does the work, the wrapper returns the usual
+    200 response (plus the keys of a dict fn returns) and logs + re-raises errors so Step Functions sees the failure.
+    Cold start metrics are emitted on the first invocation, phase metrics on every invocation.
+    """
+    @metrics.cold_start
+    @wraps(fn)
+    def handler(event, context):
+        try:
+            with metrics.invocation(metrics.event_dimensions(event)):
+                result = fn(event, context)
+            return {
+                'statusCode': 200,
+                'body': json.dumps(SUCCESS_BODY),
+                **(result or {})
+            }
+        except Exception as e:
+            log_error(e, context, event)
+            raise e
+    return handler
@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import metrics
+
+# CopyObject handles objects up to 5 GB in one call, bigger ones need UploadPartCopy
+MAX_SINGLE_COPY_BYTES = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = int(os.environ.get("COPY_PART_MB", "256")) * 1024 * 1024
+COPY_CONCURRENCY = int(os.environ.get("COPY_CONCURRENCY", "8"))
+MAX_PARTS = 10000
+
+# headers carried over to the multipart upload (CopyObject keeps them with MetadataDirective=COPY)
+PRESERVED_HEADERS = ("ContentType", "ContentEncoding", "ContentDisposition", "ContentLanguage", "CacheControl")
+
+
+def copy_object(s3, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str,
+                part_size: int = COPY_PART_SIZE, max_workers: int = COPY_CONCURRENCY) -> dict:
+    """
+    Server-side copy .. the object bytes never pass through the caller.
+    Content type and user metadata are kept. Returns the source HEAD response, the copy is pinned to its ETag.
+    """
+    with metrics.phase(metrics.COPY):
+        head = s3.head_object(Bucket=source_bucket, Key=source_key)
+        copy_source = {"Bucket": source_bucket, "Key": source_key}
+
+        if head["ContentLength"] <= MAX_SINGLE_COPY_BYTES:
+            s3.copy_object(
+                Bucket=dest_bucket,
+                Key=dest_key,
+                CopySource=copy_source,
+                CopySourceIfMatch=head["ETag"],
+                MetadataDirective="COPY"
+            )
+        else:
+            multipart_copy(s3, copy_source, head, dest_bucket, dest_key, part_size, max_workers)
+    # copied server-side .. the object size is what S3 read and wrote
+    metrics.add("BytesIn", head["ContentLength"], metrics.BYTES)
+    metrics.add("BytesOut", head["ContentLength"], metrics.BYTES)
+    return head
+
+
+def multipart_copy(s3, copy_source: dict, head: dict, dest_bucket: str, dest_key: str,
+                   part_size: int, max_workers: int):
+    size = head["ContentLength"]
+    part_size = max(part_size, -(-size // MAX_PARTS))
+    headers = {name: head[name] for name in PRESERVED_HEADERS if head.get(name)}
+    upload_id = s3.create_multipart_upload(
+        Bucket=dest_bucket,
+        Key=dest_key,
+        Metadata=head.get("Metadata", {}),
+        **headers
+    )["UploadId"]
+
+    def copy_part(part):
+        part_number, start = part
+        end = min(start + part_size, size) - 1
+        response = s3.upload_part_copy(
+            Bucket=dest_bucket,
+            Key=dest_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource=copy_source,
+            CopySourceRange=f"bytes={start}-{end}",
+            # every part from the version the HEAD saw .. an overwrite mid-copy fails instead of mixing versions
+            CopySourceIfMatch=head["ETag"]
+        )
+        return {"ETag": response["CopyPartResult"]["ETag"], "PartNumber": part_number}
+
+    try:
+        parts = [(number + 1, start) for number, start in enumerate(range(0, size, part_size))]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            completed = list(executor.map(copy_part, parts))
+
+        s3.complete_multipart_upload(
+            Bucket=dest_bucket,
+            Key=dest_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": completed}
+        )
+    except Exception:
+        # never leave an orphaned upload behind
+        s3.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+        raise
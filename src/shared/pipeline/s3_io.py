@@ -0,0 +1,309 @@
+import os
+from collections import deque
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pipeline import metrics
+
+# S3 rejects parts smaller than 5 MB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = int(os.environ.get("MULTIPART_PART_MB", "16")) * 1024 * 1024
+UPLOAD_CONCURRENCY = int(os.environ.get("MULTIPART_CONCURRENCY", "4"))
+
+# one GET stream tops out well below the Lambda network .. big objects are fetched as concurrent byte ranges
+RANGE_CHUNK_SIZE = int(os.environ.get("RANGE_GET_CHUNK_MB", "16")) * 1024 * 1024
+RANGE_CONCURRENCY = int(os.environ.get("RANGE_GET_CONCURRENCY", "8"))
+
+
+class MeteredBody:
+    """
+    Readable file object over a GetObject body .. reads count as the GetObject phase and BytesIn.
+    Streaming readers pull the body block by block, so download time is measured where it happens.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        with metrics.phase(metrics.GET_OBJECT):
+            data = self.body.read(size if size is not None and size >= 0 else None)
+        metrics.add("BytesIn", len(data), metrics.BYTES)
+        return data
+
+    def close(self):
+        self.body.close()
+        self.closed = True
+
+
+class S3RangeReader:
+    """
+    Readable file object that fetches an object as byte ranges on a thread pool and hands them back in order.
+    At most `concurrency` ranges are in flight or waiting, so memory stays at about concurrency * chunk_size.
+    Reads `size` bytes from `start` (the whole object by default). Every range must come back with the same
+    ETag and object size (`etag` / `object_size` when given, else those of the first range), an object
+    overwritten mid-read fails instead of mixing versions.
+    Only the time the caller waits for the next range counts as the GetObject phase.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, size: int, start: int = 0, etag: str = None,
+                 object_size: int = None, chunk_size: int = RANGE_CHUNK_SIZE, concurrency: int = RANGE_CONCURRENCY):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.ranges = deque((offset, min(offset + chunk_size, start + size) - 1)
+                            for offset in range(start, start + size, chunk_size))
+        self.concurrency = max(concurrency, 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.pending = deque()
+        self.version = (etag, object_size)
+        self.current = memoryview(b"")
+        self.offset = 0
+        self.closed = False
+        self._submit()
+        self._chunks = self.chunks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def _fetch(self, byte_range: tuple):
+        start, end = byte_range
+        # a pinned ETag makes S3 refuse (412) a newer version instead of returning it
+        conditions = {"IfMatch": self.version[0]} if self.version[0] else {}
+        response = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}", **conditions)
+        data = response["Body"].read()
+        metrics.add("BytesIn", len(data), metrics.BYTES)
+        # Content-Range: bytes <start>-<end>/<object size>
+        return (response["ETag"], int(response["ContentRange"].rsplit("/", 1)[1])), data
+
+    def _submit(self):
+        while self.ranges and len(self.pending) < self.concurrency:
+            self.pending.append(self.executor.submit(self._fetch, self.ranges.popleft()))
+
+    def chunks(self):
+        """Yield the ranges in object order."""
+        while self.pending:
+            with metrics.phase(metrics.GET_OBJECT):
+                version, data = self.pending.popleft().result()
+            self._submit()
+            expected = tuple(pinned if pinned is not None else seen for pinned, seen in zip(self.version, version))
+            if version != expected:
+                raise RuntimeError(f"s3://{self.bucket}/{self.key} changed while it was read")
+            self.version = version
+            yield data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return bytes(self.current[self.offset:]) + b"".join(self._chunks)
+
+        out = bytearray()
+        while len(out) < size:
+            if self.offset >= len(self.current):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self.current, self.offset = memoryview(chunk), 0
+            take = self.current[self.offset:self.offset + size - len(out)]
+            out += take
+            self.offset += len(take)
+        return bytes(out)
+
+    def read_into_buffer(self) -> bytearray:
+        """The whole object in one preallocated buffer .. no second copy when the ranges are joined."""
+        buffer = bytearray(self.size)
+        position = 0
+        for chunk in self._chunks:
+            buffer[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        return buffer
+
+    def close(self):
+        if self.closed:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.ranges.clear()
+        self.executor.shutdown(wait=True)
+        self.closed = True
+
+
+def open_object(s3, bucket: str, key: str, size: int = None, min_range_size: int = None):
+    """
+    Readable body of an object .. byte ranges fetched in parallel when size is known and at least
+    min_range_size, one metered GET stream otherwise.
+    """
+    if size is not None and min_range_size is not None and size >= min_range_size:
+        return S3RangeReader(s3, bucket, key, size, object_size=size)
+    with metrics.phase(metrics.GET_OBJECT):
+        response = s3.get_object(Bucket=bucket, Key=key)
+    return MeteredBody(response["Body"])
+
+
+class S3MultipartWriter:
+    """
+    Writable file object that streams into an S3 multipart upload.
+    A part is handed to a thread pool as soon as part_size bytes are buffered and uploaded while the caller keeps
+    writing. At most `concurrency` parts are in flight, so memory stays at about (concurrency + 1) parts
+    no matter how much is written. Used as a context manager the upload is aborted on error, after the parts
+    in flight have settled, so neither a partial object nor an orphaned upload is left behind.
+    Only the time the caller waits on S3 (a full pipeline, the final PUT / complete) counts as the PutObject phase.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, content_type: str = "binary/octet-stream",
+                 part_size: int = DEFAULT_PART_SIZE, metadata: dict = None,
+                 concurrency: int = UPLOAD_CONCURRENCY):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.concurrency = max(concurrency, 1)
+        self.buffer = bytearray()
+        self.position = 0
+        self.upload_id = None
+        self.executor = None
+        self.in_flight = set()
+        self.part_count = 0
+        self.parts = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed S3MultipartWriter")
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _send_part(self, part_number: int, body: bytes) -> dict:
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        metrics.add("BytesOut", len(body), metrics.BYTES)
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def _collect(self, return_when=FIRST_COMPLETED):
+        done, self.in_flight = wait(self.in_flight, return_when=return_when)
+        for future in done:
+            # a failed part raises here .. the caller's error path aborts the upload
+            self.parts.append(future.result())
+
+    def _upload_part(self, body: bytes):
+        if self.upload_id is None:
+            with metrics.phase(metrics.PUT_OBJECT):
+                response = self.s3.create_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    ContentType=self.content_type,
+                    Metadata=self.metadata
+                )
+            self.upload_id = response["UploadId"]
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        # surface failed parts early, then wait while the pipeline is full
+        if any(future.done() for future in self.in_flight):
+            self._collect(return_when=FIRST_COMPLETED)
+        while len(self.in_flight) >= self.concurrency:
+            with metrics.phase(metrics.PUT_OBJECT):
+                self._collect(return_when=FIRST_COMPLETED)
+
+        self.part_count += 1
+        self.in_flight.add(self.executor.submit(self._send_part, self.part_count, body))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                # everything fit in one part .. a plain PUT is cheaper than a multipart upload
+                with metrics.phase(metrics.PUT_OBJECT):
+                    self.s3.put_object(
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        Body=bytes(self.buffer),
+                        ContentType=self.content_type,
+                        Metadata=self.metadata
+                    )
+                metrics.add("BytesOut", len(self.buffer), metrics.BYTES)
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                with metrics.phase(metrics.PUT_OBJECT):
+                    self._collect(return_when=ALL_COMPLETED)
+                    self.s3.complete_multipart_upload(
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        UploadId=self.upload_id,
+                        MultipartUpload={"Parts": sorted(self.parts, key=lambda part: part["PartNumber"])}
+                    )
+        except Exception:
+            self.abort()
+            raise
+        self._shutdown()
+        self.buffer = bytearray()
+        self.closed = True
+
+    def _shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def abort(self):
+        # parts still uploading would otherwise land after the abort and leave storage behind
+        for future in self.in_flight:
+            future.cancel()
+        wait(self.in_flight)
+        self.in_flight = set()
+        self._shutdown()
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = bytearray()
+        self.closed = True
@@ -0,0 +1,199 @@
+"""
+Declared column types per dataset prefix.
+
+Types are written the way data_warehouse_stack/data_warehouse_data_model declares them so the
+Parquet written by the Lambdas and Glue jobs loads into Snowflake without type drift.
+pyarrow and pyspark are imported lazily .. Glue never needs pyarrow and Lambda never has pyspark.
+
+Columns declaring date_formats are read as text (yyyymmdd keys, ISO or US dates alike) and conformed to
+their yyyymmdd key with pipeline/date_keys.py, values no declared format reads unambiguously become null.
+"""
+import re
+from typing import NamedTuple
+
+from pipeline import date_keys
+
+
+class Column(NamedTuple):
+    name: str
+    sql_type: str
+    aliases: tuple = ()  # source column names that map onto this column
+    date_formats: tuple = ()  # strptime formats the dates of this column are written in (pipeline/date_keys.py)
+
+
+# claim dates arrive as yyyymmdd keys, ISO dates or US month first dates .. never day first
+CLAIMS_DATE_FORMATS = ("%Y%m%d", "%Y-%m-%d", "%m/%d/%Y")
+
+# FACT_CLAIMS (02_fact_structure.sql + BILLED_AMOUNT from 05_alter_structure.sql)
+CLAIMS_COLUMNS = [
+    Column("claim_id", "INT"),
+    Column("patient_id", "INT"),
+    Column("provider_id", "INT"),
+    Column("date_of_service", "INT", date_formats=CLAIMS_DATE_FORMATS),
+    Column("paid_date", "INT", date_formats=CLAIMS_DATE_FORMATS),
+    Column("allowed_amount", "DECIMAL(20, 2)", aliases=("amount_allowed",)),
+    Column("billed_amount", "DECIMAL(20, 2)"),
+    Column("coinsurance_amount", "DECIMAL(20, 2)"),
+    Column("deductible_amount", "DECIMAL(20, 2)"),
+    Column("paid_amount", "DECIMAL(20, 2)")
+]
+
+DATASETS = {
+    "claims/type=structured/": CLAIMS_COLUMNS,
+    "claims/type=semi-structured/": CLAIMS_COLUMNS
+}
+
+DECIMAL_PATTERN = re.compile(r"^(?:DECIMAL|NUMBER|NUMERIC)\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)$")
+
+
+def columns_for_key(object_key: str) -> list:
+    """
+    Return the declared columns for the dataset an object belongs to (longest matching prefix),
+    or None when the dataset is not registered and types have to be inferred.
+    """
+    matches = [prefix for prefix in DATASETS if prefix in object_key]
+    if not matches:
+        return None
+    return DATASETS[max(matches, key=len)]
+
+
+def date_formats_for_key(object_key: str) -> dict:
+    """column -> declared date formats of the dataset an object belongs to."""
+    return {column.name: column.date_formats for column in columns_for_key(object_key) or [] if column.date_formats}
+
+
+def arrow_type(sql_type: str):
+    import pyarrow as pa
+
+    sql_type = sql_type.upper().strip()
+    decimal = DECIMAL_PATTERN.match(sql_type)
+    if decimal:
+        return pa.decimal128(int(decimal.group(1)), int(decimal.group(2)))
+    if sql_type in ("INT", "INTEGER", "BIGINT"):
+        return pa.int64()
+    if sql_type in ("DOUBLE", "FLOAT"):
+        return pa.float64()
+    if sql_type == "BOOLEAN":
+        return pa.bool_()
+    if sql_type == "DATE":
+        return pa.date32()
+    if sql_type in ("STRING", "VARCHAR", "TEXT"):
+        return pa.string()
+    raise ValueError(f"Unsupported column type: {sql_type}")
+
+
+def spark_type(sql_type: str):
+    from pyspark.sql import types as T
+
+    sql_type = sql_type.upper().strip()
+    decimal = DECIMAL_PATTERN.match(sql_type)
+    if decimal:
+        return T.DecimalType(int(decimal.group(1)), int(decimal.group(2)))
+    if sql_type in ("INT", "INTEGER", "BIGINT"):
+        return T.LongType()
+    if sql_type in ("DOUBLE", "FLOAT"):
+        return T.DoubleType()
+    if sql_type == "BOOLEAN":
+        return T.BooleanType()
+    if sql_type == "DATE":
+        return T.DateType()
+    if sql_type in ("STRING", "VARCHAR", "TEXT"):
+        return T.StringType()
+    raise ValueError(f"Unsupported column type: {sql_type}")
+
+
+def parsed_as_date(column: Column) -> bool:
+    """Declared date column whose text is turned into its key on conform (not when read as text on purpose)."""
+    return bool(column.date_formats) and column.sql_type.upper().strip() not in ("STRING", "VARCHAR", "TEXT")
+
+
+def arrow_schema(columns: list):
+    """Explicit JSON schema .. date columns are left to inference, their values are numbers or text."""
+    import pyarrow as pa
+
+    return pa.schema([pa.field(column.name, arrow_type(column.sql_type)) for column in columns
+                      if not parsed_as_date(column)])
+
+
+def arrow_column_types(columns: list) -> dict:
+    """Column types for pyarrow.csv.ConvertOptions, including the alias names."""
+    import pyarrow as pa
+
+    column_types = {}
+    for column in columns:
+        for name in (column.name, *column.aliases):
+            # date columns are read as text, conform_arrow derives the key
+            column_types[name] = pa.string() if parsed_as_date(column) else arrow_type(column.sql_type)
+    return column_types
+
+
+def csv_convert_options(columns: list):
+    """pyarrow.csv.ConvertOptions that parse declared columns with their type instead of inferring it."""
+    import pyarrow.csv as pv
+
+    if not columns:
+        return pv.ConvertOptions()
+    return pv.ConvertOptions(column_types=arrow_column_types(columns))
+
+
+def conform_arrow(table, columns: list):
+    """
+    Rename aliases, cast declared columns, add missing ones as nulls and put them first
+    so every file of a dataset is written with the same Parquet schema.
+    Undeclared columns are kept after the declared ones.
+    """
+    import pyarrow as pa
+
+    declared = set()
+    arrays, fields = [], []
+    for column in columns:
+        target = arrow_type(column.sql_type)
+        present = [name for name in (column.name, *column.aliases) if name in table.column_names]
+        # an explicit JSON schema materialises the canonical name as nulls even when the file uses an alias
+        source = next((name for name in present if table.column(name).null_count < table.num_rows), None)
+        source = source or (present[0] if present else None)
+        if source is None:
+            array = pa.nulls(table.num_rows, type=target)
+        else:
+            array = table.column(source)
+            if parsed_as_date(column):
+                array = date_keys.date_keys(array, column.date_formats)
+            if array.type != target:
+                array = array.cast(target)
+        declared.update(present)
+        arrays.append(array)
+        fields.append(pa.field(column.name, target))
+
+    for name in table.column_names:
+        if name not in declared:
+            arrays.append(table.column(name))
+            fields.append(table.schema.field(name))
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def conform_spark(df, columns: list):
+    """Spark twin of conform_arrow .. read the CSV as strings (no inferSchema), cast by name, date columns keyed."""
+    from pyspark.sql.functions import col, lit
+
+    if any(parsed_as_date(column) for column in columns):
+        date_keys.enable_strict_parsing(df.sparkSession)
+
+    declared = set()
+    selected = []
+    for column in columns:
+        target = spark_type(column.sql_type)
+        source = next((name for name in (column.name, *column.aliases) if name in df.columns), None)
+        if source is None:
+            selected.append(lit(None).cast(target).alias(column.name))
+        elif parsed_as_date(column):
+            values = date_keys.spark_date_keys(col(f"`{source}`").cast("string"), column.date_formats)
+            selected.append(values.cast(target).alias(column.name))
+            declared.add(source)
+        else:
+            selected.append(col(f"`{source}`").cast(target).alias(column.name))
+            declared.add(source)
+
+    names = {column.name for column in columns}
+    selected += [col(f"`{name}`") for name in df.columns if name not in declared and name not in names]
+    return df.select(*selected)
@@ -0,0 +1,235 @@
+"""
+Load outcome of the files submitted to Snowpipe.
+
+insertFiles only queues files, its 200 says nothing about the load. LoadStatusPoller asks every pipe what became
+of its files, one request per pipe for all of them:
+
+    insertReport      load events of the last 10 minutes, read on from the beginMark of the previous poll
+    loadHistoryScan   load history of a time window (paged), once the files were submitted longer ago
+                      than insertReport remembers
+
+Pipes are polled concurrently with asyncio (the blocking HTTP calls run on threads). The interval adapts per pipe:
+back to MIN_INTERVAL_SECONDS as soon as a poll settles files, doubled (up to MAX_INTERVAL_SECONDS, with jitter)
+while nothing changes. Throttling (429 / 5xx) backs off the same way and honours Retry-After.
+
+A file is settled when Snowpipe reports LOADED, LOAD_FAILED or PARTIALLY_LOADED. The poll state (pending paths,
+beginMark, interval per pipe) is a plain dict so the state machine can carry it from one poll to the next:
+
+    {"state": "pending", "pipes": {<pipe url>: {"pending": [...], "beginMark": ..., "intervalSeconds": ...}},
+     "files": {"LOADED": 10, ..}, "failed": [{"path": ..., "status": ..., "firstError": ..}], "nextPollSeconds": 4}
+
+state ends as "loaded" (every file LOADED), "failed" (any file not fully loaded) or "timeout".
+"""
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pipeline import metrics
+
+LOADED = "LOADED"
+LOAD_FAILED = "LOAD_FAILED"
+PARTIALLY_LOADED = "PARTIALLY_LOADED"
+SETTLED = (LOADED, LOAD_FAILED, PARTIALLY_LOADED)
+
+MIN_INTERVAL_SECONDS = float(os.environ.get("SNOWPIPE_POLL_MIN_SECONDS", "1"))
+MAX_INTERVAL_SECONDS = float(os.environ.get("SNOWPIPE_POLL_MAX_SECONDS", "30"))
+
+# insertReport keeps the load events of the last 10 minutes
+REPORT_WINDOW_SECONDS = 600
+# loadHistoryScan windows open this long before the submission (clock skew between us and Snowflake)
+HISTORY_MARGIN_SECONDS = 300
+
+RETRYABLE = (429, 500, 502, 503, 504)
+
+# failures carried in the state .. the state machine payload is limited to 256 KB
+MAX_FAILURES = 100
+
+
+class Backoff:
+    """Poll interval of one pipe .. minimum after progress, doubled while idle or throttled, jittered."""
+
+    def __init__(self, seconds: float = None, minimum: float = MIN_INTERVAL_SECONDS,
+                 maximum: float = MAX_INTERVAL_SECONDS, factor: float = 2.0, jitter: float = 0.1, rng=random.random):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.rng = rng
+        self.interval = minimum if seconds is None else min(max(seconds, minimum), maximum)
+
+    def progress(self):
+        self.interval = self.minimum
+
+    def idle(self):
+        self.interval = min(self.interval * self.factor, self.maximum)
+
+    def throttled(self, retry_after: float = None):
+        self.idle()
+        if retry_after:
+            self.interval = max(self.interval, retry_after)
+
+    def delay(self) -> float:
+        return self.interval * (1 + self.jitter * (2 * self.rng() - 1))
+
+
+def pipe_url(insert_files_url: str) -> str:
+    """https://<account>.snowflakecomputing.com/v1/data/pipes/<pipe> of an insertFiles url."""
+    return insert_files_url.rsplit("/", 1)[0]
+
+
+def timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def parse_timestamp(text: str) -> float:
+    return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
+def retry_after(response) -> float:
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LoadStatusPoller:
+    """
+    get(url, params) returns a requests-like response (status_code, headers, text, json()), authenticated by the
+    caller. clock / sleep (a coroutine function, asyncio.sleep by default) are injectable for tests.
+    """
+
+    def __init__(self, get, clock=time.time, sleep=None):
+        self.get = get
+        self.clock = clock
+        self._sleep = sleep
+
+    async def sleep(self, seconds: float):
+        import asyncio  # only the load status Lambda polls, the insertFiles one skips the import
+
+        await (self._sleep or asyncio.sleep)(seconds)
+
+    async def request(self, url: str, params: dict, backoff: Backoff, deadline: float) -> dict:
+        """Response body, empty when throttled past the deadline (nothing learned this poll)."""
+        import asyncio
+
+        while True:
+            response = await asyncio.to_thread(self.get, url, {**params, "requestId": str(uuid.uuid4())})
+            metrics.add("StatusRequests", 1)
+            if response.status_code not in RETRYABLE:
+                break
+            metrics.add("StatusThrottled", 1)
+            backoff.throttled(retry_after(response))
+            delay = backoff.delay()
+            if self.clock() + delay > deadline:
+                return {}
+            await self.sleep(delay)
+
+        if response.status_code != 200:
+            raise Exception(f"Snowpipe load status failed: {response.status_code} - {response.text}")
+        return response.json()
+
+    async def insert_report(self, pipe: str, state: dict, backoff: Backoff, deadline: float) -> list:
+        params = {"beginMark": state["beginMark"]} if state.get("beginMark") else {}
+        body = await self.request(f"{pipe}/insertReport", params, backoff, deadline)
+        state["beginMark"] = body.get("nextBeginMark") or state.get("beginMark")
+        return body.get("files", [])
+
+    async def load_history(self, pipe: str, start: float, end: float, backoff: Backoff, deadline: float) -> list:
+        files = []
+        params = {"startTimeInclusive": timestamp(start), "endTimeExclusive": timestamp(end)}
+        while True:
+            body = await self.request(f"{pipe}/loadHistoryScan", params, backoff, deadline)
+            files += body.get("files", [])
+            # an incomplete result pages on from the last load it covered
+            if body.get("completeResult", True) or body.get("rangeEndTime") in (None, params["startTimeInclusive"]):
+                return files
+            params = {**params, "startTimeInclusive": body["rangeEndTime"]}
+
+    async def poll_pipe(self, pipe: str, state: dict, submitted_at: float, deadline: float) -> dict:
+        """Settled files of one pipe ({path: report entry}), polled until none is pending or deadline."""
+        pending = set(state["pending"])
+        backoff = Backoff(state.get("intervalSeconds"))
+        settled = {}
+        while pending:
+            now = self.clock()
+            if now - submitted_at >= REPORT_WINDOW_SECONDS:
+                files = await self.load_history(pipe, submitted_at - HISTORY_MARGIN_SECONDS, now + 1, backoff,
+                                                deadline)
+            else:
+                files = await self.insert_report(pipe, state, backoff, deadline)
+
+            progressed = False
+            for entry in files:
+                path = entry.get("path")
+                if path in pending and entry.get("status") in SETTLED:
+                    settled[path] = entry
+                    pending.discard(path)
+                    progressed = True
+            if progressed:
+                backoff.progress()
+            else:
+                backoff.idle()
+
+            delay = backoff.delay()
+            if not pending or self.clock() + delay > deadline:
+                break
+            await self.sleep(delay)
+
+        state["pending"] = sorted(pending)
+        state["intervalSeconds"] = backoff.interval
+        return settled
+
+    async def poll_all(self, pipes: dict, submitted_at: float, deadline: float) -> dict:
+        import asyncio
+
+        pending = {pipe: state for pipe, state in pipes.items() if state["pending"]}
+        results = await asyncio.gather(*(self.poll_pipe(pipe, state, submitted_at, deadline)
+                                         for pipe, state in pending.items()))
+        return {path: entry for settled in results for path, entry in settled.items()}
+
+    def poll(self, pipes: dict, submitted_at: float, seconds: float) -> dict:
+        """Poll every pipe for up to seconds, pipes (the state's pipes) are updated in place."""
+        import asyncio
+
+        return asyncio.run(self.poll_all(pipes, submitted_at, self.clock() + seconds))
+
+
+def new_status(paths_per_pipe: dict) -> dict:
+    return {
+        "state": "pending",
+        "pipes": {pipe: {"pending": sorted(paths), "beginMark": None, "intervalSeconds": MIN_INTERVAL_SECONDS}
+                  for pipe, paths in paths_per_pipe.items()},
+        "files": {},
+        "failed": [],
+        "lastLoadAt": None,
+        "nextPollSeconds": int(MIN_INTERVAL_SECONDS)
+    }
+
+
+def update(status: dict, settled: dict, submitted_at: float, now: float, timeout_seconds: float) -> dict:
+    """Fold newly settled files into the status and decide its state."""
+    for path, entry in settled.items():
+        outcome = entry["status"]
+        status["files"][outcome] = status["files"].get(outcome, 0) + 1
+        metrics.add(f"Files{outcome.title().replace('_', '')}", 1)
+        metrics.add("RowsInserted", entry.get("rowsInserted") or 0)
+        if outcome != LOADED and len(status["failed"]) < MAX_FAILURES:
+            status["failed"].append({"path": path, "status": outcome, "firstError": entry.get("firstError")})
+        if entry.get("lastInsertTime"):
+            loaded_at = parse_timestamp(entry["lastInsertTime"])
+            status["lastLoadAt"] = max(status["lastLoadAt"] or loaded_at, loaded_at)
+
+    pending = [state for state in status["pipes"].values() if state["pending"]]
+    if pending:
+        # failures are reported once every file settled, so one run lists all of them
+        status["state"] = "timeout" if now - submitted_at >= timeout_seconds else "pending"
+        # Wait states take whole seconds
+        status["nextPollSeconds"] = max(1, round(min(state["intervalSeconds"] for state in pending)))
+    else:
+        status["state"] = "loaded" if set(status["files"]) <= {LOADED} else "failed"
+        if status["lastLoadAt"] is not None:
+            # submission to the last load .. files / LoadMs is the pipe throughput
+            metrics.add("LoadMs", max(status["lastLoadAt"] - submitted_at, 0) * 1000, metrics.MILLISECONDS)
+    return status